@@ -1,18 +1,46 @@
-import glob
+import importlib
+import itertools
 import os
 import logging
 import platform
-import subprocess
 import threading
-from tkinter import END, Entry, OptionMenu, Toplevel, messagebox, StringVar, Text, Label, Button, Frame, Canvas, Scrollbar, filedialog, Listbox, MULTIPLE
-from collections import defaultdict
-from PIL import Image, ImageTk
-from document_generator import create_document, add_image_to_doc
-from help_feedback import open_help, open_feedback
+from tkinter import END, Entry, OptionMenu, PhotoImage, Toplevel, messagebox, StringVar, Text, Label, Button, Frame, Canvas, Scrollbar, filedialog, Listbox, MULTIPLE
+from cost_scheduler import default_memory_budget
+from dedupe import DedupeOptions
+from image_prep import ImagePrepOptions
+from output_stage import OutputStage
+from image_grouping import IMAGE_TYPES, compile_images, group_images
+from folder_index import FolderIndex
+from folder_discovery import discover_image_folders
+from thumbnail_cache import THUMBNAIL_SIZE, ThumbnailCache
+from thumbnail_loader import ThumbnailLoader
+from job_scheduler import GenerationScheduler
+import instrumentation
 from preferences import load_preferences, save_preferences
 
-# Set up logging
-logging.basicConfig(filename='app.log', level=logging.ERROR)
+# Set up logging; records are written by a background thread so workers never block on the file.
+# WORDGEN_TRACE_FILE / WORDGEN_METRICS_FILE turn on the JSON-lines trace and Prometheus export.
+instrumentation.configure('app.log', logging.ERROR, trace_file=os.environ.get('WORDGEN_TRACE_FILE'))
+
+# Heavy modules the window does not need to come up (PIL, python-docx, the feedback mailer, ...).
+# Each is imported where it is first used; warm_up_imports loads them in the background once the
+# first frame is on screen, so that first use is usually instant as well.
+WARM_UP_MODULES = (
+    "PIL.Image",
+    "PIL.ImageTk",
+    "image_grid",
+    "parallel_generator",
+    "help_feedback",
+)
+WARM_UP_DELAY_MS = 200
+
+
+def warm_up_imports(modules=WARM_UP_MODULES):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logging.error(f"Error preloading {name}: {e}")
 
 class DemoWindow:
     def __init__(self, parent):
@@ -38,6 +66,7 @@ class DemoWindow:
         if platform.system() == "Windows":
             # Use taskkill to close Microsoft Word
             try:
+                import subprocess
                 subprocess.call(["taskkill", "/F", "/IM", "WINWORD.EXE"])
             except Exception as e:
                 print(f"Error closing Word documents: {e}")
@@ -55,10 +84,26 @@ class MultiFolderDialog:
         self.top.lift()  # Raise the dialog above other windows
 
         self.selected_folders = []
+        self.selected_trees = []  # Roots whose image folders are found (recursively) at generation time
+        self.include_patterns = []
+        self.exclude_patterns = []
+        self.entries = []  # (is_tree, path) in listbox order
         self.folder_listbox = Listbox(self.top, selectmode=MULTIPLE)
         self.folder_listbox.pack(fill='both', expand=True, padx=10, pady=10)
 
         Button(self.top, text="Add Folder", command=self.add_folder).pack(pady=5)
+        Button(self.top, text="Add Tree", command=self.add_tree).pack(pady=5)
+
+        # Comma-separated globs matched against folder names or paths below a tree
+        filter_frame = Frame(self.top)
+        filter_frame.pack(pady=5)
+        Label(filter_frame, text="Include:").grid(row=0, column=0, sticky="e")
+        self.include_entry = Entry(filter_frame, width=25)
+        self.include_entry.grid(row=0, column=1, padx=5)
+        Label(filter_frame, text="Exclude:").grid(row=1, column=0, sticky="e")
+        self.exclude_entry = Entry(filter_frame, width=25)
+        self.exclude_entry.grid(row=1, column=1, padx=5)
+
         Button(self.top, text="Remove Selected", command=self.remove_selected).pack(pady=5)
         Button(self.top, text="OK", command=self.ok).pack(pady=5)
 
@@ -66,33 +111,75 @@ class MultiFolderDialog:
         folder_path = filedialog.askdirectory(mustexist=True)
         if folder_path and folder_path not in self.selected_folders:
             self.selected_folders.append(folder_path)
+            self.entries.append((False, folder_path))
             self.folder_listbox.insert(END, folder_path)
 
+    def add_tree(self):
+        folder_path = filedialog.askdirectory(mustexist=True)
+        if folder_path and folder_path not in self.selected_trees:
+            self.selected_trees.append(folder_path)
+            self.entries.append((True, folder_path))
+            self.folder_listbox.insert(END, f"{folder_path} (all subfolders)")
+
     def remove_selected(self):
         selected_indices = self.folder_listbox.curselection()
         for index in reversed(selected_indices):
-            del self.selected_folders[index]
+            is_tree, path = self.entries.pop(index)
+            (self.selected_trees if is_tree else self.selected_folders).remove(path)
             self.folder_listbox.delete(index)
 
     def ok(self):
+        self.include_patterns = parse_patterns(self.include_entry.get())
+        self.exclude_patterns = parse_patterns(self.exclude_entry.get())
         self.top.destroy()
 
 
+def parse_patterns(text):
+    return [pattern.strip() for pattern in text.split(",") if pattern.strip()]
+
+
 class ImageToWordApp:
-    def __init__(self, root):
+    def __init__(self, root, warm_up=True):
         self.root = root
         self.root.title("Image to Word Document Generator")
         self.root.geometry("600x400")
         self.image_folders = []  # List to hold selected folders
-        self.notes = {}
+        self.image_trees = []  # Folders searched recursively for image folders when generating
+        self.tree_include = []  # Globs a discovered folder must match (empty = all)
+        self.tree_exclude = []  # Globs of folders not to descend into
+        self.unreadable_folders = []  # Filled on the batch thread, shown when the batch is done
+        self.notes = {}  # title -> note text, as last saved from the preview
+        self.note_entries = {}  # title -> the preview's Text widget for the note
         self.layout_choices = {}
-        self.image_types = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+        self.image_types = IMAGE_TYPES
+        self.folder_index = FolderIndex(self.image_types)  # Folder listings shared by preview and generation
         self.max_image_width = 5  # Default maximum image width
+        self.max_workers = None  # Worker processes used for generation (None = CPU count)
+        self.image_options = ImagePrepOptions()  # Resample images to 200 DPI before embedding
+        self.incremental = True  # Skip folders whose document is up to date with its images
+        self.streaming_output = False  # Write documents incrementally instead of building them in memory
+        self.dedupe = DedupeOptions()  # 'flag' or 'drop' repeated screenshots within a title group
+        self.output_stage = OutputStage()  # Build on local scratch space, then copy to the folders in the background
+        self.append_mode = False  # Add new images to existing documents instead of rebuilding them
+        self.memory_budget = default_memory_budget()  # Bytes the running folders may need together (None = no limit)
+        self.volume_limits = None  # VolumeLimits: split folders too large for one document into parts
 
         self.preview_window = None  # To keep track of the preview window
+        self.preview_grids = {}  # title -> one VirtualImageGrid per folder, re-laid out on layout changes
+        self.viewport_update_pending = False
+        self.thumbnail_cache = ThumbnailCache()  # Survives preview windows so reopening is instant
+        self.thumbnail_loader = ThumbnailLoader(self.root, self.thumbnail_cache)  # Decodes off the Tk thread
+        self.scheduler = GenerationScheduler(self.root)  # Runs generation batches and reports back on the Tk thread
         self.create_widgets()
         load_preferences()  # Load user preferences on start
 
+        if warm_up:
+            # after() callbacks only run once the main loop is drawing, i.e. after the first frame
+            self.root.after(WARM_UP_DELAY_MS, self.start_warm_up)
+
+    def start_warm_up(self):
+        threading.Thread(target=warm_up_imports, name="import-warm-up", daemon=True).start()
+
     def create_widgets(self):
         # Create a central frame for the content
         content_frame = Frame(self.root)
@@ -106,9 +193,16 @@ class ImageToWordApp:
         self.button_generate = Button(content_frame, text="Generate Documents", command=self.generate_documents, state="disabled", font=("Arial", 12), bg="lightgreen")
         self.button_generate.pack(pady=10, anchor="center")
 
-        Button(content_frame, text="Help", command=lambda: open_help(self.root), font=("Arial", 12), bg="lightgrey").pack(pady=5, anchor="center")
+        batch_frame = Frame(content_frame)
+        batch_frame.pack(anchor="center")
+        self.button_pause = Button(batch_frame, text="Pause", command=self.toggle_pause, state="disabled", font=("Arial", 10))
+        self.button_pause.pack(side="left", padx=5)
+        self.button_cancel = Button(batch_frame, text="Cancel", command=self.cancel_generation, state="disabled", font=("Arial", 10))
+        self.button_cancel.pack(side="left", padx=5)
+
+        Button(content_frame, text="Help", command=self.open_help, font=("Arial", 12), bg="lightgrey").pack(pady=5, anchor="center")
         Button(content_frame, text="Demo", command=self.start_demo, font=("Arial", 12), bg="red").pack(pady=5, anchor="center")
-        Button(content_frame, text="Feedback", command=lambda: open_feedback(self.root), font=("Arial", 12), bg="lightgrey").pack(pady=5, anchor="center")
+        Button(content_frame, text="Feedback", command=self.open_feedback, font=("Arial", 12), bg="lightgrey").pack(pady=5, anchor="center")
 
         self.status_label = Label(content_frame, text="", font=("Arial", 10))
         self.status_label.pack(pady=5, anchor="center")
@@ -116,6 +210,14 @@ class ImageToWordApp:
     def update_status(self, message):
         self.status_label.config(text=message)
 
+    def open_help(self):
+        from help_feedback import open_help
+        open_help(self.root)
+
+    def open_feedback(self):
+        from help_feedback import open_feedback
+        open_feedback(self.root)
+
     def select_folders(self):
         # Get the current position of the root window
         root_x = self.root.winfo_x()
@@ -130,13 +232,22 @@ class ImageToWordApp:
         
         self.root.wait_window(dialog.top)  # Wait for the dialog to close
         self.image_folders = dialog.selected_folders
+        self.image_trees = dialog.selected_trees
+        self.tree_include = dialog.include_patterns
+        self.tree_exclude = dialog.exclude_patterns
 
-        if self.image_folders:
+        if self.image_folders or self.image_trees:
             self.button_generate.config(state="normal")  # Enable document generation button
-            self.update_status(f"Selected {len(self.image_folders)} folder(s).")
+            trees = f" and {len(self.image_trees)} folder tree(s)" if self.image_trees else ""
+            self.update_status(f"Selected {len(self.image_folders)} folder(s){trees}.")
+        if self.image_folders:
+            # Trees can hold thousands of folders; they are only walked when generating
             self.show_preview()
 
     def show_preview(self):
+        # Drop whatever the previous preview was still loading
+        self.close_preview()
+
         # Get the current position of the root window
         root_x = self.root.winfo_x()
         root_y = self.root.winfo_y()
@@ -147,14 +258,18 @@ class ImageToWordApp:
         self.preview_window.title("Image Preview")
         self.preview_window.geometry(f"700x500+{root_x + root_width + 10}+{root_y}")
         self.preview_window.resizable(True, True)
+        self.preview_window.protocol("WM_DELETE_WINDOW", self.close_preview)
+        # Shown in place of each thumbnail until it has been decoded
+        self.placeholder_image = PhotoImage(width=THUMBNAIL_SIZE[0], height=THUMBNAIL_SIZE[1])
 
         self.canvas = Canvas(self.preview_window)
         scrollbar = Scrollbar(self.preview_window, command=self.canvas.yview)
         self.scrollable_frame = Frame(self.canvas)
 
-        self.scrollable_frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        self.scrollable_frame.bind("<Configure>", self.on_preview_frame_configure)
         self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.configure(yscrollcommand=lambda first, last: self.on_preview_scroll(scrollbar, first, last))
+        self.canvas.bind("<Configure>", lambda e: self.schedule_viewport_update())
 
         scrollbar.pack(side="right", fill="y")
         self.canvas.pack(side="left", fill="both", expand=True)
@@ -177,19 +292,16 @@ class ImageToWordApp:
     def load_images_with_folders(self):
         # Clear previous notes and layout choices before loading new images
         self.notes.clear()
+        self.note_entries.clear()
         self.layout_choices.clear()
+        self.preview_grids.clear()
 
         for folder in self.image_folders:  # Loop through each selected folder
             folder_name = os.path.basename(folder)
             Label(self.scrollable_frame, text=f"Folder: {folder_name}", font=("Arial", 14, "bold")).pack(pady=10, anchor="w")
 
-            images_dict = defaultdict(list)
             try:
-                for filename in os.listdir(folder):
-                    if filename.lower().endswith(self.image_types):
-                        image_path = os.path.join(folder, filename)
-                        title = filename.split('_')[0]
-                        images_dict[title].append(image_path)
+                images_dict = group_images(folder, self.image_types, self.folder_index)
 
                 for title, image_paths in images_dict.items():
                     self.add_image_controls_for_folder(title, image_paths)
@@ -211,7 +323,7 @@ class ImageToWordApp:
 
         note_entry = Text(title_frame, height=3, width=40, wrap='word', font=("Arial", 12))
         note_entry.pack(pady=5, anchor="w")
-        self.notes[title] = note_entry
+        self.note_entries[title] = note_entry
 
         self.preview_images_for_folder(title_frame, title, image_paths)
 
@@ -219,40 +331,49 @@ class ImageToWordApp:
         layout = self.layout_choices[title].get()
         columns = 2 if layout == "Two Columns" else 1
 
-        preview_frame = Frame(frame)
-        preview_frame.pack(pady=5, anchor="w")
-
-        for i, image_path in enumerate(image_paths):
-            try:
-                img = Image.open(image_path)
-                img.thumbnail((100, 100))  # Thumbnail for uniform image size
-                img_tk = ImageTk.PhotoImage(img)
-
-                label = Label(preview_frame, image=img_tk)
-                label.image = img_tk  # Keep a reference
-                label.grid(row=i // columns, column=i % columns, padx=5, pady=5)
-
-            except Exception as e:
-                logging.error(f"Error loading image {image_path}: {e}")
-                messagebox.showerror("Error", f"Could not load image {image_path}. Please check the file.")
+        from image_grid import VirtualImageGrid  # Needs PIL.ImageTk, so loaded with the first preview
+        grid = VirtualImageGrid(frame, image_paths, columns, self.thumbnail_loader, self.placeholder_image)
+        self.preview_grids.setdefault(title, []).append(grid)
+        self.schedule_viewport_update()
+
+    def on_preview_frame_configure(self, event):
+        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        # Group sizes or positions changed, so different cells may now be visible
+        self.schedule_viewport_update()
+
+    def on_preview_scroll(self, scrollbar, first, last):
+        scrollbar.set(first, last)
+        self.schedule_viewport_update()
+
+    def schedule_viewport_update(self):
+        # Coalesce bursts of scroll/resize events into one update per idle cycle
+        if not self.viewport_update_pending:
+            self.viewport_update_pending = True
+            self.root.after_idle(self.update_visible_previews)
+
+    def update_visible_previews(self):
+        self.viewport_update_pending = False
+        if self.preview_window is None or not self.canvas.winfo_exists():
+            return
+        for grids in self.preview_grids.values():
+            for grid in grids:
+                grid.update_viewport(self.canvas)
+
+    def close_preview(self):
+        # Cancel pending thumbnail work before the labels it would fill disappear
+        self.thumbnail_loader.cancel()
+        self.preview_grids.clear()
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.preview_window.destroy()
+        self.preview_window = None
 
     def refresh_preview(self, title):
-        for widget in self.scrollable_frame.winfo_children():
-            if isinstance(widget, Frame) and widget.winfo_children()[0].cget("text") == title:
-                for subwidget in widget.winfo_children():
-                    if isinstance(subwidget, Frame):
-                        subwidget.destroy()
-
-                # Reload images based on the title and selected folders
-                image_paths = [
-                    os.path.join(folder, filename) 
-                    for folder in self.image_folders 
-                    for filename in os.listdir(folder) 
-                    if filename.lower().endswith(self.image_types) and filename.startswith(title)
-                ]
-                self.preview_images_for_folder(widget, title, image_paths)
-                break
-            
+        # Only the cell positions change with the layout; visible thumbnails are reused as they are
+        columns = 2 if self.layout_choices[title].get() == "Two Columns" else 1
+        for grid in self.preview_grids.get(title, []):
+            grid.set_columns(columns)
+        self.schedule_viewport_update()
+
     def on_save_apply(self):
         try:
             self.max_image_width = float(self.max_width_entry.get())
@@ -260,64 +381,135 @@ class ImageToWordApp:
             messagebox.showwarning("Invalid Input", "Please enter a valid number for max image width.")
             return
 
-        # Save the notes as actual string values instead of widget references
-        for title, note_widget in self.notes.items():
-            if isinstance(note_widget, Text):
-                self.notes[title] = note_widget.get("1.0", END).strip()
+        # Only text goes into the documents, never the widgets
+        for title, note_entry in self.note_entries.items():
+            self.notes[title] = note_entry.get("1.0", END).strip()
 
         save_preferences()
         messagebox.showinfo("Success", "Settings have been saved!")
-        self.preview_window.destroy()
-
+        self.close_preview()
 
 
-    def generate_documents(self):
-        self.update_status("Generating documents...")     
-        threading.Thread(target=self.create_documents).start()
 
+    def generate_documents(self, folders=None):
+        # Runs on the Tk thread; the scheduler keeps the build itself off it
+        if self.scheduler.running:
+            return  # A batch is already running (e.g. a double-click)
 
-    def create_documents(self):
-        for folder in self.image_folders:
+        trees = []
+        if folders is None:
+            folders, trees = self.image_folders, self.image_trees
+        if not folders and not trees:
+            return
+        # Layout choices are Tk variables, so they are read here and not on the batch thread
+        layouts = {title: layout_var.get() for title, layout_var in self.layout_choices.items()}
+        self.unreadable_folders = []
+        jobs = self.iter_jobs(list(folders), list(trees), layouts, dict(self.notes))
+
+        # Workers never show dialogs; the output stage retries or versions locked outputs, and any still failing
+        # come back as results that are offered for retry from on_generation_done
+        self.scheduler.start(jobs, self.max_image_width, on_progress=self.on_generation_progress,
+                             on_result=self.on_document_result, on_done=self.on_generation_done,
+                             max_workers=self.max_workers, incremental=self.incremental,
+                             image_options=self.image_options, streaming=self.streaming_output, dedupe=self.dedupe,
+                             output_stage=self.output_stage, append=self.incremental and self.append_mode,
+                             memory_budget=self.memory_budget, largest_first=True, volumes=self.volume_limits,
+                             metrics_file=os.environ.get('WORDGEN_METRICS_FILE'))
+        self.set_generation_controls(running=True)
+        self.update_status("Generating documents...")
+
+    def iter_jobs(self, folders, trees, layouts, notes):
+        """Yields (folder, output_file, images_dict) jobs; consumed on the batch thread, so no widgets here."""
+        folder_layouts = [(folder, None) for folder in folders]
+        if trees:
+            # Discovered folders were never previewed, so every title gets the default layout
+            discovered = discover_image_folders(trees, self.image_types, self.tree_include, self.tree_exclude)
+            folder_layouts = itertools.chain(folder_layouts, ((folder, "Single Column") for folder in discovered))
+
+        for folder, default_layout in folder_layouts:
             try:
                 # Compile images and related data specific to this folder
-                images_dict = self.compile_images(folder)
-
-                # Create an output file path based on the folder name
-                folder_name = os.path.basename(folder)
-                output_file = f"{folder_name}.docx"  # Set the output file name and path
-                output_file_path = os.path.join(folder, output_file)  # Full path to the output file
-
-                # Call create_document with the correct order of arguments
-                create_document(output_file_path, images_dict, self.max_image_width)
-
-                self.update_status(f"Document created: {output_file_path}")
-
-                # Open the document
-                os.startfile(output_file_path)
-
+                images_dict = compile_images(folder, layouts, notes, self.image_types, default_layout,
+                                             index=self.folder_index)
             except Exception as e:
                 logging.error(f"Error creating document for folder {folder}: {e}")
-                messagebox.showerror("Error", f"Could not create document for {folder}. Please check the folder.")
-
-    def compile_images(self, folder):
-        images_dict = defaultdict(lambda: {'image_paths': [], 'note': '', 'layout': 'Single Column'})
-
-        # Go through each image in the folder and match it to the corresponding title and note
-        for filename in os.listdir(folder):
-            if filename.lower().endswith(self.image_types):
-                image_path = os.path.join(folder, filename)
-                title = filename.split('_')[0]  # Extract title from image filename (before the first '_')
+                self.unreadable_folders.append(folder)
+                continue
+
+            # Create an output file path based on the folder name
+            folder_name = os.path.basename(os.path.normpath(folder))
+            output_file_path = os.path.join(folder, f"{folder_name}.docx")  # Full path to the output file
+            yield folder, output_file_path, images_dict
+
+    def set_generation_controls(self, running):
+        self.button_generate.config(state="disabled" if running else "normal")
+        self.button_pause.config(state="normal" if running else "disabled", text="Pause")
+        self.button_cancel.config(state="normal" if running else "disabled")
+
+    def toggle_pause(self):
+        if self.scheduler.progress.paused:
+            self.scheduler.resume()
+            self.button_pause.config(text="Pause")
+        else:
+            self.scheduler.pause()
+            self.button_pause.config(text="Resume")
+
+    def cancel_generation(self):
+        self.scheduler.cancel()
+        self.button_pause.config(state="disabled")
+        self.button_cancel.config(state="disabled")
+        self.update_status("Canceling...")
+
+    def on_generation_progress(self, progress):
+        if self.scheduler.running and not self.scheduler.control.canceled:
+            self.update_status(progress.status_text())
+
+    def on_document_result(self, result):
+        # Called for each folder as soon as its worker finishes
+        if result.skipped:
+            self.update_status(f"Up to date: {result.output_file}")
+        elif result.ok:
+            if result.versioned:
+                self.update_status(f"Document was open, saved as: {result.output_file} ({result.elapsed:.1f}s)")
+            elif result.appended:
+                self.update_status(f"New images added to: {result.output_file} ({result.elapsed:.1f}s)")
+            else:
+                self.update_status(f"Document created: {result.output_file} ({result.elapsed:.1f}s)")
 
-                # If the title exists in layout_choices, proceed
-                if title in self.layout_choices:
-                    images_dict[title]['image_paths'].append(image_path)
-                    images_dict[title]['layout'] = self.layout_choices[title].get()
+            # Open the document
+            try:
+                os.startfile(result.output_file)
+            except Exception as e:
+                logging.error(f"Error opening document {result.output_file}: {e}")
 
-                    # Only add the note if it exists in the self.notes dictionary
-                    if title in self.notes:
-                        images_dict[title]['note'] = self.notes[title]
+    def on_generation_done(self, summary):
+        self.set_generation_controls(running=False)
+        if summary is None:
+            self.update_status("Generation failed.")
+            messagebox.showerror("Error", "Could not create documents. Please check app.log.")
+            return
 
-        return images_dict
+        self.update_status(summary.headline())
+        # The status line only has room for the headline; the per-folder timings go to app.log
+        logging.getLogger(instrumentation.REPORT_LOGGER).info(summary.report())
+
+        locked = [result for result in summary.failed if result.locked]
+        failed = [result.folder for result in summary.failed if not result.locked] + self.unreadable_folders
+        failed = list(dict.fromkeys(failed))  # A folder split into volumes can fail more than once
+        if failed:
+            failed_folders = "\n".join(failed)
+            messagebox.showerror("Error", f"Could not create documents for:\n{failed_folders}\nPlease check the folders.")
+        if locked:
+            locked_files = "\n".join(result.output_file for result in locked)
+            if messagebox.askretrycancel("Permission Denied",
+                                         f"These files are already open:\n{locked_files}\nPlease close them and try again."):
+                self.generate_documents(list(dict.fromkeys(result.folder for result in locked)))
+
+        duplicates = [f"{os.path.basename(duplicate)} duplicates {os.path.basename(kept)}"
+                      for result in summary.succeeded for duplicate, kept, _ in result.duplicates]
+        if duplicates and self.dedupe.mode == 'flag':
+            more = f"\n... and {len(duplicates) - 20} more" if len(duplicates) > 20 else ""
+            messagebox.showinfo("Duplicate Images", "These images repeat an earlier one:\n" + "\n".join(duplicates[:20]) + more)
 
     def start_demo(self):
         # Cleanup demo files first
@@ -379,7 +571,7 @@ class ImageToWordApp:
 
     def close_demo_windows(self):
         if self.preview_window:
-            self.preview_window.destroy()  # Close the preview window if open
+            self.close_preview()  # Close the preview window if open
         # if self.demo_window:
         #     self.demo_window.top.destroy()  # Close the demo window
         self.update_status("Reset all demo windows.")
@@ -455,7 +647,7 @@ class ImageToWordApp:
 
     def demo_generate_documents(self):
         self.update_status("Simulating document generation...")
-        threading.Thread(target=self.create_documents).start()
+        self.generate_documents()
 
     def cleanup_demo_files(self, folders):
         # Loop through each folder provided
@@ -464,6 +656,7 @@ class ImageToWordApp:
             pattern = os.path.join(folder, "*.docx")
             
             # Get a list of all .docx files in the current folder
+            import glob
             generated_files = glob.glob(pattern)
             
             # Check if any files are found
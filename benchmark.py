@@ -0,0 +1,354 @@
+"""Performance benchmarks for the generation pipeline.
+
+    python benchmark.py run --images 200 --resolution 1920x1080 --output bench.json
+    python benchmark.py run --baseline bench.json      # exits 1 on a regression
+    python benchmark.py generate OUT_DIR --images 500  # synthetic folder only
+    python benchmark.py startup --repeat 5             # time to first window
+
+Each stage runs in a fresh process so peak memory figures do not leak between
+stages. Results are written as JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from synthetic_folders import FORMAT_EXTENSIONS, generate_folder, parse_resolution
+
+DEFAULT_TOLERANCE = 0.25  # Fraction slower than the baseline that counts as a regression
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a fresh interpreter per sample, like a user launching main.py. Prints the
+# time until `import app` returns and until the main window has drawn its first frame
+# (skipped when there is no display).
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import tkinter
+from app import ImageToWordApp
+result = {'import_app': time.perf_counter() - start}
+try:
+    root = tkinter.Tk()
+except tkinter.TclError:
+    root = None
+if root is not None:
+    ImageToWordApp(root, warm_up=False)
+    root.update()
+    result['first_window'] = time.perf_counter() - start
+    root.destroy()
+print(json.dumps(result))
+"""
+
+
+class Stopwatch:
+    """Accumulates the time and traced peak memory spent inside `with` blocks."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.peak_traced = 0
+
+    def __enter__(self):
+        tracemalloc.reset_peak()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self._start
+        self.peak_traced = max(self.peak_traced, tracemalloc.get_traced_memory()[1])
+
+
+def _image_options(dpi):
+    from image_prep import ImagePrepOptions
+    # No cache, so every run measures the real resampling cost
+    return ImagePrepOptions(dpi=dpi or None, cache_dir=None)
+
+
+def _images_dict(folder, layout):
+    from image_grouping import compile_images
+    return compile_images(folder, {}, {}, default_layout=layout)
+
+
+def stage_scan(folder, dpi, stopwatch):
+    from folder_index import FolderIndex
+    with stopwatch:
+        groups = FolderIndex().groups(folder)
+    return sum(len(paths) for paths in groups.values())
+
+
+def stage_compile_images(folder, dpi, stopwatch):
+    from image_grouping import compile_images
+    with stopwatch:
+        images_dict = compile_images(folder, {}, {}, default_layout="Single Column")
+    return images_dict.image_count()
+
+
+def stage_thumbnails(folder, dpi, stopwatch):
+    # What preview_images_for_folder pays on a cold cache
+    from thumbnail_cache import ThumbnailCache
+    paths = [path for group in _images_dict(folder, "Single Column").values() for path in group.image_paths]
+    cache = ThumbnailCache(disk_dir=None)
+    with stopwatch:
+        for path in paths:
+            cache.get(path)
+    return len(paths)
+
+
+def _stage_build(layout):
+    def stage(folder, dpi, stopwatch):
+        from document_generator import build_document
+        images_dict = _images_dict(folder, layout)
+        with stopwatch:
+            build_document(os.path.join(folder, "bench.docx"), images_dict, 5, image_options=_image_options(dpi))
+        return images_dict.image_count()
+    return stage
+
+
+def stage_save(folder, dpi, stopwatch):
+    from document_generator import build_document
+    images_dict = _images_dict(folder, "Single Column")
+    doc = build_document(os.path.join(folder, "bench.docx"), images_dict, 5, image_options=_image_options(dpi))
+    with tempfile.TemporaryDirectory() as scratch:
+        with stopwatch:
+            doc.save(os.path.join(scratch, "bench.docx"))
+    return images_dict.image_count()
+
+
+def stage_streaming(folder, dpi, stopwatch):
+    from document_generator import create_document
+    images_dict = _images_dict(folder, "Single Column")
+    with tempfile.TemporaryDirectory() as scratch:
+        with stopwatch:
+            create_document(os.path.join(scratch, "bench.docx"), images_dict, 5, image_options=_image_options(dpi), streaming=True)
+    return images_dict.image_count()
+
+
+STAGES = {
+    'scan': stage_scan,
+    'compile_images': stage_compile_images,
+    'thumbnails': stage_thumbnails,
+    'build_one_column': _stage_build("Single Column"),
+    'build_two_columns': _stage_build("Two Columns"),
+    'save': stage_save,
+    'streaming_create_document': stage_streaming,
+}
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_stage_in_process(name, folder, dpi):
+    # Entry point of the per-stage child process
+    tracemalloc.start()
+    stopwatch = Stopwatch()
+    images = STAGES[name](folder, dpi, stopwatch)
+    return {
+        'seconds': round(stopwatch.seconds, 4),
+        'images': images,
+        'peak_traced_mb': round(stopwatch.peak_traced / (1024 * 1024), 1),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def folder_bytes(folder):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+
+
+def run_benchmarks(folder, stages, repeat=1, dpi=200):
+    input_mb = folder_bytes(folder) / (1024 * 1024)
+    results = {}
+    for name in stages:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                runs.append(executor.submit(run_stage_in_process, name, folder, dpi).result())
+        best = min(runs, key=lambda run: run['seconds'])
+        seconds = max(best['seconds'], 1e-9)
+        best['images_per_second'] = round(best['images'] / seconds, 1)
+        best['mb_per_second'] = round(input_mb / seconds, 1)
+        results[name] = best
+        print(f"{name:28s} {best['seconds']:8.3f}s  {best['images_per_second']:9.1f} img/s  "
+              f"peak rss {best['peak_rss_mb']} MB", file=sys.stderr, flush=True)
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('stages', {}).get(name)
+        if not previous or not previous['seconds']:
+            continue
+        change = result['seconds'] / previous['seconds'] - 1
+        result['change_vs_baseline'] = round(change, 3)
+        if change > tolerance:
+            regressions.append(f"{name}: {previous['seconds']:.3f}s -> {result['seconds']:.3f}s ({change:+.0%})")
+    return regressions
+
+
+def run(args):
+    stages = args.stages or list(STAGES)
+    unknown = [name for name in stages if name not in STAGES]
+    if unknown:
+        print(f"error: unknown stage(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    scratch = args.keep or tempfile.mkdtemp(prefix="wordgen-bench-")
+    try:
+        generate_folder(scratch, args.images, args.resolution, args.formats, args.titles, args.seed)
+        report = {
+            'parameters': {
+                'images': args.images,
+                'resolution': list(args.resolution),
+                'formats': list(args.formats),
+                'titles': args.titles,
+                'dpi': args.dpi,
+                'repeat': args.repeat,
+                'input_mb': round(folder_bytes(scratch) / (1024 * 1024), 1),
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'stages': run_benchmarks(scratch, stages, args.repeat, args.dpi),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    return write_report(report, args)
+
+
+def _startup_sample(python_flags=()):
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, *python_flags, "-c", STARTUP_SCRIPT], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True)
+    sample = json.loads(completed.stdout.strip().splitlines()[-1])
+    sample['process'] = time.perf_counter() - start  # Interpreter start-up included
+    return sample, completed.stderr
+
+
+def slowest_imports(importtime_output, limit=15):
+    # Modules from `python -X importtime` by their own import time, which (unlike the
+    # cumulative column) does not count a module again in every package above it
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        imports.append((int(own), name.strip()))
+    imports.sort(reverse=True)
+    return [{'module': name, 'ms': round(us / 1000, 1)} for us, name in imports[:limit]]
+
+
+def startup(args):
+    samples = [_startup_sample()[0] for _ in range(args.repeat)]
+    results = {}
+    for name in ('import_app', 'first_window', 'process'):
+        values = [sample[name] for sample in samples if name in sample]
+        if values:
+            # The fastest run is the one least disturbed by the rest of the machine
+            results[name] = {'seconds': round(min(values), 4), 'median_seconds': round(statistics.median(values), 4)}
+            print(f"{name:28s} {results[name]['seconds']:8.3f}s  (median {results[name]['median_seconds']:.3f}s)",
+                  file=sys.stderr, flush=True)
+
+    _, importtime_output = _startup_sample(("-X", "importtime"))
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'stages': results,
+        'slowest_imports': slowest_imports(importtime_output),
+    }
+    return write_report(report, args)
+
+
+def write_report(report, args):
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_to_baseline(report['stages'], json.load(f), args.tolerance)
+        report['regressions'] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def generate(args):
+    paths = generate_folder(args.folder, args.images, args.resolution, args.formats, args.titles, args.seed)
+    print(f"Wrote {len(paths)} images to {args.folder}")
+    return 0
+
+
+def add_folder_options(parser):
+    parser.add_argument('--images', type=int, default=100, help="number of images (default 100)")
+    parser.add_argument('--resolution', type=parse_resolution, default=(1280, 720), help="WIDTHxHEIGHT (default 1280x720)")
+    parser.add_argument('--formats', type=lambda value: value.split(','), default=['png', 'jpg'],
+                        help=f"comma-separated mix of {','.join(FORMAT_EXTENSIONS)} (default png,jpg)")
+    parser.add_argument('--titles', type=int, default=4, help="number of title_N groups (default 4)")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def add_report_options(parser):
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--baseline', help="JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"slowdown that counts as a regression (default {DEFAULT_TOLERANCE})")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the image-to-Word pipeline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="generate a synthetic folder and time each stage")
+    add_folder_options(run_parser)
+    run_parser.add_argument('--stages', nargs='+', metavar='STAGE', help=f"subset of: {' '.join(STAGES)}")
+    run_parser.add_argument('--dpi', type=int, default=200, help="image preparation DPI, 0 to embed originals")
+    run_parser.add_argument('--repeat', type=int, default=1, help="runs per stage; the fastest is reported")
+    add_report_options(run_parser)
+    run_parser.add_argument('--keep', metavar='DIR', help="generate the folder here and keep it")
+    run_parser.set_defaults(func=run)
+
+    startup_parser = subparsers.add_parser('startup', help="time app import and first window in fresh interpreters")
+    startup_parser.add_argument('--repeat', type=int, default=5, help="launches to time; the fastest is reported")
+    add_report_options(startup_parser)
+    startup_parser.set_defaults(func=startup)
+
+    generate_parser = subparsers.add_parser('generate', help="only write a synthetic image folder")
+    generate_parser.add_argument('folder')
+    add_folder_options(generate_parser)
+    generate_parser.set_defaults(func=generate)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+from image_ingest import known_sha256
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def manifest_path(output_file):
+    # Stored next to the document, e.g. tc1.docx.manifest.json
+    return output_file + MANIFEST_SUFFIX
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _image_options_settings(image_options):
+    if image_options is None:
+        return None
+    return {'dpi': image_options.dpi, 'recompress': image_options.recompress, 'jpeg_quality': image_options.jpeg_quality}
+
+
+def describe_build(images_dict, max_image_width, image_options=None, dedupe=None):
+    """Describes everything a document build depends on: inputs and settings."""
+    groups = []
+    for title, group in images_dict.items():
+        images = []
+        for image_path in group.image_paths:
+            stat = os.stat(image_path)
+            images.append({'path': image_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+        groups.append({'title': title, 'layout': group.layout, 'note': group.note, 'images': images})
+
+    build = {
+        'version': MANIFEST_VERSION,
+        'max_image_width': max_image_width,
+        'image_options': _image_options_settings(image_options),
+        'groups': groups,
+    }
+    if dedupe is not None and dedupe.enabled:
+        # Only recorded when on, so documents built before deduplication existed stay up to date
+        build['dedupe'] = {'mode': dedupe.mode, 'threshold': dedupe.threshold}
+    return build
+
+
+def load_manifest(output_file):
+    try:
+        with open(manifest_path(output_file), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"Error reading build manifest for {output_file}: {e}")
+        return None
+
+
+def add_content_hashes(build):
+    """Stores each image's SHA-256 in build, where it is not there already."""
+    for group in build['groups']:
+        for image in group['images']:
+            if 'sha256' not in image:
+                # Usually already known from embedding the image, which saves reading it again
+                image['sha256'] = (known_sha256(image['path'], image['size'], image['mtime_ns'])
+                                   or file_sha256(image['path']))
+
+
+def write_manifest(output_file, build, hash_contents=False):
+    """Records build next to output_file; hash_contents also stores each image's SHA-256."""
+    if hash_contents:
+        add_content_hashes(build)
+
+    # Remember the output as written so a replaced or edited document is rebuilt
+    stat = os.stat(output_file)
+    _save(output_file, dict(build, output={'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}))
+
+
+def _save(output_file, manifest):
+    tmp_path = manifest_path(output_file) + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path(output_file))
+
+
+def plan_append(output_file, build):
+    """Works out whether output_file can be brought up to date by adding images only.
+
+    New images go at the end of their group and new groups at the end of the
+    document, so build is put in that order (to be recorded once they are added).
+    Returns [(title, new image paths, new_group)] in that order, where new_group says
+    the title is not in the document yet, or None when anything else changed:
+    settings, layouts, notes, or an image that was edited or removed. Those need a
+    full rebuild.
+    """
+    manifest = load_manifest(output_file)
+    if manifest is None or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    try:
+        stat = os.stat(output_file)
+    except FileNotFoundError:
+        return None
+    if manifest.get('output') != {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}:
+        return None
+    if (manifest['max_image_width'] != build['max_image_width']
+            or manifest['image_options'] != build['image_options']
+            or manifest.get('dedupe') != build.get('dedupe')):
+        return None
+
+    groups = {group['title']: group for group in build['groups']}
+    plan = []
+    ordered = []
+    for old_group in manifest['groups']:
+        group = groups.pop(old_group['title'], None)
+        if group is None or (old_group['layout'], old_group['note']) != (group['layout'], group['note']):
+            return None
+        images = {image['path']: image for image in group['images']}
+        kept = []
+        for old in old_group['images']:
+            new = images.pop(old['path'], None)
+            if new is None or not _same_image(old, new):
+                return None
+            kept.append(new)
+        added = list(images.values())  # What is left, in folder order
+        if added:
+            plan.append((group['title'], [image['path'] for image in added], False))
+        ordered.append(dict(group, images=kept + added))
+    for group in groups.values():
+        plan.append((group['title'], [image['path'] for image in group['images']], True))
+        ordered.append(group)
+
+    build['groups'] = ordered
+    return plan
+
+
+def _same_image(old, new):
+    if old['path'] != new['path']:
+        return False
+    if old['size'] == new['size'] and old['mtime_ns'] == new['mtime_ns']:
+        if 'sha256' in old:
+            new['sha256'] = old['sha256']
+        return True
+    # Touched but possibly unchanged (e.g. copied back from a share): fall back to the hash
+    if 'sha256' in old and old['size'] == new['size']:
+        new['sha256'] = file_sha256(new['path'])
+        return old['sha256'] == new['sha256']
+    return False
+
+
+def is_up_to_date(output_file, build):
+    """True if output_file was produced from exactly the inputs and settings in build.
+
+    Groups are matched by title and images by path, not by position: an appended
+    document records its images in document order, which need not be folder order.
+    """
+    manifest = load_manifest(output_file)
+    if manifest is None or manifest.get('version') != MANIFEST_VERSION:
+        return False
+
+    try:
+        stat = os.stat(output_file)
+    except FileNotFoundError:
+        return False
+    if manifest.get('output') != {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}:
+        return False
+
+    if (manifest['max_image_width'] != build['max_image_width']
+            or manifest['image_options'] != build['image_options']
+            or manifest.get('dedupe') != build.get('dedupe')
+            or len(manifest['groups']) != len(build['groups'])):
+        return False
+
+    new_groups = {group['title']: group for group in build['groups']}
+    restamped = False
+    for old_group in manifest['groups']:
+        new_group = new_groups.get(old_group['title'])
+        if new_group is None or (old_group['layout'], old_group['note']) != (new_group['layout'], new_group['note']):
+            return False
+        new_images = {image['path']: image for image in new_group['images']}
+        if len(old_group['images']) != len(new_images):
+            return False
+        for old in old_group['images']:
+            new = new_images.get(old['path'])
+            if new is None or not _same_image(old, new):
+                return False
+            if old['mtime_ns'] != new['mtime_ns']:
+                # Matched by hash only; the new mtime makes the next check a plain stat again
+                old['mtime_ns'] = new['mtime_ns']
+                restamped = True
+
+    if restamped:
+        _save(output_file, manifest)
+    return True
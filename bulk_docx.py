@@ -0,0 +1,98 @@
+from docx.image.image import Image
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.oxml.ns import nsdecls, qn
+from docx.oxml.parser import parse_xml
+from docx.parts.image import ImagePart
+from docx.shared import Emu
+from docx_xml import inline_picture_xml
+
+
+class BulkDocxWriter:
+    """Lays out the body of a python-docx Document from XML text in bulk.
+
+    Offers the same write_xml/picture_xml interface as StreamingDocxWriter, so both
+    are fed by the same layout code, and produces the same XML python-docx's
+    add_heading/add_table/add_picture calls would. The difference is cost: each
+    add_picture call scans the whole document for the next shape id and every
+    image part for duplicates and free names, which is quadratic in the number of
+    images. Here ids, names and duplicates are tracked as they are handed out, and
+    each batch of XML is parsed in one go.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.part = doc.part
+        self.package = self.part.package
+        self.media = {}  # sha1 of image bytes -> (relationship id, filename)
+
+        # Where python-docx would continue numbering for this document
+        self.next_shape_id = self.part.next_id
+        used_rel_ids = set(self.part.rels.keys())
+        self.next_rel_number = 1
+        while f"rId{self.next_rel_number}" in used_rel_ids:
+            self.next_rel_number += 1
+        self.used_rel_ids = used_rel_ids
+        self.next_image_number = max((part.partname.idx for part in self.package.image_parts), default=0) + 1
+
+        section = doc.sections[-1]
+        self.text_width_twips = Emu(section.page_width - section.left_margin - section.right_margin).twips
+
+    def write_xml(self, fragments):
+        """Parses the concatenated fragments (complete body elements) and appends them to the body."""
+        body = self.doc.element.body
+        insert_elements(parse_body_xml(fragments), body, body.sectPr)
+
+    def picture_xml(self, image, width, height, filename=None):
+        """Embeds image (a binary stream) and returns its drawing XML; sizes in EMU.
+
+        filename names the picture, as add_picture(path) names it after the file; a
+        picture sharing earlier media keeps that one's name, as with add_picture.
+        """
+        image.seek(0)
+        docx_image = Image.from_blob(image.read())
+        sha1 = docx_image.sha1
+        media = self.media.get(sha1)
+        if media is None:
+            partname = PackURI(f"/word/media/image{self.next_image_number}.{docx_image.ext}")
+            self.next_image_number += 1
+            image_part = ImagePart.from_image(docx_image, partname)
+            self.package.image_parts.append(image_part)
+            rel_id = self._next_rel_id()
+            self.part.rels.add_relationship(RT.IMAGE, image_part, rel_id)
+            media = self.media[sha1] = (rel_id, filename or docx_image.filename)
+
+        rel_id, filename = media
+        shape_id = self.next_shape_id
+        self.next_shape_id += 1
+        return inline_picture_xml(shape_id, rel_id, filename, width, height)
+
+    def _next_rel_id(self):
+        while f"rId{self.next_rel_number}" in self.used_rel_ids:
+            self.next_rel_number += 1
+        rel_id = f"rId{self.next_rel_number}"
+        self.used_rel_ids.add(rel_id)
+        self.next_rel_number += 1
+        return rel_id
+
+
+def parse_body_xml(fragments):
+    # Returns the top-level elements of the concatenated body XML fragments
+    return list(parse_xml(f'<w:body {nsdecls("w", "wp", "r")}>{"".join(fragments)}</w:body>'))
+
+
+def insert_elements(elements, parent, before=None):
+    """Moves parsed elements into parent (a body or a table), ahead of before or at the end."""
+    for element in elements:
+        # Moving a subtree into another document looks up each namespace declaration
+        # in it against all the ones seen so far, and every picture declares its own,
+        # so a table moved whole costs quadratic time; rows are moved one at a time
+        rows = element.findall(qn("w:tr")) if element.tag == qn("w:tbl") else []
+        for row in rows:
+            element.remove(row)
+        if before is not None:
+            before.addprevious(element)
+        else:
+            parent.append(element)
+        for row in rows:
+            element.append(row)
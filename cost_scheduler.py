@@ -0,0 +1,228 @@
+"""Orders generation jobs by estimated size and holds them back to fit a memory budget.
+
+Folders range from a few thumbnails to thousands of scans, and a worker building
+an in-memory document holds every embedded image until it saves. Each job's cost
+is estimated up front from file sizes and header-probed pixel counts (no image is
+decoded); the largest jobs start first, so one huge folder does not end up running
+alone at the end of the batch, and a job only starts once its estimated peak memory
+fits next to the jobs already running.
+
+    scheduler = CostScheduler(jobs, partial(estimate_cost, max_image_width=5), memory_budget=8 << 30)
+    job, cost = scheduler.take()  # None while the largest waiting job does not fit
+    ...
+    scheduler.release(cost)
+"""
+import logging
+import os
+from image_ingest import probe
+from instrumentation import count, span
+
+# What a worker process costs before it holds any image (interpreter, lxml, PIL, python-docx);
+# about 40 MB measured on Linux, with room for platforms that map more
+WORKER_BASE_BYTES = 64 << 20
+# Decoding for a resample holds the full bitmap plus a reduced and a resampled copy
+# (measured about 5.5 for large PNGs; JPEGs decode at reduced scale and need less)
+DECODE_BYTES_PER_PIXEL = 6
+# Body XML and relationships per embedded image, held until the document is saved
+XML_BYTES_PER_IMAGE = 4 << 10
+# Only this many headers are read per folder: the largest files, plus an even spread of the rest
+PROBE_LARGEST = 16
+PROBE_SPREAD = 16
+# Jobs read ahead of the pool to choose the largest from; a lazy job source
+# (folder discovery) is never drained further than this ahead of the workers
+DEFAULT_LOOKAHEAD = 64
+# Share of physical memory the default budget hands out to workers
+DEFAULT_MEMORY_FRACTION = 0.75
+
+
+class JobCost:
+    __slots__ = ('images', 'bytes', 'pixels', 'largest_pixels', 'memory', 'work')
+
+    def __init__(self, images, bytes, pixels, largest_pixels, memory, work):
+        self.images = images
+        self.bytes = bytes  # Total size of the image files
+        self.pixels = pixels  # Total pixel count, extrapolated from the probed headers
+        self.largest_pixels = largest_pixels
+        self.memory = memory  # Estimated peak memory of the worker building the job
+        self.work = work  # Relative amount of work, only used to order jobs
+
+    def __repr__(self):
+        return (f"JobCost({self.images} image(s), {self.bytes >> 20} MB on disk, "
+                f"{self.pixels / 1_000_000:.0f} MP, ~{self.memory >> 20} MB peak)")
+
+
+def default_memory_budget(fraction=DEFAULT_MEMORY_FRACTION):
+    """Bytes of physical memory the workers may plan on, or None where it cannot be read."""
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * fraction)
+    except (AttributeError, ValueError, OSError):
+        # os.sysconf is missing on Windows
+        return None
+
+
+def _file_size(image):
+    # IngestedImages (uploads) carry their bytes; anything else is a path
+    data = getattr(image, 'data', None)
+    if data is not None:
+        return len(data)
+    try:
+        return os.stat(image).st_size
+    except OSError:
+        return 0  # Gone since it was listed; the build reports it
+
+
+def _info(image):
+    info = getattr(image, 'info', None)
+    if info is not None:
+        return info
+    try:
+        return probe(image)
+    except (OSError, ValueError):
+        return None
+
+
+def _probe_sample(sizes):
+    # Indexes of the images whose headers are read: the largest files and an even spread
+    by_size = sorted(range(len(sizes)), key=sizes.__getitem__, reverse=True)
+    sample = set(by_size[:PROBE_LARGEST])
+    step = max(1, len(sizes) // PROBE_SPREAD)
+    sample.update(range(0, len(sizes), step))
+    return sorted(sample)
+
+
+def predict_group(group, max_image_width, image_options=None, max_image_height=4):
+    """Returns (file sizes, predicted embedded sizes, total pixels, largest pixels) for an ImageGroup.
+
+    Every image is stat'ed but only a sample of headers is read (see _probe_sample);
+    the group's pixel count is extrapolated from the sample's pixels per file byte,
+    and so is how far resampling at image_options.dpi shrinks each file.
+    """
+    dpi = image_options.dpi if image_options is not None else None
+    width_in = None
+    if dpi:
+        # Imported here: document_generator pulls in python-docx, which the GUI loads on first use
+        from document_generator import fit_image_size, get_safe_max_image_width
+        width_in = get_safe_max_image_width(max_image_width, group.two_columns)
+
+    image_paths = group.image_paths
+    sizes = [_file_size(image) for image in image_paths]
+    sampled_bytes = sampled_pixels = sampled_kept = largest_pixels = 0
+    for i in _probe_sample(sizes):
+        info = _info(image_paths[i])
+        if info is None:
+            continue
+        pixels = info.width * info.height
+        sampled_bytes += sizes[i]
+        sampled_pixels += pixels
+        largest_pixels = max(largest_pixels, pixels)
+        if width_in:
+            # Pixels left after resampling to the printed size at dpi (images are never upscaled)
+            shown = fit_image_size(info, width_in, max_image_height)
+            sampled_kept += min(pixels, shown[0] * dpi * shown[1] * dpi) if shown else pixels
+
+    embedded = sizes
+    if width_in and sampled_pixels:
+        # Resampled files shrink about as much as their pixel count
+        shrink = sampled_kept / sampled_pixels
+        embedded = [int(size * shrink) for size in sizes]
+    total_pixels = int(sum(sizes) * sampled_pixels / sampled_bytes) if sampled_bytes else 0
+    return sizes, embedded, total_pixels, largest_pixels
+
+
+def estimate_cost(images_dict, max_image_width, image_options=None, streaming=False, max_image_height=4):
+    """Returns the JobCost of building images_dict (an ImageManifest) with these options."""
+    resampled = bool(image_options is not None and (image_options.dpi or image_options.recompress))
+
+    images = total_bytes = total_pixels = largest_pixels = largest_file = embedded = 0
+    with span("job_estimate"):
+        for group in images_dict.values():
+            sizes, group_embedded, pixels, group_largest = predict_group(group, max_image_width, image_options,
+                                                                         max_image_height)
+            if not sizes:
+                continue
+            images += len(sizes)
+            total_bytes += sum(sizes)
+            total_pixels += pixels
+            largest_pixels = max(largest_pixels, group_largest)
+            largest_file = max(largest_file, max(sizes))
+            embedded += sum(group_embedded)
+
+    memory = WORKER_BASE_BYTES + images * XML_BYTES_PER_IMAGE + largest_file  # Each file is read whole
+    if resampled:
+        memory += largest_pixels * DECODE_BYTES_PER_PIXEL
+    if not streaming:
+        memory += embedded  # An in-memory document keeps every embedded image until it is saved
+
+    # Decoding dominates when images are resampled, reading and writing bytes when they are not
+    work = total_pixels + total_bytes if resampled else total_bytes
+    count("jobs_estimated")
+    return JobCost(images, total_bytes, total_pixels, largest_pixels, memory, work)
+
+
+class CostScheduler:
+    """Hands out (job, cost) pairs, largest first, as long as they fit in memory_budget bytes.
+
+    Up to lookahead jobs are estimated ahead of the pool. take() returns the largest
+    of them if it fits beside the jobs already running, or None if it does not fit
+    yet; done is true once every job was handed out. Smaller jobs wait behind it
+    rather than take the memory it is waiting for, so it is never starved. A job
+    estimated above the whole budget still runs, but only on its own. Without a
+    memory_budget, jobs are only reordered. release(cost) must be called as each
+    job finishes.
+    """
+
+    def __init__(self, jobs, estimate, memory_budget=None, lookahead=DEFAULT_LOOKAHEAD):
+        self.jobs = iter(jobs)
+        self.estimate = estimate
+        self.memory_budget = memory_budget
+        self.lookahead = lookahead
+        self.pending = []  # (job, cost), largest work first
+        self.reserved = 0  # Estimated memory of the running jobs
+        self.running = 0
+        self.exhausted = False
+
+    @property
+    def done(self):
+        return self.exhausted and not self.pending
+
+    def _refill(self):
+        added = False
+        while not self.exhausted and len(self.pending) < self.lookahead:
+            try:
+                job = next(self.jobs)
+            except StopIteration:
+                self.exhausted = True
+                break
+            folder, _, images_dict = job
+            try:
+                cost = self.estimate(images_dict)
+            except Exception as e:
+                # An estimate is only a hint; a folder that cannot be estimated still gets built
+                logging.error(f"Error estimating the cost of folder {folder}: {e}")
+                cost = JobCost(0, 0, 0, 0, WORKER_BASE_BYTES, 0)
+            self.pending.append((job, cost))
+            added = True
+        if added:
+            self.pending.sort(key=lambda pending: pending[1].work, reverse=True)
+
+    def take(self):
+        self._refill()
+        if not self.pending:
+            return None
+        job, cost = self.pending[0]
+        if self.memory_budget is not None:
+            if self.running and self.reserved + cost.memory > self.memory_budget:
+                count("jobs_held_for_memory")
+                return None
+            if cost.memory > self.memory_budget:
+                logging.warning(f"Folder {job[0]} needs about {cost.memory >> 20} MB, more than the "
+                                f"{self.memory_budget >> 20} MB budget; building it on its own")
+                count("jobs_over_budget")
+        del self.pending[0]
+        self.reserved += cost.memory
+        self.running += 1
+        return job, cost
+
+    def release(self, cost):
+        self.reserved -= cost.memory
+        self.running -= 1
@@ -0,0 +1,392 @@
+"""Finds repeated screenshots within each title group before they are embedded.
+
+Exact duplicates are found by SHA-256 of the file contents. Near duplicates (the
+same screen captured again, re-encoded or with a blinking cursor) are found by a
+64-bit difference hash: each image is decoded at a small size, shrunk to 9x8
+grayscale, and every bit says whether a pixel is brighter than its right-hand
+neighbour. Images whose hashes differ in at most threshold bits are near duplicates.
+
+mode 'off' leaves everything alone, 'flag' only reports what it finds, 'drop'
+embeds just the first image of each run of duplicates.
+
+While a document is built, each image is hashed from the bytes read to embed it
+(see GroupDeduper.checked), so dedupe adds a small decode per image but no second read.
+"""
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from image_ingest import IngestedImage, read_image
+from instrumentation import count, span
+from preferences import CACHE_DIR
+
+DEDUPE_MODES = ('off', 'flag', 'drop')
+DEFAULT_THRESHOLD = 8  # Differing hash bits (of 64) still counted as the same picture
+
+HASH_WIDTH, HASH_HEIGHT = 9, 8
+# Decoded at this size first: enough detail for the 9x8 averages, and JPEGs decode at 1/8 scale
+_DECODE_SIZE = (HASH_WIDTH * 4, HASH_HEIGHT * 4)
+# Image decoding releases the GIL, so a few threads keep all cores of a worker busy
+MAX_HASH_THREADS = 8
+SQL_BATCH = 500  # Keys per lookup query, well under SQLite's bound parameter limit
+HASH_CHUNK = 32  # Images read ahead and hashed together while a group is embedded
+HASH_CACHE_ENTRIES = 16384  # Hashes also kept in memory, so a process hashes an unchanged file once
+
+
+class DedupeOptions:
+    """cache_file keeps hashes between runs (None disables it); see HashStore."""
+
+    def __init__(self, mode='off', threshold=DEFAULT_THRESHOLD, cache_file=os.path.join(CACHE_DIR, "image_hashes.sqlite3")):
+        if mode not in DEDUPE_MODES:
+            raise ValueError(f"dedupe mode must be one of {DEDUPE_MODES}, got {mode!r}")
+        if not 0 <= threshold < 64:
+            raise ValueError(f"dedupe threshold must be between 0 and 63, got {threshold}")
+        self.mode = mode
+        self.threshold = threshold
+        self.cache_file = cache_file
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+
+class HashStore:
+    """Image hashes kept on disk per (path, mtime, size), so unchanged files are not read again.
+
+    Decoding is what hashing costs; with the store, a folder seen before is hashed
+    with one stat per image and a query. Worker processes may share the file.
+    Failures are logged and the store is then simply not used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30)
+            self.db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, "
+                            "sha256 TEXT, dhash TEXT)")
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Error opening image hash cache {path}: {e}")
+            self.close()
+
+    def lookup(self, keys):
+        # keys are (abspath, mtime_ns, size); returns {key: (sha256, dhash)} for the ones stored
+        found = {}
+        if self.db is None:
+            return found
+        by_path = {key[0]: key for key in keys}
+        paths = list(by_path)
+        try:
+            for start in range(0, len(paths), SQL_BATCH):
+                batch = paths[start:start + SQL_BATCH]
+                rows = self.db.execute(f"SELECT path, mtime_ns, size, sha256, dhash FROM hashes "
+                                       f"WHERE path IN ({','.join('?' * len(batch))})", batch)
+                for path, mtime_ns, size, sha256, dhash in rows:
+                    if by_path[path] == (path, mtime_ns, size):
+                        found[by_path[path]] = (sha256, int(dhash, 16))
+        except sqlite3.Error as e:
+            logging.error(f"Error reading image hash cache {self.path}: {e}")
+        return found
+
+    def store(self, entries):
+        # entries are ((abspath, mtime_ns, size), (sha256, dhash))
+        if self.db is None or not entries:
+            return
+        try:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                                    [(*key, sha256, f"{dhash:016x}") for key, (sha256, dhash) in entries])
+        except sqlite3.Error as e:
+            logging.error(f"Error writing image hash cache {self.path}: {e}")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+_cache = OrderedDict()  # (abspath, mtime_ns, size) -> (sha256, dhash)
+_cache_lock = threading.Lock()
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _cached(key):
+    with _cache_lock:
+        hashed = _cache.get(key)
+        if hashed is not None:
+            _cache.move_to_end(key)
+        return hashed
+
+
+def _remember(key, hashed):
+    with _cache_lock:
+        _cache[key] = hashed
+        _cache.move_to_end(key)
+        while len(_cache) > HASH_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _gray(image):
+    # The 9x8 grayscale bytes of an IngestedImage, decoded from the bytes it holds
+    from PIL import Image
+    from fast_decode import decode_reduced
+    with Image.open(image.stream()) as img:
+        small = decode_reduced(img, _DECODE_SIZE, reducing_gap=1.0)
+        return small.convert('L').resize((HASH_WIDTH, HASH_HEIGHT), Image.BOX).tobytes()
+
+
+def _dhashes(grays):
+    # All difference hashes at once: (n, 8, 9) pixels -> (n, 8, 8) comparisons -> n 64-bit words
+    import numpy as np
+    pixels = np.frombuffer(b"".join(grays), dtype=np.uint8).reshape(len(grays), HASH_HEIGHT, HASH_WIDTH)
+    bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    return np.packbits(bits.reshape(len(grays), 64), axis=1).view('>u8').ravel().tolist()
+
+
+def _read_for_hash(source):
+    # Returns (sha256, 9x8 grayscale bytes) for one image, or None if it cannot be read
+    try:
+        image = source if isinstance(source, IngestedImage) else read_image(source)
+        return image.sha256(), _gray(image)
+    except Exception as e:
+        logging.error(f"Error hashing image {getattr(source, 'path', source)}: {e}")
+        return None
+
+
+def _read_to_embed(source, need_hash):
+    # Returns (image, sha256, 9x8 grayscale bytes) for one image about to be embedded; the
+    # hash parts are None if not needed or not computable, and image is source if unreadable
+    try:
+        image = source if isinstance(source, IngestedImage) else read_image(source)
+    except OSError:
+        return source, None, None
+    if not need_hash:
+        return image, None, None
+    try:
+        with span("image_hash", path=image.path):
+            return image, image.sha256(), _gray(image)
+    except Exception as e:
+        logging.error(f"Error hashing image {image.path}: {e}")
+        return image, None, None
+
+
+def image_hashes(image_paths, store=None):
+    """Returns (sha256, dhash) per image path (or IngestedImage), None where unreadable.
+
+    For images that are not about to be embedded (e.g. the ones already in a
+    document): hashes come from memory or store (a HashStore) where they can, and
+    the rest are read on a few threads.
+    """
+    results = [None] * len(image_paths)
+    keys = {}  # index -> file key, for files that can be cached
+    for i, source in enumerate(image_paths):
+        if not isinstance(source, IngestedImage):
+            try:
+                keys[i] = _file_key(source)
+            except OSError:
+                pass  # Reported when it fails to read
+    for i, key in keys.items():
+        results[i] = _cached(key)
+
+    if store is not None:
+        unknown = {i: key for i, key in keys.items() if results[i] is None}
+        stored = store.lookup(unknown.values())
+        for i, key in unknown.items():
+            results[i] = stored.get(key)
+            if results[i] is not None:
+                _remember(key, results[i])
+
+    missing = [i for i, hashed in enumerate(results) if hashed is None]
+    if not missing:
+        return results
+    with ThreadPoolExecutor(max_workers=min(MAX_HASH_THREADS, os.cpu_count() or 1)) as executor:
+        read = list(executor.map(_read_for_hash, [image_paths[i] for i in missing]))
+    readable = [(i, hashed) for i, hashed in zip(missing, read) if hashed is not None]
+    if not readable:
+        return results
+
+    for (i, (sha256, _)), dhash in zip(readable, _dhashes([gray for _, (_, gray) in readable])):
+        results[i] = (sha256, dhash)
+        if i in keys:
+            _remember(keys[i], results[i])
+    if store is not None:
+        store.store([(keys[i], results[i]) for i, _ in readable if i in keys])
+    return results
+
+
+class _Matcher:
+    # Compares each image with the ones kept before it in a title group
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.seen = {}  # sha256 -> first path with those contents
+        self.kept_paths = []
+        self.kept = None  # dhashes of kept_paths, in an array grown as needed
+
+    def match(self, path, sha256, dhash):
+        # Returns (kept path, distance) if path repeats an earlier image, else keeps it and returns None
+        import numpy as np
+        if sha256 in self.seen:
+            return self.seen[sha256], 0
+        self.seen[sha256] = path
+
+        kept = len(self.kept_paths)
+        if self.threshold and kept:
+            distances = _bit_count(self.kept[:kept] ^ np.uint64(dhash))
+            nearest = int(distances.argmin())
+            if distances[nearest] <= self.threshold:
+                return self.kept_paths[nearest], int(distances[nearest])
+        if self.kept is None or kept == len(self.kept):
+            grown = np.empty(max(64, kept * 2), dtype=np.uint64)
+            if kept:
+                grown[:kept] = self.kept
+            self.kept = grown
+        self.kept[kept] = dhash
+        self.kept_paths.append(path)
+        return None
+
+
+def find_duplicates(image_paths, threshold=DEFAULT_THRESHOLD, store=None):
+    """Returns {duplicate_path: (kept_path, distance)} for one title group, in order.
+
+    Each image is compared with the images kept before it; distance is 0 for an
+    exact copy. Unreadable images are never reported.
+    """
+    matcher = _Matcher(threshold)
+    duplicates = {}
+    for path, hashed in zip(image_paths, image_hashes(image_paths, store)):
+        if hashed is not None:
+            match = matcher.match(path, *hashed)
+            if match is not None:
+                duplicates[path] = match
+    return duplicates
+
+
+def _bit_count(words):
+    import numpy as np
+    if hasattr(np, 'bitwise_count'):  # NumPy 2
+        return np.bitwise_count(words)
+    return np.unpackbits(words.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class Deduper:
+    """Applies DedupeOptions (None or 'off' does nothing) to a document as it is built.
+
+    group() gives the GroupDeduper for each title group. Duplicates are counted
+    (images_duplicate, images_near_duplicate) in either mode, and (duplicate path,
+    kept path, distance) is appended to found, if given. New hashes go to the
+    HashStore as the Deduper closes; use it in a with block.
+    """
+
+    def __init__(self, options, found=None):
+        self.options = options
+        self.found = found
+        self.enabled = options is not None and options.enabled
+        self.store = HashStore(options.cache_file) if self.enabled and options.cache_file else None
+        self.pending = []  # (file key, hashes) to add to the store
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def group(self):
+        return GroupDeduper(self) if self.enabled else None
+
+    def remember(self, key, hashed):
+        _remember(key, hashed)
+        if self.store is not None:
+            self.pending.append((key, hashed))
+            if len(self.pending) >= SQL_BATCH:
+                self.store.store(self.pending)
+                self.pending = []
+
+    def close(self):
+        if self.store is not None:
+            self.store.store(self.pending)
+            self.store.close()
+            self.store = None
+        self.pending = []
+
+
+class GroupDeduper:
+    """Finds the repeats within one title group, in the order its images are embedded."""
+
+    def __init__(self, deduper):
+        self.deduper = deduper
+        self.matcher = _Matcher(deduper.options.threshold)
+
+    def seed(self, image_paths):
+        """Has later images compared with image_paths too (e.g. the images already in a
+        document); returns how many of them are kept. Nothing is reported for them."""
+        kept = 0
+        for path, hashed in zip(image_paths, image_hashes(image_paths, self.deduper.store)):
+            # An unreadable image still takes its place in the layout
+            if hashed is None or self.matcher.match(path, *hashed) is None:
+                kept += 1
+        return kept
+
+    def checked(self, sources):
+        """Yields (source, image) for each source (a path or IngestedImage), in order.
+
+        image is source read into memory, ready to embed, or None if it is dropped; a
+        file that cannot be read comes back as it is, for embedding to report. Stored
+        hashes are looked up for the whole group in one query; the other images are
+        read HASH_CHUNK at a time on a few threads and hashed in one array pass.
+        """
+        deduper = self.deduper
+        keys = [None] * len(sources)
+        hashes = [None] * len(sources)
+        for i, source in enumerate(sources):
+            if not isinstance(source, IngestedImage):
+                try:
+                    keys[i] = _file_key(source)
+                except OSError:
+                    continue  # Reported when it fails to read
+                hashes[i] = _cached(keys[i])
+        if deduper.store is not None:
+            unknown = [key for key, hashed in zip(keys, hashes) if key is not None and hashed is None]
+            stored = deduper.store.lookup(unknown) if unknown else {}
+            for i, key in enumerate(keys):
+                if key in stored:
+                    hashes[i] = stored[key]
+                    _remember(key, hashes[i])
+
+        with ThreadPoolExecutor(max_workers=min(MAX_HASH_THREADS, os.cpu_count() or 1)) as executor:
+            for start in range(0, len(sources), HASH_CHUNK):
+                chunk = range(start, min(start + HASH_CHUNK, len(sources)))
+                # Each task gets its own copy of the context, so its spans nest under the current one
+                futures = [executor.submit(contextvars.copy_context().run, _read_to_embed, sources[i],
+                                           hashes[i] is None) for i in chunk]
+                read = [future.result() for future in futures]
+                grays = [(i, sha256, gray) for i, (_, sha256, gray) in zip(chunk, read) if gray is not None]
+                if grays:
+                    for (i, sha256, _), dhash in zip(grays, _dhashes([gray for _, _, gray in grays])):
+                        hashes[i] = sha256, dhash
+                        if keys[i] is not None:
+                            deduper.remember(keys[i], hashes[i])
+                for i, (image, _, _) in zip(chunk, read):
+                    yield sources[i], self._match(image, hashes[i])
+
+    def _match(self, image, hashed):
+        # An unreadable or unhashable image is never reported
+        if hashed is None or not isinstance(image, IngestedImage):
+            return image
+        deduper = self.deduper
+        match = self.matcher.match(image.path, *hashed)
+        if match is None:
+            return image
+        kept_path, distance = match
+        count("images_duplicate" if distance == 0 else "images_near_duplicate")
+        if deduper.found is not None:
+            deduper.found.append((image.path, kept_path, distance))
+        return None if deduper.options.mode == 'drop' else image
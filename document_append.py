@@ -0,0 +1,274 @@
+"""Adds new images to a document built earlier, without rebuilding it.
+
+    python -m wordgenerator build FOLDER --append
+
+Only the images that are new since the last build are read and embedded: at the
+end of their group, or, for a title the document does not have yet, in a new group
+at the end of the document. A full rebuild puts everything back in folder order.
+
+The document is copied (to scratch space, or next to it) and the copy is
+extended, then published like any other build, so the original is only ever
+replaced whole. A .docx is a zip archive: the new media and the three small
+parts that change (word/document.xml, its relationships and [Content_Types].xml)
+are written after the existing entries, followed by a new central directory. The
+existing media is not recompressed or rewritten, so the cost follows what was
+added rather than the size of the document. The replaced parts' old copies
+remain in the file, unused, until the next full rebuild.
+"""
+import hashlib
+import os
+import re
+import shutil
+import zipfile
+from lxml import etree
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml.ns import qn
+from docx.oxml.parser import parse_xml
+from build_manifest import plan_append
+from bulk_docx import insert_elements, parse_body_xml
+from dedupe import Deduper
+from image_manifest import ImageManifest
+from document_generator import embed_images, get_safe_max_image_width, group_xml
+from docx_xml import (TABLE_END_XML, inline_picture_xml, picture_paragraph_xml, relationship_xml, table_row_xml,
+                      table_start_xml)
+from instrumentation import count, span
+from streaming_docx import (CONTENT_TYPES_PART, DOCUMENT_PART, DOCUMENT_RELS_PART, IMAGE_CONTENT_TYPES,
+                            STORED_EXTENSIONS, sniff_image_extension)
+
+MEDIA_PREFIX = "word/media/"
+
+
+class _AppendWriter:
+    """picture_xml() for an archive opened for appending; see BulkDocxWriter.
+
+    Shape ids, relationship ids and media names carry on from the highest ones the
+    document uses. Media is written to the archive as it is embedded, and an image
+    identical to one already in the document shares its part.
+    """
+
+    def __init__(self, archive, body):
+        self.archive = archive
+        self.relationships = archive.read(DOCUMENT_RELS_PART).decode("utf-8")
+        self.content_types = archive.read(CONTENT_TYPES_PART).decode("utf-8")
+        self.new_relationships = []
+        self.new_extensions = set()
+        self.next_rel_number = max(int(n) for n in re.findall(r'Id="rId(\d+)"', self.relationships)) + 1
+        # Same rule as python-docx's next_id: one past the highest numeric id anywhere in the document
+        self.next_shape_id = max((int(value) for value in body.xpath('//@id') if value.isdigit()), default=0) + 1
+
+        self.media_rel_ids = {rel.get('Target'): rel.get('Id') for rel in etree.fromstring(self.relationships.encode("utf-8"))}
+        self.media = {}  # sha1 of image bytes -> relationship id
+        # Pictures sharing media take the name of its first picture, as in a full build
+        self.names = {}  # relationship id -> picture name
+        for picture in body.iter(qn("pic:pic")):
+            blip, name = picture.find(f".//{qn('a:blip')}"), picture.find(f".//{qn('pic:cNvPr')}")
+            if blip is not None and name is not None:
+                self.names.setdefault(blip.get(qn("r:embed")), name.get("name"))
+        self.unhashed_media = {}  # size -> names of document media not compared against yet
+        numbers = [0]
+        for info in archive.infolist():
+            if info.filename.startswith(MEDIA_PREFIX):
+                self.unhashed_media.setdefault(info.file_size, []).append(info.filename)
+                match = re.match(r"image(\d+)\.", info.filename[len(MEDIA_PREFIX):])
+                if match:
+                    numbers.append(int(match.group(1)))
+        self.next_image_number = max(numbers) + 1
+
+        section = body.find(qn("w:sectPr"))
+        margins = section.find(qn("w:pgMar"))
+        self.text_width_twips = (int(section.find(qn("w:pgSz")).get(qn("w:w")))
+                                 - int(margins.get(qn("w:left"))) - int(margins.get(qn("w:right"))))
+
+    def picture_xml(self, image, width, height, filename=None):
+        """Embeds image (a binary stream) and returns its drawing XML; sizes in EMU."""
+        image.seek(0)
+        data = image.read()
+        extension = sniff_image_extension(data)
+        digest = hashlib.sha1(data).hexdigest()
+        rel_id = self.media.get(digest) or self._existing_media(len(data), digest)
+        if rel_id is None:
+            rel_id = f"rId{self.next_rel_number}"
+            self.next_rel_number += 1
+            target = f"media/image{self.next_image_number}.{extension}"
+            self.next_image_number += 1
+            compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            self.archive.writestr("word/" + target, data, compress_type=compress_type)
+            self.new_relationships.append(relationship_xml(rel_id, target))
+            self.new_extensions.add(extension)
+            self.media[digest] = rel_id
+
+        shape_id = self.next_shape_id
+        self.next_shape_id += 1
+        name = self.names.setdefault(rel_id, filename or f"image.{extension}")
+        return inline_picture_xml(shape_id, rel_id, name, width, height)
+
+    def _existing_media(self, size, digest):
+        # Media already in the document is only read when its size matches
+        for name in self.unhashed_media.pop(size, ()):
+            rel_id = self.media_rel_ids.get(name[len("word/"):])
+            if rel_id is not None:
+                self.media.setdefault(hashlib.sha1(self.archive.read(name)).hexdigest(), rel_id)
+        return self.media.get(digest)
+
+    def save(self, document):
+        # Replaced entries are dropped from the new central directory; their bytes stay behind
+        for name in (DOCUMENT_PART, DOCUMENT_RELS_PART, CONTENT_TYPES_PART):
+            self.archive.filelist.remove(self.archive.NameToInfo.pop(name))
+
+        defaults = "".join(f'<Default Extension="{ext}" ContentType="{IMAGE_CONTENT_TYPES[ext]}"/>'
+                           for ext in sorted(self.new_extensions) if f'Extension="{ext}"' not in self.content_types)
+        content_types = self.content_types.replace("</Types>", defaults + "</Types>")
+        self.archive.writestr(CONTENT_TYPES_PART, content_types.encode("utf-8"), compress_type=zipfile.ZIP_DEFLATED)
+        relationships = self.relationships.replace(
+            "</Relationships>", "".join(self.new_relationships) + "</Relationships>")
+        self.archive.writestr(DOCUMENT_RELS_PART, relationships.encode("utf-8"), compress_type=zipfile.ZIP_DEFLATED)
+        self.archive.writestr(DOCUMENT_PART, serialize_part_xml(document), compress_type=zipfile.ZIP_DEFLATED)
+        self.archive.close()
+
+
+def _heading_title(element):
+    # The title of a group heading (a Heading2 paragraph), or None for any other element
+    if element.tag != qn("w:p"):
+        return None
+    style = element.find(f"{qn('w:pPr')}/{qn('w:pStyle')}")
+    if style is None or style.get(qn("w:val")) != "Heading2":
+        return None
+    return "".join(text.text or "" for text in element.iter(qn("w:t")))
+
+
+def _find_groups(body):
+    # Returns {title: (heading, [elements up to the next heading])} in document order
+    groups = {}
+    elements = None
+    for element in body:
+        title = _heading_title(element)
+        if title is not None:
+            elements = []
+            groups[title] = (element, elements)
+        elif elements is not None and element.tag != qn("w:sectPr"):
+            elements.append(element)
+    return groups
+
+
+def _has_picture(element):
+    return next(element.iter(qn("w:drawing")), None) is not None
+
+
+def _plan_layout(body, plan, groups, headings, deduper):
+    """Decides where each group's new images go; None if the document is not laid out as expected.
+
+    Returns [(group, new images, place, GroupDeduper or None)], where place is
+    ('group', sectPr) for a new group, ('paragraphs', element to follow) or
+    ('table', table, whether its last cell is waiting for a picture).
+    """
+    placed = []
+    for title, image_paths, new_group in plan:
+        group = groups[title]
+        added = set(image_paths)
+        new_images = [path for path in group.image_paths if path in added]
+
+        if new_group:
+            placed.append((group, new_images, ('group', body.find(qn("w:sectPr"))), None))
+            continue
+
+        # New images are compared with the ones already in the document as well
+        dedupe_group = deduper.group()
+        old_images = [path for path in group.image_paths if path not in added]
+        in_document = dedupe_group.seed(old_images) if dedupe_group is not None else len(old_images)
+
+        heading, elements = headings[title]
+        if not group.two_columns:
+            pictures = [element for element in elements if element.tag == qn("w:p") and _has_picture(element)]
+            placed.append((group, new_images, ('paragraphs', pictures[-1] if pictures else heading), dedupe_group))
+            continue
+
+        table = next((element for element in elements if element.tag == qn("w:tbl")), None)
+        if table is None:
+            return None
+        # Images are paired up by position, so an odd count leaves the last row half full
+        filling = in_document % 2 == 1
+        if filling:
+            rows = table.findall(qn("w:tr"))
+            cells = rows[-1].findall(qn("w:tc")) if rows else []
+            if len(cells) != 2 or _has_picture(cells[1]):
+                return None
+        placed.append((group, new_images, ('table', table, filling), dedupe_group))
+    return placed
+
+
+def _add_images(writer, body, placed, max_image_width, max_image_height, image_options, on_image, deduper):
+    for group, new_images, place, dedupe_group in placed:
+        with span("group", title=group.title, layout=group.layout, images=len(new_images)):
+            if place[0] == 'group':
+                insert_elements(parse_body_xml(group_xml(writer, group, max_image_width, max_image_height,
+                                                         image_options, on_image, deduper)), body, place[1])
+                continue
+
+            pictures = embed_images(writer, new_images, get_safe_max_image_width(max_image_width, group.two_columns),
+                                    max_image_height, image_options, on_image, dedupe_group)
+            if place[0] == 'paragraphs':
+                paragraphs = [picture_paragraph_xml(picture_xml) for picture_xml in pictures if picture_xml]
+                insert_elements(parse_body_xml(paragraphs), body, place[1].getnext())
+                continue
+
+            _, table, filling = place
+            column_width = int(table.find(f"{qn('w:tblGrid')}/{qn('w:gridCol')}").get(qn("w:w")))
+            if filling:
+                picture_xml = next(pictures, None)
+                if picture_xml:
+                    cell = table.findall(qn("w:tr"))[-1].findall(qn("w:tc"))[1]
+                    cell.replace(cell.find(qn("w:p")), parse_body_xml([picture_paragraph_xml(picture_xml)])[0])
+            with span("table", title=group.title, images=len(new_images)):
+                rows = [table_row_xml([picture_xml, next(pictures, None)], column_width) for picture_xml in pictures]
+                if rows:
+                    parsed_table = parse_body_xml([table_start_xml(2, column_width)] + rows + [TABLE_END_XML])[0]
+                    insert_elements(parsed_table.findall(qn("w:tr")), table)
+
+
+def append_to_document(output_file, build, images_dict, max_image_width, target, max_image_height=4,
+                       image_options=None, dedupe=None, on_image=None, duplicates=None):
+    """Writes output_file with the images that are new since it was built added to target.
+
+    output_file itself is only read; target is where the extended copy goes, to be
+    moved over output_file by the caller. build is describe_build() for images_dict;
+    it is put in the document's order, ready for write_manifest. Returns the number
+    of new images (0 writes nothing), or None when the document cannot simply be
+    extended (see plan_append) and has to be rebuilt instead. on_image, dedupe and
+    duplicates work as for create_document.
+    """
+    ordered = dict(build)  # Reordered by plan_append; only passed on once the images are in
+    plan = plan_append(output_file, ordered)
+    if plan is None:
+        return None
+    if not plan:
+        build['groups'] = ordered['groups']
+        return 0
+    # Whole groups in document order, since whether an image is a duplicate depends on the ones before it
+    groups = ImageManifest(images_dict[group['title']].replace(image_paths=[image['path'] for image in group['images']])
+                           for group in ordered['groups'])
+    new_titles = {title for title, _, new_group in plan if new_group}
+    old_titles = [group['title'] for group in ordered['groups'] if group['title'] not in new_titles]
+
+    with Deduper(dedupe, duplicates) as deduper, span("append", output=output_file):
+        with zipfile.ZipFile(output_file) as original:
+            document = parse_xml(original.read(DOCUMENT_PART))
+        body = document.find(qn("w:body"))
+        headings = _find_groups(body)
+        placed = _plan_layout(body, plan, groups, headings, deduper) if list(headings) == old_titles else None
+        if placed is None:
+            count("appends_rejected")
+            return None
+
+        with span("append_copy"):
+            shutil.copyfile(output_file, target)
+        try:
+            with open(target, 'r+b') as output, zipfile.ZipFile(output, 'a') as archive:
+                writer = _AppendWriter(archive, body)
+                _add_images(writer, body, placed, max_image_width, max_image_height, image_options, on_image, deduper)
+                with span("doc_save", output=target):
+                    writer.save(document)
+        except BaseException:
+            os.remove(target)
+            raise
+    build['groups'] = ordered['groups']
+    return sum(len(image_paths) for _, image_paths, _ in plan)
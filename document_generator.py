@@ -1,11 +1,15 @@
+import io
 import os
-import sys
 from docx import Document
-from docx.shared import Inches
-from PIL import Image
 import logging
-import tkinter as tk
-from tkinter import messagebox
+from image_ingest import IngestedImage, read_image
+from image_prep import ImagePrepOptions, prepare_image
+from bulk_docx import BulkDocxWriter
+from dedupe import Deduper
+from docx_xml import (TABLE_END_XML, heading_xml, inches_to_emu, paragraph_xml, picture_paragraph_xml,
+                      table_row_xml, table_start_xml)
+from instrumentation import count, span
+from streaming_docx import StreamingDocxWriter
 
 def get_safe_max_image_width(max_image_width, is_two_column):
     page_width = 8.5  # inches
@@ -14,88 +18,162 @@ def get_safe_max_image_width(max_image_width, is_two_column):
         return min(max_image_width, max_allowed_width) - 0.5  # Slightly reduce to prevent cropping
     return min(max_image_width, page_width - 2)  # For one column, subtract total margins
 
-def create_document(output_file, images_dict, max_image_width, max_image_height=4):
+def create_document(output_file, images_dict, max_image_width, max_image_height=4, image_options=None, streaming=False,
+                    on_image=None, dedupe=None, duplicates=None):
+    # on_image(image_path) is called after each image; raising from it stops the build.
+    # dedupe (DedupeOptions) flags or drops repeated images within each title group;
+    # what it finds is appended to duplicates (see Deduper). A locked output_file raises PermissionError
+    if image_options is None:
+        image_options = ImagePrepOptions()
+
+    with Deduper(dedupe, duplicates) as deduper:
+        if streaming:
+            return create_document_streaming(output_file, images_dict, max_image_width, max_image_height, image_options,
+                                             on_image, deduper)
+
+        doc = build_document(output_file, images_dict, max_image_width, max_image_height, image_options, on_image,
+                             deduper)
+
+    save_document(doc, output_file)
+
+def build_document(output_file, images_dict, max_image_width, max_image_height=4, image_options=None, on_image=None,
+                   deduper=None):
+    """Builds the in-memory Document for create_document without saving it."""
     doc = Document()
+    write_body(BulkDocxWriter(doc), output_file, images_dict, max_image_width, max_image_height, image_options, on_image,
+               deduper)
+    return doc
+
+def create_document_streaming(output_file, images_dict, max_image_width, max_image_height=4, image_options=None,
+                              on_image=None, deduper=None):
+    """Same layout as create_document, but written straight into the .docx as it is built.
+
+    Memory stays flat however many images the folder holds.
+    """
+    with open(output_file, 'wb') as output:
+        writer = StreamingDocxWriter(output)
+        try:
+            write_body(writer, output_file, images_dict, max_image_width, max_image_height, image_options, on_image,
+                       deduper)
+        except BaseException:
+            writer.abort()
+            raise
+        with span("doc_save", output=output_file):
+            writer.close()
+
+def document_bytes(name, images_dict, max_image_width, max_image_height=4, image_options=None, on_image=None,
+                   dedupe=None):
+    """Builds the document entirely in memory and returns the .docx bytes.
+
+    name is the document's heading; image_paths may hold IngestedImages (e.g. uploads)
+    as well as paths, so nothing has to touch the disk.
+    """
+    with Deduper(dedupe) as deduper:
+        doc = build_document(f"{name}.docx", images_dict, max_image_width, max_image_height, image_options, on_image,
+                             deduper)
+    output = io.BytesIO()
+    with span("doc_save", output=name):
+        doc.save(output)
+    return output.getvalue()
+
+def write_body(writer, output_file, images_dict, max_image_width, max_image_height, image_options=None, on_image=None,
+               deduper=None):
+    # writer is a BulkDocxWriter or a StreamingDocxWriter; both take the same XML.
+    # deduper (a dedupe.Deduper) leaves out or reports repeated images as they are reached
     folder_name = os.path.basename(output_file).replace('.docx', '')
-    doc.add_heading(folder_name, level=1)
+    writer.write_xml([heading_xml(folder_name, 1)])
 
-    for title, content in images_dict.items():
-        doc.add_heading(title, level=2)
-        max_image_width_for_layout = get_safe_max_image_width(max_image_width, content['layout'] == "Two Columns")
+    for title, group in images_dict.items():
+        with span("group", title=title, layout=group.layout, images=len(group.image_paths)):
+            writer.write_xml(group_xml(writer, group, max_image_width, max_image_height, image_options, on_image,
+                                       deduper))
 
-        if content['layout'] == "Two Columns":
-            add_images_to_doc_two_columns(doc, content, max_image_width_for_layout, max_image_height)
-        else:
-            add_images_to_doc_one_column(doc, content, max_image_width_for_layout, max_image_height)
+def group_xml(writer, group, max_image_width, max_image_height, image_options=None, on_image=None, deduper=None):
+    """Yields the body XML of one ImageGroup: heading, pictures (one per paragraph or
+    two per table row), the note and a blank paragraph. Images are embedded through
+    writer as they are reached."""
+    yield heading_xml(group.title, 2)
+    max_image_width_for_layout = get_safe_max_image_width(max_image_width, group.two_columns)
 
-        if isinstance(content['note'], str) and content['note']:
-            doc.add_paragraph(content['note'])
-        doc.add_paragraph()
+    pictures = embed_images(writer, group.image_paths, max_image_width_for_layout, max_image_height, image_options,
+                            on_image, deduper.group() if deduper is not None else None)
+    if group.two_columns:
+        column_width = writer.text_width_twips // 2
+        # Open across the yields: the writer consumes the rows as they come, so this times the whole table
+        with span("table", title=group.title, images=len(group.image_paths)):
+            yield table_start_xml(2, column_width)
+            for picture_xml in pictures:
+                yield table_row_xml([picture_xml, next(pictures, None)], column_width)
+            yield TABLE_END_XML
+    else:
+        for picture_xml in pictures:
+            if picture_xml:
+                yield picture_paragraph_xml(picture_xml)
 
-    if not save_document(doc, output_file):
-        # If the user canceled the save operation, return without proceeding further
-        return
+    if group.note:
+        yield paragraph_xml(group.note)
+    yield paragraph_xml()
 
-def save_document(doc, output_file):
-    """Attempts to save the document, prompting the user to retry or cancel if the file is open."""
-    saved = False
-    while not saved:
+def embed_images(writer, image_paths, max_image_width, max_image_height, image_options=None, on_image=None,
+                 dedupe_group=None):
+    # Yields each image's drawing XML in order, or None for an image that could not be added.
+    # dedupe_group (a dedupe.GroupDeduper) hashes each image from the bytes read to embed it
+    images = dedupe_group.checked(image_paths) if dedupe_group is not None else zip(image_paths, image_paths)
+    for image_path, image in images:
+        picture_xml = None if image is None else embed_image(writer, image, max_image_width, max_image_height,
+                                                             image_options)
+        if on_image:
+            on_image(image_path)
+        if image is not None:  # A dropped duplicate leaves no gap
+            yield picture_xml
+
+def embed_image(writer, image_path, max_image_width, max_image_height, image_options=None):
+    # Returns the drawing XML for one image, or None if it could not be added
+    image = None
+    if isinstance(image_path, IngestedImage):  # Already in memory, e.g. uploaded
+        image, image_path = image_path, image_path.path
+    with span("image", path=image_path):
         try:
-            doc.save(output_file)
-            saved = True  # If the save is successful, break the loop
-        except PermissionError:
-            # Show a warning dialog if the file is already open
-            root = tk.Tk()
-            root.withdraw()  # Hide the main tkinter window
-            response = messagebox.askretrycancel("Permission Denied", 
-                                                 f"The file '{output_file}' is already open. Please close it and try again.")
-            root.destroy()
-            
-            if not response:
-                print("User canceled the save operation.")
-                return False  # Return False to indicate that the user canceled the operation
-    return True  # Return True to indicate that the save was successful
-
-def add_images_to_doc_two_columns(doc, content, max_image_width, max_image_height):
-    table = doc.add_table(rows=0, cols=2)
-    for i in range(0, len(content['image_paths']), 2):
-        row_cells = table.add_row().cells
-        for j in range(2):
-            if i + j < len(content['image_paths']):
-                add_image_to_cell(row_cells[j], content['image_paths'][i + j], max_image_width, max_image_height)
-
-def add_images_to_doc_one_column(doc, content, max_image_width, max_image_height):
-    for image_path in content['image_paths']:
-        add_image_to_doc(doc, image_path, max_image_width, max_image_height)
-
-def add_image_to_cell(cell, image_path, max_image_width, max_image_height):
-    try:
-        with Image.open(image_path) as img:
-            width, height = img.size
-            ratio = min(max_image_width / width, max_image_height / height)
-
-            new_width = width * ratio
-            new_height = height * ratio
-
-            # Ensure the new dimensions are positive
-            if new_width > 0 and new_height > 0:
-                # Use the new width and height calculated from the aspect ratio
-                cell.paragraphs[0].add_run().add_picture(image_path, width=Inches(new_width), height=Inches(new_height))
-    except Exception as e:
-        logging.error(f"Error adding image to cell: {image_path} - {e}")
-
-def add_image_to_doc(doc, image_path, max_image_width, max_image_height):
-    try:
-        with Image.open(image_path) as img:
-            width, height = img.size
-            ratio = min(max_image_width / width, max_image_height / height)
-
-            new_width = width * ratio
-            new_height = height * ratio
-
-            # Ensure the new dimensions are positive
-            if new_width > 0 and new_height > 0:
-                # Use the new width and height calculated from the aspect ratio
-                doc.add_picture(image_path, width=Inches(new_width), height=Inches(new_height))
-    except Exception as e:
-        logging.error(f"Error adding image to document: {image_path} - {e}")
\ No newline at end of file
+            # The file is read once here; sizing, resampling and embedding all use that buffer
+            if image is None:
+                image = read_image(image_path)
+            size = fit_image_size(image, max_image_width, max_image_height)
+            if size is None:
+                count("images_skipped")
+                return None
+            new_width, new_height = size
+            picture = prepare_image(image, new_width, new_height, image_options)
+            with span("add_picture"):
+                picture_xml = writer.picture_xml(picture, inches_to_emu(new_width), inches_to_emu(new_height),
+                                                 os.path.basename(image.path))
+            record_embedded(picture)
+            return picture_xml
+        except Exception as e:
+            count("images_skipped")
+            logging.error(f"Error adding image to document: {image_path} - {e}")
+            return None
+
+def fit_image_size(image, max_image_width, max_image_height):
+    """Returns the (width, height) in inches the image is shown at, or None if it has no area.
+
+    image is anything with width and height in pixels (an IngestedImage or ImageInfo).
+    """
+    width, height = image.width, image.height
+    ratio = min(max_image_width / width, max_image_height / height)
+
+    new_width = width * ratio
+    new_height = height * ratio
+
+    # Ensure the new dimensions are positive
+    if new_width > 0 and new_height > 0:
+        return new_width, new_height
+    return None
+
+def record_embedded(picture):
+    # picture is the stream that went to add_picture: the original bytes or a prepared copy
+    count("images_embedded")
+    count("bytes_embedded", picture.getbuffer().nbytes)
+
+def save_document(doc, output_file):
+    with span("doc_save", output=output_file):
+        doc.save(output_file)
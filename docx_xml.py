@@ -0,0 +1,105 @@
+"""WordprocessingML fragments matching what python-docx writes for our layouts.
+
+The streaming writer emits these as text, so they must stay byte-compatible with
+add_heading, add_paragraph, add_picture and a python-docx add_table(rows=0, cols=2).
+"""
+from xml.sax.saxutils import escape
+
+EMU_PER_INCH = 914400
+TWIPS_PER_INCH = 1440
+
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+NS_PIC = "http://schemas.openxmlformats.org/drawingml/2006/picture"
+NS_R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+IMAGE_RELATIONSHIP = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+
+
+def inches_to_emu(inches):
+    # Same truncation as docx.shared.Inches
+    return int(inches * EMU_PER_INCH)
+
+
+def _text_runs(text):
+    # python-docx turns tabs and line breaks in run text into <w:tab/> and <w:br/>
+    parts = []
+    chunk = []
+
+    def flush():
+        if chunk:
+            value = "".join(chunk)
+            space = ' xml:space="preserve"' if value != value.strip() else ""
+            parts.append(f"<w:t{space}>{escape(value)}</w:t>")
+            chunk.clear()
+
+    for char in text:
+        if char == "\t":
+            flush()
+            parts.append("<w:tab/>")
+        elif char in "\r\n":
+            flush()
+            parts.append("<w:br/>")
+        else:
+            chunk.append(char)
+    flush()
+    return "".join(parts)
+
+
+def paragraph_xml(text="", style=None):
+    style_xml = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    if not text and not style:
+        return "<w:p/>"
+    run_xml = f"<w:r>{_text_runs(text)}</w:r>" if text else ""
+    return f"<w:p>{style_xml}{run_xml}</w:p>"
+
+
+def heading_xml(text, level):
+    return paragraph_xml(text, "Title" if level == 0 else f"Heading{level}")
+
+
+def hyperlink_xml(rel_id, text):
+    # A run linking to the target of relationship rel_id, looking like Word's own links
+    return (f'<w:hyperlink r:id="{rel_id}"><w:r><w:rPr><w:color w:val="0563C1"/><w:u w:val="single"/></w:rPr>'
+            f'{_text_runs(text)}</w:r></w:hyperlink>')
+
+
+def inline_picture_xml(shape_id, rel_id, filename, cx, cy):
+    return (
+        f'<w:drawing><wp:inline xmlns:a="{NS_A}" xmlns:pic="{NS_PIC}">'
+        f'<wp:extent cx="{cx}" cy="{cy}"/>'
+        f'<wp:docPr id="{shape_id}" name="Picture {shape_id}"/>'
+        '<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+        f'<a:graphic><a:graphicData uri="{NS_PIC}"><pic:pic>'
+        f'<pic:nvPicPr><pic:cNvPr id="0" name="{escape(filename, {chr(34): "&quot;"})}"/><pic:cNvPicPr/></pic:nvPicPr>'
+        f'<pic:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+        f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"/></pic:spPr>'
+        '</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing>'
+    )
+
+
+def picture_paragraph_xml(picture_xml):
+    return f"<w:p><w:r>{picture_xml}</w:r></w:p>"
+
+
+def table_start_xml(cols, col_width_twips):
+    grid = "".join(f'<w:gridCol w:w="{col_width_twips}"/>' for _ in range(cols))
+    return (
+        '<w:tbl><w:tblPr><w:tblW w:type="auto" w:w="0"/>'
+        '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/>'
+        f'</w:tblPr><w:tblGrid>{grid}</w:tblGrid>'
+    )
+
+
+def table_row_xml(cell_pictures, col_width_twips):
+    # One entry per column: the picture's drawing XML, or None for an empty cell
+    cells = []
+    for picture_xml in cell_pictures:
+        paragraph = picture_paragraph_xml(picture_xml) if picture_xml else "<w:p/>"
+        cells.append(f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{col_width_twips}"/></w:tcPr>{paragraph}</w:tc>')
+    return f"<w:tr>{''.join(cells)}</w:tr>"
+
+
+TABLE_END_XML = "</w:tbl>"
+
+
+def relationship_xml(rel_id, target, rel_type=IMAGE_RELATIONSHIP):
+    return f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="{target}"/>'
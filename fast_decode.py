@@ -0,0 +1,47 @@
+import math
+
+# Decoding stops at REDUCING_GAP times the target size; the final resample from there
+# is what keeps the quality, the reduced decode only drops pixels nobody would see
+REDUCING_GAP = 2.0
+# Images above this many pixels are refused before any decoding (None disables the check).
+# PIL has its own, higher limit (Image.MAX_IMAGE_PIXELS * 2) that applies regardless.
+DEFAULT_MAX_PIXELS = 150_000_000
+
+# Modes Image.reduce() can work on directly
+_REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'I', 'F')
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def check_pixels(size, max_pixels=DEFAULT_MAX_PIXELS):
+    """Raises ImageTooLargeError for a (width, height) beyond max_pixels."""
+    if max_pixels is not None and size[0] * size[1] > max_pixels:
+        raise ImageTooLargeError(f"{size[0]}x{size[1]} is more than {max_pixels} pixels")
+
+
+def decode_reduced(img, target_size, reducing_gap=REDUCING_GAP):
+    """Decodes an opened (not yet loaded) image at the smallest size still good for target_size.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale by the decoder itself (draft), which
+    saves both time and memory. Other formats are decoded in full and then shrunk by
+    an integer factor (reduce), which makes the final resample much cheaper. Returns
+    the loaded image, which may be a new object; it is never smaller than
+    target_size * reducing_gap unless the source is.
+    """
+    requested = (max(1, math.ceil(target_size[0] * reducing_gap)), max(1, math.ceil(target_size[1] * reducing_gap)))
+
+    if img.format == 'JPEG':
+        img.draft(None, requested)
+        img.load()
+        return img
+
+    img.load()
+    factor = min(img.width // requested[0], img.height // requested[1])
+    if factor < 2:
+        return img
+    if img.mode not in _REDUCIBLE_MODES:
+        # Palette and bilevel images have to be expanded before they can be averaged
+        img = img.convert('RGBA' if img.mode == 'P' else 'RGB' if img.mode == 'CMYK' else 'L')
+    return img.reduce(factor)
@@ -0,0 +1,94 @@
+import fnmatch
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from image_grouping import IMAGE_TYPES
+from instrumentation import count
+
+# Directory listings on network shares are latency bound, so far more threads than cores pay off
+DEFAULT_WORKERS = 16
+
+_DONE = object()
+
+
+def matches(patterns, relative_path, name):
+    # A pattern matches a folder's name ("raw*") or its path below the root ("2024/*/raw")
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
+
+
+def discover_image_folders(roots, image_types=IMAGE_TYPES, include=(), exclude=(), max_workers=DEFAULT_WORKERS,
+                           follow_symlinks=False):
+    """Walks the trees under roots concurrently and yields each folder that holds images.
+
+    Folders are yielded as soon as they have been listed, in no particular order,
+    so callers can start on them while the rest of the tree is still being walked.
+    Folders matching an exclude glob are not entered at all; with include globs,
+    only matching folders are yielded (their subfolders are still walked).
+    Unreadable folders are logged and skipped. Closing the generator stops the walk.
+    """
+    found = queue.SimpleQueue()
+    lock = threading.Lock()
+    state = {'pending': 1, 'stopped': False}  # 1 = the roots still being submitted
+    visited = set()  # Real paths, so symlink loops and overlapping roots are walked once
+
+    def submit(folder, root):
+        # Without following symlinks only the roots can overlap; realpath costs a stat per component
+        real_path = os.path.realpath(folder) if follow_symlinks or folder == root else folder
+        with lock:
+            if state['stopped'] or real_path in visited:
+                return
+            visited.add(real_path)
+            state['pending'] += 1
+        executor.submit(scan, folder, root)
+
+    def scan(folder, root):
+        try:
+            has_images = False
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if state['stopped']:
+                        break
+                    try:
+                        if entry.is_dir(follow_symlinks=follow_symlinks):
+                            relative_path = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                            if not matches(exclude, relative_path, entry.name):
+                                submit(entry.path, root)
+                        elif not has_images and entry.name.lower().endswith(image_types) and entry.is_file():
+                            has_images = True
+                    except OSError as e:
+                        logging.error(f"Error reading {entry.path}: {e}")
+            count("folders_scanned")
+
+            if has_images:
+                relative_path = os.path.relpath(folder, root).replace(os.sep, '/')
+                if not include or matches(include, relative_path, os.path.basename(folder)):
+                    found.put(folder)
+        except OSError as e:
+            logging.error(f"Error listing folder {folder}: {e}")
+        finally:
+            release()
+
+    def release():
+        with lock:
+            state['pending'] -= 1
+            finished = state['pending'] == 0
+        if finished:
+            found.put(_DONE)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="discovery")
+    try:
+        roots = [os.path.abspath(root) for root in roots]
+        for root in roots:
+            submit(root, root)
+        release()
+
+        while True:
+            folder = found.get()
+            if folder is _DONE:
+                return
+            yield folder
+    finally:
+        state['stopped'] = True
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,82 @@
+import os
+import threading
+from image_grouping import IMAGE_TYPES, extract_title
+from instrumentation import span
+
+
+class ImageEntry:
+    __slots__ = ('path', 'name', 'title')
+
+    def __init__(self, path, name, title):
+        self.path = path
+        self.name = name
+        self.title = title
+
+
+class FolderSnapshot:
+    def __init__(self, folder, mtime_ns, entries):
+        self.folder = folder
+        self.mtime_ns = mtime_ns  # Directory mtime the entries were listed at
+        self.entries = entries  # name -> ImageEntry, in listing order
+        self.groups = {}  # title -> [ImageEntry]
+        for entry in entries.values():
+            self.groups.setdefault(entry.title, []).append(entry)
+
+
+class FolderIndex:
+    """Remembers the image listing of each folder so it is only read once per change.
+
+    A folder is listed again (with os.scandir) only when its own mtime changes, i.e.
+    when files were added, removed or renamed; entries of files that were already
+    known are reused. Files are not stat'ed here: a file rewritten in place leaves the
+    folder's mtime alone, so its size and mtime are read fresh where they matter
+    (build_manifest.describe_build). Safe to share between the Tk thread and worker threads.
+    """
+
+    def __init__(self, image_types=IMAGE_TYPES):
+        self.image_types = image_types
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, folder):
+        mtime_ns = os.stat(folder).st_mtime_ns
+        with self._lock:
+            previous = self._snapshots.get(folder)
+        if previous is not None and previous.mtime_ns == mtime_ns:
+            return previous
+
+        with span("folder_scan", folder=folder):
+            snapshot = FolderSnapshot(folder, mtime_ns, self._scan(folder, previous))
+        with self._lock:
+            self._snapshots[folder] = snapshot
+        return snapshot
+
+    def groups(self, folder):
+        """Returns {title: [image_path, ...]} like image_grouping.group_images."""
+        return {title: [entry.path for entry in entries]
+                for title, entries in self.snapshot(folder).groups.items()}
+
+    def names(self, folder):
+        # {title: [file name, ...]}, for folder-relative storage such as PackedPaths
+        return {title: [entry.name for entry in entries]
+                for title, entries in self.snapshot(folder).groups.items()}
+
+    def paths(self, folder, title):
+        # Exact title match, so 'dd' never picks up 'dd5000_1.png'
+        return [entry.path for entry in self.snapshot(folder).groups.get(title, [])]
+
+    def _scan(self, folder, previous):
+        known = previous.entries if previous is not None else {}
+        entries = {}
+        with os.scandir(folder) as it:
+            for dir_entry in it:
+                name = dir_entry.name
+                if not name.lower().endswith(self.image_types):
+                    continue
+                if name in known:
+                    entries[name] = known[name]
+                    continue
+                if not dir_entry.is_file():
+                    continue
+                entries[name] = ImageEntry(dir_entry.path, name, extract_title(name))
+        return entries
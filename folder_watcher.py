@@ -0,0 +1,362 @@
+"""Watches folder trees and rebuilds their documents as new captures arrive.
+
+    python -m wordgenerator watch D:/captures --debounce 2
+
+On Linux the kernel reports changes through inotify (called through ctypes, no
+extra package); elsewhere, or when inotify is unavailable or out of watches,
+folders are polled by modification time instead. Either way the loop sleeps until
+something happens or a debounce deadline passes, so an idle watcher costs nothing.
+
+Only image files count as changes, so the documents, manifests and temporary
+files the builds write never set off another build, and the image caches and
+scratch folder are not watched at all. A burst of captures in a folder is built
+once, debounce seconds after the last of them (or max_delay after the first, if
+they keep coming); a folder changing while its build runs is built again in the
+next batch.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from folder_discovery import matches, discover_image_folders
+from image_grouping import IMAGE_TYPES
+from instrumentation import count
+
+DEFAULT_DEBOUNCE = 2.0  # Seconds a folder must be quiet before it is built
+DEFAULT_MAX_DELAY = 30.0  # Longest a folder that keeps changing waits for its build
+DEFAULT_POLL_INTERVAL = 5.0
+STOP_CHECK_INTERVAL = 1.0  # How often a stop event is looked at while idle
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of name
+READ_SIZE = 64 * 1024
+
+
+def _is_image(name):
+    return name.lower().endswith(IMAGE_TYPES)
+
+
+class _Tree:
+    # The roots being watched and the subtrees left out of them
+    def __init__(self, roots, exclude=(), ignore_dirs=()):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.exclude = exclude
+        self.ignore_dirs = [os.path.abspath(folder) for folder in ignore_dirs]
+
+    def root_of(self, folder):
+        return max((root for root in self.roots if folder == root or folder.startswith(root.rstrip(os.sep) + os.sep)),
+                   key=len, default=None)
+
+    def wanted(self, folder, root):
+        if any(folder == ignored or folder.startswith(ignored + os.sep) for ignored in self.ignore_dirs):
+            return False
+        if folder == root:
+            return True
+        return not matches(self.exclude, os.path.relpath(folder, root).replace(os.sep, '/'), os.path.basename(folder))
+
+    def walk(self, folder, root):
+        # Yields folder and every folder below it that is watched (symlinks are not followed)
+        stack = [folder]
+        while stack:
+            folder = stack.pop()
+            yield folder
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and self.wanted(entry.path, root):
+                            stack.append(entry.path)
+            except OSError as e:
+                logging.error(f"Error listing folder {folder}: {e}")
+
+
+class InotifyWatcher:
+    """Reports the folders whose images changed, as inotify tells it."""
+
+    def __init__(self, tree):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.libc = libc
+        self.tree = tree
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}  # watch descriptor -> folder
+        try:
+            for root in tree.roots:
+                self._watch_tree(root, root)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, folder, root):
+        # Returns the folders added; running out of watches is left to the caller
+        added = []
+        for path in self.tree.walk(folder, root):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOENT, errno.ENOTDIR):
+                    continue  # Removed again before the watch was in place
+                hint = " (raise fs.inotify.max_user_watches)" if error == errno.ENOSPC else ""
+                raise OSError(error, f"cannot watch {path}: {os.strerror(error)}{hint}")
+            self.folders[wd] = path
+            added.append(path)
+        return added
+
+    def wait(self, timeout=None):
+        """Blocks for up to timeout seconds (None: until something happens); returns the changed folders."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        changed = set()
+        while ready:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            self._handle(data, changed)
+        return changed
+
+    def _handle(self, data, changed):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0"))
+            offset += _EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # The kernel dropped events, so any folder may have changed
+                count("watch_overflows")
+                changed.update(self.folders.values())
+                continue
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)  # The folder is gone
+                continue
+            folder = self.folders.get(wd)
+            if folder is None:
+                continue
+
+            if mask & IN_ISDIR:
+                path = os.path.join(folder, name)
+                root = self.tree.root_of(path)
+                if mask & (IN_CREATE | IN_MOVED_TO) and root is not None and self.tree.wanted(path, root):
+                    # Captures may have landed in it before its watch was in place
+                    try:
+                        changed.update(self._watch_tree(path, root))
+                    except OSError as e:
+                        logging.error(f"Error watching {path}: {e}")
+            elif mask & IN_CREATE:
+                continue  # Reported again once the file is written and closed
+            elif _is_image(name):
+                changed.add(folder)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """Reports the folders whose images changed by looking at them every interval seconds.
+
+    Between polls an idle tree costs one stat per folder: a folder is listed again
+    only when its modification time moved, and stays on the list until its images
+    stop changing, as a file being written does not touch the folder's time.
+    Images replaced in place under the same name and size are not noticed.
+    """
+
+    def __init__(self, tree, interval=DEFAULT_POLL_INTERVAL):
+        self.tree = tree
+        self.interval = interval
+        self.folders = {}  # folder -> (mtime_ns, images as a frozenset of (name, size, mtime_ns))
+        self.unsettled = set()  # Folders whose images were still changing at the last poll
+        for root in tree.roots:
+            for folder in tree.walk(root, root):
+                self._look(folder)
+        self.next_poll = time.monotonic() + interval
+
+    def _look(self, folder):
+        # Records and returns (mtime_ns, images, new subfolders) for folder, or None if it is gone
+        subfolders = []
+        images = set()
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in self.folders:
+                            subfolders.append(entry.path)
+                    elif _is_image(entry.name):
+                        stat = entry.stat()
+                        images.add((entry.name, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            self.folders.pop(folder, None)
+            return None
+        except OSError as e:
+            logging.error(f"Error listing folder {folder}: {e}")
+            return None
+        images = frozenset(images)
+        self.folders[folder] = (mtime_ns, images)
+        return mtime_ns, images, subfolders
+
+    def wait(self, timeout=None):
+        """Sleeps until the next poll, or timeout seconds if that comes first; returns the changed folders."""
+        delay = self.next_poll - time.monotonic()
+        if timeout is not None and timeout < delay:
+            time.sleep(max(timeout, 0))
+            return set()
+        time.sleep(max(delay, 0))
+        self.next_poll = time.monotonic() + self.interval
+        return self.poll()
+
+    def poll(self):
+        changed = set()
+        for folder, (mtime_ns, images) in list(self.folders.items()):
+            if folder not in self.unsettled:
+                try:
+                    if os.stat(folder).st_mtime_ns == mtime_ns:
+                        continue
+                except OSError:
+                    self.folders.pop(folder, None)
+                    continue
+
+            looked = self._look(folder)
+            if looked is None:
+                self.unsettled.discard(folder)
+                continue
+            _, new_images, subfolders = looked
+            if new_images != images:
+                changed.add(folder)
+                self.unsettled.add(folder)
+            else:
+                self.unsettled.discard(folder)
+
+            root = self.tree.root_of(folder)
+            for subfolder in subfolders:
+                if root is not None and self.tree.wanted(subfolder, root):
+                    for path in self.tree.walk(subfolder, root):
+                        if path not in self.folders and self._look(path) is not None:
+                            changed.add(path)
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(tree, use_inotify=True, poll_interval=DEFAULT_POLL_INTERVAL):
+    if use_inotify:
+        try:
+            return InotifyWatcher(tree)
+        except (OSError, AttributeError, TypeError) as e:
+            # TypeError: no C library found (find_library returned None on some platforms)
+            # Printed, not logged: the log only keeps errors, and the slower polling is worth knowing about
+            print(f"warning: inotify unavailable ({e}); polling every {poll_interval:g}s instead",
+                  file=sys.stderr, flush=True)
+    return PollingWatcher(tree, poll_interval)
+
+
+class ChangeQueue:
+    """Folders waiting to be built, each once, until they have been quiet for debounce seconds."""
+
+    def __init__(self, debounce=DEFAULT_DEBOUNCE, max_delay=DEFAULT_MAX_DELAY):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.first_seen = {}  # folder -> when its first unbuilt change was seen
+        self.last_seen = {}  # folder -> when its latest change was seen
+
+    def __len__(self):
+        return len(self.first_seen)
+
+    def touch(self, folders, now):
+        for folder in folders:
+            self.first_seen.setdefault(folder, now)
+            self.last_seen[folder] = now
+
+    def _due_at(self, folder):
+        return min(self.last_seen[folder] + self.debounce, self.first_seen[folder] + self.max_delay)
+
+    def timeout(self, now):
+        # Seconds until the next folder is due, or None if nothing is waiting
+        if not self.first_seen:
+            return None
+        return max(min(self._due_at(folder) for folder in self.first_seen) - now, 0)
+
+    def pop_due(self, now):
+        due = [folder for folder in self.first_seen if self._due_at(folder) <= now]
+        for folder in due:
+            del self.first_seen[folder]
+            del self.last_seen[folder]
+        return due
+
+
+def _has_images(folder):
+    try:
+        with os.scandir(folder) as it:
+            return any(_is_image(entry.name) and entry.is_file() for entry in it)
+    except OSError:
+        return False
+
+
+def watch_folders(roots, build, include=(), exclude=(), ignore_dirs=(), debounce=DEFAULT_DEBOUNCE,
+                  max_delay=DEFAULT_MAX_DELAY, use_inotify=True, poll_interval=DEFAULT_POLL_INTERVAL,
+                  initial_build=True, stop=None):
+    """Calls build(folders) with each batch of changed image folders under roots, until stop is set.
+
+    include/exclude are globs as for discover_image_folders; ignore_dirs are
+    subtrees never watched (caches, scratch space). With initial_build, every image
+    folder is handed to build once at the start, for captures that arrived while
+    nothing was watching; build is expected to skip documents that are up to date.
+    stop is a threading.Event; without one, the watch runs until interrupted.
+    """
+    tree = _Tree(roots, exclude, ignore_dirs)
+    watcher = make_watcher(tree, use_inotify, poll_interval)
+    changes = ChangeQueue(debounce, max_delay)
+
+    def run(folders):
+        folders = [folder for folder in folders if _has_images(folder) and _included(tree, folder, include)]
+        if not folders:
+            return
+        count("watch_batches")
+        try:
+            build(sorted(folders))
+        except Exception as e:
+            # One bad batch must not end the watch
+            logging.error(f"Error building watched folders: {e}")
+
+    try:
+        if initial_build:
+            run([folder for folder in discover_image_folders(tree.roots, IMAGE_TYPES, include, exclude)
+                 if tree.wanted(folder, tree.root_of(folder))])
+
+        while stop is None or not stop.is_set():
+            timeout = changes.timeout(time.monotonic())
+            if stop is not None:
+                timeout = STOP_CHECK_INTERVAL if timeout is None else min(timeout, STOP_CHECK_INTERVAL)
+            changed = watcher.wait(timeout)
+            now = time.monotonic()
+            changes.touch(changed, now)
+            run(changes.pop_due(now))
+    finally:
+        watcher.close()
+
+
+def _included(tree, folder, include):
+    if not include:
+        return True
+    root = tree.root_of(folder)
+    return root is not None and matches(include, os.path.relpath(folder, root).replace(os.sep, '/'),
+                                         os.path.basename(folder))
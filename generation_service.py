@@ -0,0 +1,314 @@
+"""Local HTTP service that builds documents for other tools.
+
+    python -m wordgenerator serve --port 8765 --workers 4
+
+    POST /jobs     JSON job (below); answers with the .docx bytes
+    GET  /health   JSON status and pool occupancy
+    GET  /metrics  Prometheus text format
+
+A job names a folder on this machine or carries the images itself:
+
+    {
+        "folder": "D:/captures/tc1",                  (or)
+        "images": [{"name": "login_1.png", "data": "<base64>"}, ...],
+        "name": "tc1",                                heading; defaults to the folder name
+        "layout": "two",                              default layout for every title
+        "layouts": {"login": "single"},
+        "notes": {"login": "Login flow"},
+        "max_image_width": 5,
+        "dpi": 200, "recompress": "jpeg", "jpeg_quality": 85,
+        "dedupe": "drop", "dedupe_threshold": 8
+    }
+
+Documents are built by a pool of warm worker processes, entirely in memory. At
+most workers + queue_size jobs are accepted at a time; beyond that the service
+answers 503 with Retry-After straight away instead of letting callers pile up.
+"""
+import base64
+import binascii
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dedupe import DEFAULT_THRESHOLD, DedupeOptions
+from document_generator import document_bytes
+from image_grouping import IMAGE_TYPES, LAYOUTS, compile_images, extract_title
+from image_ingest import ingest_bytes
+from image_prep import DEFAULT_DPI, DEFAULT_JPEG_QUALITY, ImagePrepOptions
+from image_manifest import ImageGroup, ImageManifest
+from parallel_generator import _init_worker, default_worker_count
+from wordgenerator import DEFAULT_MAX_IMAGE_WIDTH, LAYOUT_ALIASES
+import instrumentation
+from instrumentation import METRIC_PREFIX, count, span
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 16  # Jobs waiting for a worker on top of the ones being built
+MAX_REQUEST_BYTES = 512 * 1024 * 1024
+RESPONSE_CHUNK_BYTES = 1024 * 1024
+RETRY_AFTER_SECONDS = 1
+
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+class JobError(ValueError):
+    """A job the service cannot build as described; reported as 400."""
+
+
+def _layout(value):
+    layout = LAYOUT_ALIASES.get(str(value).lower(), value)
+    if layout not in LAYOUTS:
+        raise JobError(f"unknown layout '{value}' (use single or two)")
+    return layout
+
+
+def _titled(job, key):
+    # layouts and notes map titles to values
+    value = job.get(key, {})
+    if not isinstance(value, dict):
+        raise JobError(f"{key} must be an object of title: value")
+    return value
+
+
+def parse_job(job):
+    """Turns a job's JSON into (name, images_dict, max_image_width, image_options, dedupe)."""
+    if not isinstance(job, dict):
+        raise JobError("job must be a JSON object")
+
+    default_layout = _layout(job.get('layout', "Single Column"))
+    layouts = {title: _layout(layout) for title, layout in _titled(job, 'layouts').items()}
+    notes = _titled(job, 'notes')
+    if not all(isinstance(note, str) for note in notes.values()):
+        raise JobError("notes must be text")
+
+    if 'folder' in job:
+        folder = job['folder']
+        if not isinstance(folder, str) or not os.path.isdir(folder):
+            raise JobError(f"folder not found: {folder}")
+        try:
+            images_dict = compile_images(folder, layouts, notes, IMAGE_TYPES, default_layout)
+        except OSError as e:
+            raise JobError(f"cannot read folder {folder}: {e}")
+        name = job.get('name') or os.path.basename(os.path.normpath(folder))
+    elif 'images' in job:
+        images_dict = _uploaded_images_dict(job['images'], layouts, notes, default_layout)
+        name = job.get('name') or "images"
+    else:
+        raise JobError("job needs a folder or images")
+
+    try:
+        max_image_width = float(job.get('max_image_width', DEFAULT_MAX_IMAGE_WIDTH))
+        dpi = job.get('dpi', DEFAULT_DPI)
+        # No disk caches: a job is built entirely in memory
+        image_options = ImagePrepOptions(dpi=int(dpi) if dpi else None,  # 0 embeds the originals
+                                         recompress=job.get('recompress'),
+                                         jpeg_quality=int(job.get('jpeg_quality', DEFAULT_JPEG_QUALITY)),
+                                         cache_dir=None)
+        dedupe = DedupeOptions(job.get('dedupe', 'off'), int(job.get('dedupe_threshold', DEFAULT_THRESHOLD)),
+                               cache_file=None)
+    except (TypeError, ValueError) as e:
+        raise JobError(str(e))
+    if max_image_width <= 0:
+        raise JobError("max_image_width must be positive")
+    return str(name), images_dict, max_image_width, image_options, dedupe
+
+
+def _uploaded_images_dict(images, layouts, notes, default_layout):
+    # Same grouping as compile_images, by the part of the name before the first '_'
+    if not isinstance(images, list) or not images:
+        raise JobError("images must be a non-empty list")
+    if not all(isinstance(upload, dict) and isinstance(upload.get('name'), str) and 'data' in upload for upload in images):
+        raise JobError("each image needs a name and base64 data")
+
+    images_dict = ImageManifest()
+    for upload in sorted(images, key=lambda upload: upload['name']):
+        name = upload['name']
+        if not name.lower().endswith(IMAGE_TYPES):
+            raise JobError(f"{name} is not a {'/'.join(IMAGE_TYPES)} image")
+        try:
+            image = ingest_bytes(name, base64.b64decode(upload['data'], validate=True))
+        except (binascii.Error, ValueError) as e:
+            raise JobError(f"{name}: {e}")
+        except OSError:
+            raise JobError(f"{name} is not a readable image")
+
+        title = extract_title(name)
+        if title not in images_dict:
+            images_dict.add(ImageGroup(title, [], layouts.get(title, default_layout), notes.get(title, '')))
+        images_dict[title].image_paths.append(image)
+    return images_dict
+
+
+def render_job(name, images_dict, max_image_width, image_options, dedupe=None):
+    # Runs inside a worker process; the metrics travel back with the document
+    with span("service_render", document=name):
+        data = document_bytes(name, images_dict, max_image_width, image_options=image_options, dedupe=dedupe)
+    return data, instrumentation.snapshot(reset=True)
+
+
+def _warm_up():
+    # Gives each worker process a job to start on, so the first caller does not pay for it
+    return os.getpid()
+
+
+class GenerationService(ThreadingHTTPServer):
+    """HTTP server handing jobs to a bounded pool of document-building processes."""
+
+    daemon_threads = True
+
+    def __init__(self, address=(DEFAULT_HOST, DEFAULT_PORT), workers=None, queue_size=DEFAULT_QUEUE_SIZE):
+        self.workers = workers or default_worker_count()
+        self.capacity = self.workers + queue_size
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.lock = threading.Lock()
+        self.active = 0  # Jobs accepted and not yet answered
+        self.started = time.time()
+        super().__init__(address, GenerationRequestHandler)
+        # Started once the address is bound, so a port in use leaves no processes behind
+        self.executor = self._start_pool()
+
+    def _start_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                       initargs=(instrumentation.worker_config(), None, None))
+        for _ in range(self.workers):
+            executor.submit(_warm_up)
+        return executor
+
+    def try_accept(self):
+        # Never blocks: a full pool is the caller's cue to back off
+        if not self.slots.acquire(blocking=False):
+            return False
+        with self.lock:
+            self.active += 1
+        return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+        self.slots.release()
+
+    def render(self, name, images_dict, max_image_width, image_options, dedupe=None):
+        executor = self.executor
+        try:
+            data, metrics = executor.submit(render_job, name, images_dict, max_image_width, image_options,
+                                            dedupe).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); later jobs get a fresh pool
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = self._start_pool()
+            executor.shutdown(wait=False)
+            raise
+        instrumentation.merge(metrics)
+        return data
+
+    def health(self):
+        with self.lock:
+            active = self.active
+        return {'status': "ok", 'workers': self.workers, 'active': active, 'capacity': self.capacity,
+                'uptime': round(time.time() - self.started, 1)}
+
+    def metrics_text(self):
+        health = self.health()
+        gauges = [f"# TYPE {METRIC_PREFIX}_service_active_jobs gauge",
+                  f"{METRIC_PREFIX}_service_active_jobs {health['active']}",
+                  f"# TYPE {METRIC_PREFIX}_service_capacity gauge",
+                  f"{METRIC_PREFIX}_service_capacity {health['capacity']}"]
+        return instrumentation.prometheus_text() + "\n".join(gauges) + "\n"
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    server_version = "wordgenerator"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, self.server.health())
+        elif self.path == "/metrics":
+            self._send(200, "text/plain; version=0.0.4", self.server.metrics_text().encode('utf-8'))
+        else:
+            self._send_json(404, {'error': f"no such endpoint: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self._send_json(404, {'error': f"no such endpoint: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._send_json(411, {'error': "Content-Length required"})
+            return
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True  # The body is not read, so the connection cannot be reused
+            self._send_json(413, {'error': f"request larger than {MAX_REQUEST_BYTES} bytes"})
+            return
+        # Accepted before the body is read, so a busy service never buffers what it turns away
+        if not self.server.try_accept():
+            count("service_jobs_rejected")
+            self.close_connection = True  # The body is not read, so the connection cannot be reused
+            self._send_json(503, {'error': "all workers busy, retry later"},
+                            {'Retry-After': str(RETRY_AFTER_SECONDS)})
+            return
+        try:
+            body = self.rfile.read(length)
+            with span("service_job"):
+                try:
+                    name, images_dict, max_image_width, image_options, dedupe = parse_job(json.loads(body))
+                except (JobError, json.JSONDecodeError, UnicodeDecodeError) as e:
+                    count("service_jobs_invalid")
+                    self._send_json(400, {'error': str(e)})
+                    return
+                try:
+                    data = self.server.render(name, images_dict, max_image_width, image_options, dedupe)
+                except Exception as e:
+                    logging.error(f"Error generating document {name}: {e}")
+                    count("service_jobs_failed")
+                    self._send_json(500, {'error': str(e)})
+                    return
+        finally:
+            self.server.release()
+
+        count("service_jobs_done")
+        self._send(200, DOCX_CONTENT_TYPE, data,
+                   {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(name + '.docx')}"})
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, "application/json", json.dumps(payload).encode('utf-8'), headers)
+
+    def _send(self, status, content_type, data, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        # Written in slices so a large document goes out as it is copied, not as one huge send
+        view = memoryview(data)
+        for offset in range(0, len(view), RESPONSE_CHUNK_BYTES):
+            self.wfile.write(view[offset:offset + RESPONSE_CHUNK_BYTES])
+
+    def log_message(self, format, *args):
+        # Access logging stays off; errors go through logging like everywhere else
+        pass
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, queue_size=DEFAULT_QUEUE_SIZE):
+    with GenerationService((host, port), workers, queue_size) as service:
+        print(f"Serving on http://{host}:{service.server_address[1]} with {service.workers} worker(s)", flush=True)
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,120 @@
+import logging
+import os
+from tkinter import Frame, Label
+from PIL import ImageTk
+from thumbnail_cache import THUMBNAIL_SIZE
+
+CELL_PADDING = 5
+CELL_WIDTH = THUMBNAIL_SIZE[0] + 4 + 2 * CELL_PADDING  # Label border included
+CELL_HEIGHT = THUMBNAIL_SIZE[1] + 4 + 2 * CELL_PADDING
+OVERSCAN_ROWS = 2  # Rows kept alive above and below the viewport for smooth scrolling
+
+
+class VirtualImageGrid:
+    """Thumbnail grid that only creates widgets for rows near the visible viewport.
+
+    The frame is sized for every row up front so the scrollbar stays accurate, but
+    Labels and PhotoImages exist only for visible cells. Cells that scroll away hand
+    their Label back to a small pool and drop their PhotoImage, so memory and redraw
+    cost depend on the window size, not on how many images the folder holds.
+    """
+
+    def __init__(self, parent, image_paths, columns, loader, placeholder_image):
+        self.image_paths = image_paths
+        self.columns = columns
+        self.loader = loader
+        self.placeholder_image = placeholder_image
+        self.cells = {}  # index -> Label currently showing that image
+        self.requests = {}  # index -> pending thumbnail future
+        self.pool = []  # Hidden Labels ready for reuse
+
+        self.frame = Frame(parent)
+        self.frame.pack(pady=5, anchor="w")
+        self.frame.pack_propagate(False)
+        self._resize()
+
+    @property
+    def rows(self):
+        return (len(self.image_paths) + self.columns - 1) // self.columns
+
+    def set_columns(self, columns):
+        if columns == self.columns:
+            return
+        self.columns = columns
+        self._resize()
+        for index, label in self.cells.items():
+            self._place(label, index)
+
+    def update_viewport(self, canvas):
+        """Shows the rows that intersect the canvas viewport and releases the others."""
+        if not self.frame.winfo_ismapped():
+            self.release_all()
+            return
+
+        # Viewport edges in this grid's coordinates
+        top = canvas.winfo_rooty() - self.frame.winfo_rooty()
+        bottom = top + canvas.winfo_height()
+        first_row = max(0, top // CELL_HEIGHT - OVERSCAN_ROWS)
+        last_row = min(self.rows - 1, bottom // CELL_HEIGHT + OVERSCAN_ROWS)
+
+        if last_row < first_row:
+            self.release_all()
+            return
+
+        wanted = range(first_row * self.columns, min(len(self.image_paths), (last_row + 1) * self.columns))
+        for index in [index for index in self.cells if index not in wanted]:
+            self._hide(index)
+        for index in wanted:
+            if index not in self.cells:
+                self._show(index)
+
+    def release_all(self):
+        # Off-screen grids keep no widgets or images at all
+        for index in list(self.cells):
+            self._hide(index)
+        for label in self.pool:
+            label.destroy()
+        self.pool.clear()
+
+    def _resize(self):
+        self.frame.config(width=self.columns * CELL_WIDTH, height=max(1, self.rows * CELL_HEIGHT))
+
+    def _place(self, label, index):
+        row, column = divmod(index, self.columns)
+        label.place(x=column * CELL_WIDTH + CELL_PADDING, y=row * CELL_HEIGHT + CELL_PADDING)
+
+    def _show(self, index):
+        label = self.pool.pop() if self.pool else Label(self.frame)
+        label.config(image=self.placeholder_image, text="", fg="black")
+        label.image = None
+        self._place(label, index)
+        self.cells[index] = label
+
+        image_path = self.image_paths[index]
+        self.requests[index] = self.loader.request(
+            image_path, lambda img, error: self._on_loaded(index, label, image_path, img, error))
+
+    def _hide(self, index):
+        label = self.cells.pop(index)
+        future = self.requests.pop(index, None)
+        if future is not None:
+            future.cancel()
+        label.place_forget()
+        label.config(image=self.placeholder_image, text="")
+        label.image = None  # Release the PhotoImage
+        self.pool.append(label)
+
+    def _on_loaded(self, index, label, image_path, img, error):
+        # The cell may have scrolled away (and its Label been reused) while decoding
+        if self.cells.get(index) is not label or not label.winfo_exists():
+            return
+        self.requests.pop(index, None)
+
+        if error is not None:
+            logging.error(f"Error loading image {image_path}: {error}")
+            label.config(image="", text="Could not load\n" + os.path.basename(image_path), fg="red")
+            return
+
+        img_tk = ImageTk.PhotoImage(img)
+        label.config(image=img_tk)
+        label.image = img_tk  # Keep a reference while the cell is visible
@@ -0,0 +1,39 @@
+from image_manifest import SINGLE_COLUMN, TWO_COLUMNS, ImageGroup, ImageManifest, PackedPaths
+
+IMAGE_TYPES = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+LAYOUTS = (SINGLE_COLUMN, TWO_COLUMNS)
+
+
+def extract_title(filename):
+    # Images are grouped by the part of the filename before the first '_'
+    return filename.split('_')[0]
+
+
+def group_images(folder, image_types=IMAGE_TYPES, index=None):
+    """Returns {title: [image_path, ...]} for the images directly inside folder.
+
+    Pass a shared FolderIndex to avoid listing the same folder again.
+    """
+    if index is None:
+        from folder_index import FolderIndex  # folder_index imports this module
+        index = FolderIndex(image_types)
+    return index.groups(folder)
+
+
+def compile_images(folder, layouts, notes, image_types=IMAGE_TYPES, default_layout=None, index=None):
+    """Builds the ImageManifest consumed by create_document.
+
+    Titles missing from layouts are skipped unless a default_layout is given.
+    notes holds strings; titles without one get no note.
+    """
+    if index is None:
+        from folder_index import FolderIndex  # folder_index imports this module
+        index = FolderIndex(image_types)
+
+    manifest = ImageManifest()
+    for title, names in index.names(folder).items():
+        layout = layouts.get(title, default_layout)
+        if layout is None:
+            continue
+        manifest.add(ImageGroup(title, PackedPaths(folder, names), layout, notes.get(title, '')))
+    return manifest
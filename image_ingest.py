@@ -0,0 +1,195 @@
+"""Reads each image once and gets its size from the file header.
+
+    image = read_image(path)        # one read; width/height from the header
+    doc.add_picture(image.stream())  # the same bytes, no second read
+
+Dimensions (and, once computed, the SHA-256) are cached per (path, mtime, size),
+so probing an unchanged file again costs a stat and no read at all.
+"""
+import hashlib
+import io
+import os
+import struct
+import threading
+from collections import OrderedDict
+from instrumentation import count, span
+
+PROBE_CACHE_ENTRIES = 16384
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...); C4, C8 and CC are not frames
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers that stand alone, without a length field
+_JPEG_STANDALONE_MARKERS = frozenset(range(0xD0, 0xDA)) | {0x01}
+
+
+class ImageInfo:
+    __slots__ = ('format', 'width', 'height', 'sha256')
+
+    def __init__(self, format, width, height, sha256=None):
+        self.format = format  # PIL's format name: 'PNG', 'JPEG', 'GIF' or 'BMP'
+        self.width = width
+        self.height = height
+        self.sha256 = sha256
+
+
+class IngestedImage:
+    """The bytes of one image file together with its header information."""
+
+    __slots__ = ('path', 'data', 'info')
+
+    def __init__(self, path, data, info):
+        self.path = path
+        self.data = data
+        self.info = info
+
+    @property
+    def width(self):
+        return self.info.width
+
+    @property
+    def height(self):
+        return self.info.height
+
+    @property
+    def format(self):
+        return self.info.format
+
+    def stream(self):
+        # BytesIO shares the bytes until written to, so this does not copy the image
+        return io.BytesIO(self.data)
+
+    def sha256(self):
+        if self.info.sha256 is None:
+            self.info.sha256 = hashlib.sha256(self.data).hexdigest()
+        return self.info.sha256
+
+
+_cache = OrderedDict()  # (path, mtime_ns, size) -> ImageInfo
+_cache_lock = threading.Lock()
+
+
+def _cache_key(path, stat):
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _cached(key):
+    with _cache_lock:
+        info = _cache.get(key)
+        if info is not None:
+            _cache.move_to_end(key)
+        return info
+
+
+def _remember(key, info):
+    with _cache_lock:
+        _cache[key] = info
+        _cache.move_to_end(key)
+        while len(_cache) > PROBE_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def parse_header(f):
+    """Returns ImageInfo for the PNG, JPEG, GIF or BMP file f, reading only its header.
+
+    Raises ValueError for other formats or headers it cannot make sense of.
+    """
+    head = f.read(26)
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", head[16:24])
+        return ImageInfo('PNG', width, height)
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        width, height = struct.unpack("<HH", head[6:10])
+        return ImageInfo('GIF', width, height)
+    if head.startswith(b"BM") and len(head) >= 26:
+        header_size = struct.unpack("<I", head[14:18])[0]
+        if header_size == 12:  # OS/2 BITMAPCOREHEADER
+            width, height = struct.unpack("<HH", head[18:22])
+        else:
+            width, height = struct.unpack("<ii", head[18:26])
+        # A negative height marks a top-down bitmap
+        return ImageInfo('BMP', width, abs(height))
+    if head.startswith(b"\xff\xd8"):
+        f.seek(2)
+        return _parse_jpeg(f)
+    raise ValueError("unsupported image format")
+
+
+def _parse_jpeg(f):
+    # Walks the marker segments up to the first start-of-frame, seeking over the rest
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise ValueError("no JPEG frame header")
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":  # Fill bytes
+            marker = f.read(1)
+        if not marker:
+            raise ValueError("truncated JPEG")
+        marker = marker[0]
+        if marker in _JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            raise ValueError("truncated JPEG")
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                raise ValueError("truncated JPEG")
+            height, width = struct.unpack(">HH", frame[1:5])
+            return ImageInfo('JPEG', width, height)
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _parse_or_decode(f):
+    try:
+        return parse_header(f)
+    except (ValueError, struct.error):
+        # Let PIL have a go at anything the header parser does not know
+        from PIL import Image
+        f.seek(0)
+        with Image.open(f) as img:
+            return ImageInfo(img.format, img.width, img.height)
+
+
+def probe(path):
+    """Returns ImageInfo for path, reading no more of the file than its header."""
+    stat = os.stat(path)
+    key = _cache_key(path, stat)
+    info = _cached(key)
+    if info is None:
+        with span("image_probe"):
+            with open(path, 'rb') as f:
+                info = _parse_or_decode(f)
+        _remember(key, info)
+    return info
+
+
+def read_image(path):
+    """Reads path into memory once; returns an IngestedImage."""
+    with span("image_read"):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            data = f.read()
+    count("bytes_read", len(data))
+
+    key = _cache_key(path, stat)
+    info = _cached(key)
+    if info is None:
+        info = _parse_or_decode(io.BytesIO(data))
+        _remember(key, info)
+    return IngestedImage(path, data, info)
+
+
+def ingest_bytes(name, data):
+    """Wraps image bytes that did not come from a file (e.g. an upload); nothing is cached."""
+    return IngestedImage(name, data, _parse_or_decode(io.BytesIO(data)))
+
+
+def known_sha256(path, size, mtime_ns):
+    """The SHA-256 of path if it was already computed for this exact version of the file."""
+    with _cache_lock:
+        info = _cache.get((os.path.abspath(path), mtime_ns, size))
+    return info.sha256 if info is not None else None
@@ -0,0 +1,147 @@
+"""What goes into one document: its title groups, their layout and note, and their images.
+
+compile_images builds an ImageManifest per folder and create_document consumes it.
+It holds nothing but strings and numbers, so it travels to worker processes as is:
+pickling it costs one string and one array per group, however many images the
+group has. to_json()/from_json() give the same contents as plain JSON.
+"""
+import os
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from itertools import accumulate
+
+SINGLE_COLUMN = "Single Column"
+TWO_COLUMNS = "Two Columns"
+
+
+class PackedPaths(Sequence):
+    """Paths of files in one folder, kept as the folder plus one string of all their names.
+
+    A list of 100,000 path strings costs a string object per path, each repeating
+    the folder; here each name costs its characters and a 4-byte end offset. Paths
+    are joined up again as they are read.
+    """
+
+    __slots__ = ('folder', '_names', '_ends')
+
+    def __init__(self, folder, names=()):
+        names = list(names)
+        self.folder = sys.intern(folder)  # Shared by every group and manifest of the folder
+        self._names = "".join(names)
+        self._ends = array('I', accumulate(map(len, names)))
+
+    @classmethod
+    def _from_parts(cls, folder, names, ends):
+        packed = cls.__new__(cls)
+        packed.folder, packed._names, packed._ends = sys.intern(folder), names, ends
+        return packed
+
+    def __len__(self):
+        return len(self._ends)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return os.path.join(self.folder, self.name(index))
+
+    def __iter__(self):
+        start = 0
+        for end in self._ends:
+            yield os.path.join(self.folder, self._names[start:end])
+            start = end
+
+    def __reduce__(self):
+        return PackedPaths._from_parts, (self.folder, self._names, self._ends)
+
+    def name(self, index):
+        if index < 0:
+            index += len(self._ends)
+        if not 0 <= index < len(self._ends):
+            raise IndexError("path index out of range")
+        return self._names[self._ends[index - 1] if index else 0:self._ends[index]]
+
+    def names(self):
+        return [self.name(i) for i in range(len(self))]
+
+
+class ImageGroup:
+    """One title group. image_paths is a PackedPaths or any sequence of paths (or IngestedImages)."""
+
+    __slots__ = ('title', 'layout', 'note', 'image_paths')
+
+    def __init__(self, title, image_paths=(), layout=SINGLE_COLUMN, note=''):
+        if not isinstance(note, str):
+            raise TypeError(f"note for {title} must be a string, not {type(note).__name__}")
+        self.title = sys.intern(title)
+        self.image_paths = image_paths
+        self.layout = sys.intern(layout)
+        self.note = note
+
+    @property
+    def two_columns(self):
+        return self.layout == TWO_COLUMNS
+
+    def replace(self, **changes):
+        # A copy with some fields changed, e.g. replace(image_paths=kept)
+        fields = {name: getattr(self, name) for name in ('title', 'image_paths', 'layout', 'note')}
+        fields.update(changes)
+        return ImageGroup(**fields)
+
+    def to_json(self):
+        group = {'title': self.title, 'layout': self.layout, 'note': self.note}
+        if isinstance(self.image_paths, PackedPaths):
+            group['folder'] = self.image_paths.folder
+            group['names'] = self.image_paths.names()
+        else:
+            group['image_paths'] = list(self.image_paths)
+        return group
+
+    @classmethod
+    def from_json(cls, group):
+        if 'names' in group:
+            image_paths = PackedPaths(group['folder'], group['names'])
+        else:
+            image_paths = group['image_paths']
+        return cls(group['title'], image_paths, group.get('layout', SINGLE_COLUMN), group.get('note', ''))
+
+    def __repr__(self):
+        return f"ImageGroup({self.title!r}, {len(self.image_paths)} image(s), layout={self.layout!r})"
+
+
+class ImageManifest(Mapping):
+    """Title -> ImageGroup, in document order."""
+
+    __slots__ = ('groups',)
+
+    def __init__(self, groups=()):
+        self.groups = {}
+        for group in groups:
+            self.add(group)
+
+    def add(self, group):
+        if group.title in self.groups:
+            raise ValueError(f"duplicate title group {group.title!r}")
+        self.groups[group.title] = group
+
+    def __getitem__(self, title):
+        return self.groups[title]
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def image_count(self):
+        return sum(len(group.image_paths) for group in self.groups.values())
+
+    def to_json(self):
+        return {'groups': [group.to_json() for group in self.groups.values()]}
+
+    @classmethod
+    def from_json(cls, manifest):
+        return cls(ImageGroup.from_json(group) for group in manifest['groups'])
+
+    def __repr__(self):
+        return f"ImageManifest({len(self)} group(s), {self.image_count()} image(s))"
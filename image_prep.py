@@ -0,0 +1,166 @@
+import hashlib
+import io
+import logging
+import math
+import os
+from fast_decode import DEFAULT_MAX_PIXELS, check_pixels, decode_reduced
+from instrumentation import count, span
+from preferences import CACHE_DIR
+from thumbnail_cache import DEFAULT_DISK_BUDGET, cache_entries, prune_cache
+
+CACHE_EXTENSIONS = ('.jpg', '.png')
+
+DEFAULT_DPI = 200
+DEFAULT_JPEG_QUALITY = 85
+RECOMPRESS_FORMATS = ('jpeg', 'png')
+
+
+class ImagePrepOptions:
+    """How images are resampled and re-encoded before they are embedded.
+
+    dpi=None embeds the original files untouched. recompress is None (keep the
+    source format), 'jpeg' or 'png' (optimized). cache_dir=None disables the cache;
+    it is kept under cache_budget bytes by dropping the least recently used files.
+    Images above max_pixels are refused (see fast_decode.check_pixels).
+    """
+
+    def __init__(self, dpi=DEFAULT_DPI, recompress=None, jpeg_quality=DEFAULT_JPEG_QUALITY,
+                 cache_dir=os.path.join(CACHE_DIR, "images"), max_pixels=DEFAULT_MAX_PIXELS,
+                 cache_budget=DEFAULT_DISK_BUDGET):
+        if recompress is not None and recompress not in RECOMPRESS_FORMATS:
+            raise ValueError(f"recompress must be one of {RECOMPRESS_FORMATS}, got {recompress!r}")
+        self.dpi = dpi
+        self.recompress = recompress
+        self.jpeg_quality = jpeg_quality
+        self.cache_dir = cache_dir
+        self.max_pixels = max_pixels
+        self.cache_budget = cache_budget
+
+
+def target_pixels(width_in, height_in, dpi):
+    return max(1, math.ceil(width_in * dpi)), max(1, math.ceil(height_in * dpi))
+
+
+def _output_format(source_format, recompress):
+    if recompress:
+        return recompress.upper()
+    # GIF and BMP are re-encoded as PNG; BMP is uncompressed and Word only shows the first GIF frame
+    return 'JPEG' if source_format == 'JPEG' else 'PNG'
+
+
+def _cache_path(options, source_hash, size, output_format):
+    settings = f"{size[0]}x{size[1]}:{output_format}:{options.jpeg_quality if output_format == 'JPEG' else ''}"
+    key = hashlib.sha256(f"{source_hash}:{settings}".encode()).hexdigest()
+    extension = '.jpg' if output_format == 'JPEG' else '.png'
+    return os.path.join(options.cache_dir, key[:2], key + extension)
+
+
+# Bytes in each cache directory as this process last counted them; measured lazily on the first write
+_cache_bytes = {}
+
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file, 'rb') as f:
+            data = f.read()
+        os.utime(cache_file)  # Mark as recently used for pruning
+        return data
+    except OSError:
+        return None
+
+
+def _write_cache(options, cache_file, data):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Write under a temporary name first so concurrent workers never see a partial file
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logging.error(f"Error writing image cache {cache_file}: {e}")
+        return
+
+    cache_dir = options.cache_dir
+    if cache_dir in _cache_bytes:
+        _cache_bytes[cache_dir] += len(data)
+    else:
+        _cache_bytes[cache_dir] = sum(size for _, _, size in cache_entries(cache_dir, CACHE_EXTENSIONS))
+    if _cache_bytes[cache_dir] > options.cache_budget:
+        _cache_bytes[cache_dir] = prune_cache(cache_dir, options.cache_budget, CACHE_EXTENSIONS)
+
+
+def _encode(img, size, output_format, options):
+    from PIL import Image
+    # Palette and bilevel images would only get nearest-neighbour resampling
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    elif img.mode == '1':
+        img = img.convert('L')
+
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+
+    if output_format == 'JPEG':
+        if img.mode in ('RGBA', 'LA'):
+            # JPEG has no alpha channel; flatten onto white like Word would show it
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        save_kwargs = {'quality': options.jpeg_quality, 'optimize': True}
+    else:
+        if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+            img = img.convert('RGBA')
+        save_kwargs = {'optimize': True}
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=output_format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def prepare_image(image, width_in, height_in, options):
+    """Returns the stream to pass to add_picture for an image shown at width_in x height_in.
+
+    image is an image_ingest.IngestedImage. The stream holds either its original bytes
+    (already small enough, nothing to re-encode) or the resampled image. Raises
+    ImageTooLargeError for images beyond options.max_pixels.
+    """
+    if options is None or options.dpi is None:
+        return image.stream()
+    check_pixels((image.width, image.height), options.max_pixels)
+
+    target = target_pixels(width_in, height_in, options.dpi)
+    # Never upscale: an image that already fits is only re-encoded on request
+    scale = min(1.0, target[0] / image.width, target[1] / image.height)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    if size == (image.width, image.height) and not options.recompress:
+        return image.stream()
+
+    try:
+        output_format = _output_format(image.format, options.recompress)
+        cache_file = None
+        if options.cache_dir:
+            cache_file = _cache_path(options, image.sha256(), size, output_format)
+            data = _read_cache(cache_file)
+            if data is not None:
+                count("image_cache_hits")
+                return io.BytesIO(data)
+
+        # PIL is imported on first use so the GUI can import ImagePrepOptions without it
+        from PIL import Image
+        with Image.open(image.stream()) as img:
+            with span("image_resize", path=image.path, width=size[0], height=size[1]):
+                # Decodes JPEGs at reduced scale; the LANCZOS resample in _encode does the rest
+                data = _encode(decode_reduced(img, size), size, output_format, options)
+        count("images_resized")
+
+        if cache_file:
+            _write_cache(options, cache_file, data)
+        return io.BytesIO(data)
+
+    except Exception as e:
+        # Fall back to embedding the original file
+        logging.error(f"Error preparing image {image.path}: {e}")
+        return image.stream()
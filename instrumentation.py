@@ -0,0 +1,206 @@
+"""Timing spans, counters and non-blocking logging.
+
+Spans and counters always aggregate in memory (a dict update per event). When a
+trace file is configured, every finished span is also emitted as one JSON line.
+All file output goes through a QueueHandler, so the threads being measured only
+ever put a record on a queue; a QueueListener thread does the actual writing.
+
+    with span("doc_save", folder=folder):
+        doc.save(output_file)
+    count("bytes_embedded", len(data))
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+TRACE_LOGGER = "wordgenerator.trace"
+REPORT_LOGGER = "wordgenerator.report"  # Batch reports, kept in the log whatever its level
+METRIC_PREFIX = "wordgen"
+
+_config = {'log_file': None, 'level': logging.ERROR, 'trace_file': None}
+_listener = None
+_metrics_lock = threading.Lock()
+_counters = {}  # name -> total
+_span_stats = {}  # name -> [count, total seconds, max seconds]
+_span_ids = itertools.count(1)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats every record on the calling thread; the listener
+    # lives in this process, so hand the record over untouched and format it there
+    def prepare(self, record):
+        return record
+
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, separators=(",", ":"), default=str)
+
+
+def configure(log_file='app.log', level=logging.ERROR, trace_file=None):
+    """Routes the root logger (and the trace, if any) through a background writer thread.
+
+    Log records go to log_file, or to stderr when it is None. Safe to call again,
+    e.g. as a worker process initializer; the previous listener is stopped first.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    _config.update(log_file=log_file, level=level, trace_file=trace_file)
+    records = queue.SimpleQueue()
+    handlers = []
+
+    log_handler = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    log_handler.addFilter(lambda record: record.name != TRACE_LOGGER)
+    handlers.append(log_handler)
+
+    if trace_file:
+        trace_handler = logging.FileHandler(trace_file, encoding='utf-8')
+        trace_handler.setFormatter(_JsonLineFormatter())
+        trace_handler.addFilter(lambda record: record.name == TRACE_LOGGER)
+        handlers.append(trace_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(_InProcessQueueHandler(records))
+    root.setLevel(level)
+
+    trace_logger = logging.getLogger(TRACE_LOGGER)
+    trace_logger.setLevel(logging.INFO if trace_file else logging.CRITICAL + 1)
+    logging.getLogger(REPORT_LOGGER).setLevel(logging.INFO)
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def worker_config():
+    # Arguments for configure() in worker processes, so they log where the parent does
+    return (_config['log_file'], _config['level'], _config['trace_file'])
+
+
+def shutdown():
+    """Flushes queued log and trace records."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
+
+
+def count(name, value=1):
+    with _metrics_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class span:
+    """Context manager timing one unit of work (an image, a folder, a batch, ...)."""
+
+    __slots__ = ('name', 'attrs', 'span_id', 'parent_id', 'start', '_token')
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.span_id = next(_span_ids)
+        self.parent_id = _current_span.get()
+        self._token = _current_span.set(self.span_id)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+
+        with _metrics_lock:
+            stats = _span_stats.get(self.name)
+            if stats is None:
+                _span_stats[self.name] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+        trace_logger = logging.getLogger(TRACE_LOGGER)
+        if trace_logger.isEnabledFor(logging.INFO):
+            event = {
+                'span': self.name,
+                'id': f"{os.getpid()}-{self.span_id}",
+                'parent': f"{os.getpid()}-{self.parent_id}" if self.parent_id else None,
+                'start': time.time() - seconds,
+                'ms': round(seconds * 1000, 3),
+                'pid': os.getpid(),
+                'thread': threading.current_thread().name,
+            }
+            if exc_type is not None:
+                event['error'] = repr(exc)
+            event.update(self.attrs)
+            trace_logger.info(event)
+        return False
+
+
+def snapshot(reset=False):
+    """Returns the aggregated counters and span statistics, e.g. to ship them out of a worker."""
+    with _metrics_lock:
+        data = {'counters': dict(_counters), 'spans': {name: list(stats) for name, stats in _span_stats.items()}}
+        if reset:
+            _counters.clear()
+            _span_stats.clear()
+    return data
+
+
+def merge(data):
+    """Adds a snapshot taken in another process to this process's totals."""
+    with _metrics_lock:
+        for name, value in data['counters'].items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, (calls, total, longest) in data['spans'].items():
+            stats = _span_stats.get(name)
+            if stats is None:
+                _span_stats[name] = [calls, total, longest]
+            else:
+                stats[0] += calls
+                stats[1] += total
+                stats[2] = max(stats[2], longest)
+
+
+def prometheus_text():
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data['counters'].items()):
+        metric = f"{METRIC_PREFIX}_{name}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+
+    # Every sample of a metric family has to follow its own TYPE line
+    spans = sorted(data['spans'].items())
+    if spans:
+        lines.append(f"# TYPE {METRIC_PREFIX}_span_seconds summary")
+        for name, (calls, total, _) in spans:
+            lines += [f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {calls}',
+                      f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {total:.6f}']
+        lines.append(f"# TYPE {METRIC_PREFIX}_span_max_seconds gauge")
+        for name, (_, _, longest) in spans:
+            lines.append(f'{METRIC_PREFIX}_span_max_seconds{{span="{name}"}} {longest:.6f}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    # Written atomically so a node_exporter textfile collector never reads half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
@@ -0,0 +1,248 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+POLL_INTERVAL_MS = 100
+MAX_EVENTS_PER_POLL = 500  # Keeps one poll from starving the Tk event loop
+
+
+class BatchProgress:
+    """Image and folder counts of the running batch, plus throughput and ETA."""
+
+    def __init__(self):
+        self.folder_images = {}  # folder -> number of images it will embed
+        self.folder_done = {}
+        self.folder_jobs = {}  # folder -> jobs (volumes) not finished yet
+        self.folder_failed = {}
+        self.finished = set()
+        self.total_images = 0
+        self.total_folders = 0
+        self.discovering = True  # More jobs may still arrive (e.g. from a folder walk)
+        self.done_images = 0
+        self.done_folders = 0
+        self.current_folder = None
+        self.paused = False
+        self.started = time.perf_counter()
+        self.paused_at = None
+        self.paused_time = 0.0  # Seconds spent paused, left out of the throughput
+
+    def elapsed(self):
+        now = self.paused_at if self.paused_at is not None else time.perf_counter()
+        return now - self.started - self.paused_time
+
+    def images_per_second(self):
+        elapsed = self.elapsed()
+        return self.done_images / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        # Seconds left at the current rate, or None before the first image is done
+        rate = self.images_per_second()
+        if not rate:
+            return None
+        return max(0, self.total_images - self.done_images) / rate
+
+    def add_folder(self, folder, image_count):
+        # A folder split into volumes is announced once per part
+        if folder not in self.folder_jobs:
+            self.folder_images[folder] = 0
+            self.folder_done[folder] = 0
+            self.folder_jobs[folder] = 0
+            self.total_folders += 1
+        self.folder_images[folder] += image_count
+        self.folder_jobs[folder] += 1
+        self.total_images += image_count
+
+    def image_done(self, folder):
+        # Image events can arrive after their folder's result; those are already counted
+        if folder in self.finished:
+            return
+        self.folder_done[folder] += 1
+        self.done_images += 1
+        self.current_folder = folder
+
+    def folder_finished(self, result):
+        folder = result.folder
+        if folder in self.finished:
+            return
+        self.folder_jobs[folder] -= 1
+        self.folder_failed[folder] = self.folder_failed.get(folder, False) or not result.ok
+        if self.folder_jobs[folder]:
+            return  # More parts to come
+        self.finished.add(folder)
+        self.done_folders += 1
+        remaining = self.folder_images[folder] - self.folder_done[folder]
+        if not self.folder_failed[folder]:
+            # Skipped folders embed nothing but are done all the same
+            self.done_images += remaining
+        else:
+            self.total_images -= remaining
+
+    def set_paused(self, paused):
+        if paused and self.paused_at is None:
+            self.paused_at = time.perf_counter()
+        elif not paused and self.paused_at is not None:
+            self.paused_time += time.perf_counter() - self.paused_at
+            self.paused_at = None
+        self.paused = paused
+
+    def status_text(self):
+        more = "+" if self.discovering else ""
+        text = (f"{self.done_images}/{self.total_images}{more} images, "
+                f"{self.done_folders}/{self.total_folders}{more} folders")
+        if self.paused:
+            return f"Paused: {text}"
+        rate = self.images_per_second()
+        if rate and not self.discovering:
+            eta = self.eta()
+            text += f", {rate:.1f} img/s, ETA {int(eta) // 60}:{int(eta) % 60:02d}"
+        return text
+
+
+class GenerationScheduler:
+    """Runs one generation batch at a time off the Tk thread.
+
+    The batch runs on a background thread (which drives the process pool); all of
+    its progress, results and completion are put on queues that are drained from
+    the Tk thread with root.after, so callbacks may touch widgets freely. Starting
+    a batch while one is running is refused.
+    """
+
+    def __init__(self, root, poll_interval=POLL_INTERVAL_MS):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.events = queue.SimpleQueue()  # ('job' | 'jobs_done' | 'result' | 'done', payload) from the batch thread
+        self.image_events = None  # (folder, image_path) from the worker processes
+        self.control = None
+        self.progress = None
+        self.callbacks = None
+
+    @property
+    def running(self):
+        return self.control is not None
+
+    def start(self, jobs, max_image_width, on_progress=None, on_result=None, on_done=None, **options):
+        """Starts a batch; returns False if one is already running.
+
+        jobs may be lazy; it is consumed on the batch thread, so a slow source
+        (such as folder discovery) never blocks the UI.
+
+        on_progress(BatchProgress) is called after each poll that saw progress,
+        on_result(FolderResult) per folder and on_done(BatchSummary) once at the end,
+        all on the Tk thread. options are passed on to generate_documents_parallel.
+        """
+        if self.running:
+            return False
+
+        # Imported on the first batch: it pulls in python-docx and lxml, which the
+        # window does not need to come up
+        from parallel_generator import BatchControl
+
+        self.control = BatchControl()
+        self.image_events = multiprocessing.Queue()
+        self.progress = BatchProgress()
+        self.callbacks = (on_progress, on_result, on_done)
+
+        thread = threading.Thread(target=self._run, name="generation-batch", daemon=True,
+                                  args=(jobs, max_image_width, self.control, self.image_events, options))
+        thread.start()
+        self.root.after(self.poll_interval, self._poll)
+        return True
+
+    def pause(self):
+        if self.running:
+            self.control.pause()
+            self.progress.set_paused(True)
+            self._notify_progress()
+
+    def resume(self):
+        if self.running:
+            self.control.resume()
+            self.progress.set_paused(False)
+            self._notify_progress()
+
+    def cancel(self):
+        if self.running:
+            self.control.cancel()
+            self.progress.set_paused(False)
+
+    def _run(self, jobs, max_image_width, control, image_events, options):
+        # Batch thread: never touches Tk, only puts events on the queue
+        from parallel_generator import generate_documents_parallel
+        from volumes import volume_jobs
+
+        volumes = options.pop('volumes', None)
+        if volumes is not None:
+            # Split here rather than in generate_documents_parallel, so each part is announced
+            jobs = volume_jobs(jobs, volumes, max_image_width, options.get('image_options'),
+                               options.get('max_image_height', 4), options.get('output_stage'))
+
+        def announced(jobs):
+            # Announced before the job is submitted, so it is known before any of its progress
+            for job in jobs:
+                folder, _, images_dict = job
+                self.events.put(('job', (folder, images_dict.image_count())))
+                yield job
+            self.events.put(('jobs_done', None))
+
+        try:
+            summary = generate_documents_parallel(announced(jobs), max_image_width,
+                                                  on_result=lambda result: self.events.put(('result', result)),
+                                                  progress_queue=image_events, control=control, **options)
+        except Exception as e:
+            logging.error(f"Generation batch failed: {e}")
+            summary = None
+        self.events.put(('done', summary))
+
+    def _poll(self):
+        on_progress, on_result, on_done = self.callbacks
+        changed = False
+
+        # Batch events first: every image event read below then belongs to an announced folder
+        summary = done = None
+        while True:
+            try:
+                kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            changed = True
+            if kind == 'job':
+                self.progress.add_folder(*payload)
+            elif kind == 'jobs_done':
+                self.progress.discovering = False
+            elif kind == 'result':
+                self.progress.folder_finished(payload)
+                if on_result:
+                    on_result(payload)
+            else:
+                done, summary = True, payload
+                self.progress.discovering = False
+
+        for _ in range(MAX_EVENTS_PER_POLL):
+            try:
+                folder, _ = self.image_events.get_nowait()
+            except queue.Empty:
+                break
+            self.progress.image_done(folder)
+            changed = True
+
+        if changed:
+            self._notify_progress()
+
+        if done:
+            self._finish()
+            if on_done:
+                on_done(summary)
+        else:
+            self.root.after(self.poll_interval, self._poll)
+
+    def _notify_progress(self):
+        on_progress = self.callbacks[0]
+        if on_progress:
+            on_progress(self.progress)
+
+    def _finish(self):
+        self.image_events.close()
+        self.image_events = None
+        self.control = None
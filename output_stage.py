@@ -0,0 +1,128 @@
+"""Moves finished documents from local scratch space to their destination.
+
+Workers write each document into a scratch folder on the local disk, which is
+fast and never locked, and go straight on to their next folder. The copy to the
+destination (often a network share) runs here, on a small thread pool of its
+own: the document is copied next to the target under a temporary name and then
+renamed over it, so readers never see half a file. A target that is open in
+another program is retried with backoff and, failing that, written under a
+versioned name ("tc1 (2).docx") instead of holding anything up.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from build_manifest import write_manifest
+from instrumentation import count, span
+
+DEFAULT_SCRATCH_DIR = os.path.join(tempfile.gettempdir(), "wordgenerator-scratch")
+DEFAULT_IO_WORKERS = 4
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 0.5  # Seconds before the first retry; doubles each time
+
+
+def make_scratch_dir(scratch_root):
+    # One folder per document keeps its file name, which is also its heading, unchanged
+    os.makedirs(scratch_root, exist_ok=True)
+    return tempfile.mkdtemp(prefix="wordgen-", dir=scratch_root)
+
+
+def versioned_name(output_file):
+    base, extension = os.path.splitext(output_file)
+    version = 2
+    while os.path.exists(f"{base} ({version}){extension}"):
+        version += 1
+    return f"{base} ({version}){extension}"
+
+
+class OutputStage:
+    """Publishes staged FolderResults on its own I/O threads.
+
+    publish() returns a Future for the same result, updated with where the
+    document ended up (output_file, versioned) or why it could not be written.
+    """
+
+    def __init__(self, scratch_dir=DEFAULT_SCRATCH_DIR, max_workers=DEFAULT_IO_WORKERS, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, version_locked=True):
+        self.scratch_dir = scratch_dir
+        self.retries = retries
+        self.backoff = backoff
+        self.version_locked = version_locked  # False: a target still locked after the retries fails the folder
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="output")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+    def publish(self, result):
+        return self.executor.submit(self._publish, result)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def _publish(self, result):
+        staged_file, build = result.staged_file, result.build
+        result.staged_file = result.build = None  # Results are kept for the summary; these are not needed there
+        with span("publish", output=result.output_file):
+            try:
+                target = self._move_into_place(staged_file, result.output_file)
+            except Exception as e:
+                count("outputs_failed")
+                logging.error(f"Error writing {result.output_file}: {e}")
+                result.ok = False
+                result.locked = isinstance(e, PermissionError)
+                result.error = f"could not write {result.output_file} ({e}); the document was kept at {staged_file}"
+                return result
+
+        shutil.rmtree(os.path.dirname(staged_file), ignore_errors=True)
+        if target != result.output_file:
+            result.output_file = target
+            result.versioned = True
+        elif build is not None:
+            # Recorded only for the real target, so a versioned copy never marks the folder up to date
+            try:
+                write_manifest(target, build)
+            except OSError as e:
+                logging.error(f"Error writing build manifest for {target}: {e}")
+        return result
+
+    def _move_into_place(self, staged_file, output_file):
+        # Returns the path the document was written to
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        if os.stat(staged_file).st_dev == os.stat(output_dir).st_dev:
+            temp_file = staged_file  # Same file system: the rename alone is atomic, no copy needed
+        else:
+            temp_file = os.path.join(output_dir, f".{os.path.basename(output_file)}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with span("publish_copy"):
+                shutil.copyfile(staged_file, temp_file)
+
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    os.replace(temp_file, output_file)
+                    return output_file
+                except PermissionError:
+                    # Open in Word (or a virus scanner); it may well be closed in a moment
+                    if attempt == self.retries:
+                        if not self.version_locked:
+                            raise
+                        break
+                    count("outputs_retried")
+                    time.sleep(self.backoff * 2 ** attempt)
+
+            target = versioned_name(output_file)
+            os.replace(temp_file, target)
+            count("outputs_versioned")
+            return target
+        finally:
+            if temp_file != staged_file and os.path.exists(temp_file):
+                try:
+                    os.remove(temp_file)
+                except OSError:
+                    pass
@@ -0,0 +1,380 @@
+import os
+import time
+import logging
+import multiprocessing
+import queue
+import shutil
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from build_manifest import add_content_hashes, describe_build, is_up_to_date, write_manifest
+from cost_scheduler import CostScheduler, estimate_cost
+from document_append import append_to_document
+from document_generator import create_document
+from image_prep import ImagePrepOptions
+from output_stage import make_scratch_dir
+from volumes import remove_stale_parts, volume_jobs
+import instrumentation
+from instrumentation import span
+
+
+# Jobs handed to the pool ahead of the workers; the rest of a (possibly lazy) job
+# iterable is only consumed as folders finish
+MAX_QUEUED_PER_WORKER = 4
+
+# Set in each worker process by _init_worker
+_progress_queue = None
+_control = None
+
+
+def default_worker_count():
+    return os.cpu_count() or 1
+
+
+class BatchCanceled(Exception):
+    pass
+
+
+class BatchControl:
+    """Pause and cancel flags shared with the worker processes of one batch.
+
+    Workers check them between images, so a running folder stops (or waits) after
+    the image it is on rather than at the end of the folder.
+    """
+
+    def __init__(self):
+        self._running = multiprocessing.Event()
+        self._running.set()
+        self._canceled = multiprocessing.Event()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    @property
+    def canceled(self):
+        return self._canceled.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._canceled.set()
+        self._running.set()  # Wake paused workers so they can stop
+
+    def checkpoint(self):
+        self._running.wait()
+        if self._canceled.is_set():
+            raise BatchCanceled()
+
+
+class FolderResult:
+    def __init__(self, folder, output_file, ok, elapsed, error=None, skipped=False):
+        self.folder = folder
+        self.output_file = output_file
+        self.ok = ok
+        self.elapsed = elapsed  # Seconds spent building this folder's document
+        self.error = error
+        self.skipped = skipped  # Output was already up to date with its inputs
+        self.canceled = False  # Stopped by BatchControl.cancel before it finished
+        self.locked = False  # Output file was open in another program
+        self.metrics = None  # Counters and span totals recorded by the worker for this folder
+        self.staged_file = None  # Built in scratch space and waiting for the OutputStage
+        self.build = None  # Build description to record once the staged file is published
+        self.versioned = False  # The target was locked, so the document went to a versioned name
+        self.appended = False  # New images were added to the existing document instead of rebuilding it
+        self.duplicates = []  # (duplicate path, kept path, distance) found by dedupe
+
+
+class BatchSummary:
+    def __init__(self, results, wall_time, workers):
+        self.results = results
+        self.wall_time = wall_time
+        self.workers = workers
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok and not result.canceled]
+
+    @property
+    def canceled(self):
+        return [result for result in self.results if result.canceled]
+
+    @property
+    def skipped(self):
+        return [result for result in self.results if result.skipped]
+
+    def headline(self):
+        built = len(self.succeeded) - len(self.skipped)
+        up_to_date = f", {len(self.skipped)} up to date" if self.skipped else ""
+        up_to_date += f", {len(self.canceled)} canceled" if self.canceled else ""
+        return (f"Generated {built}/{len(self.results)} document(s){up_to_date} "
+                f"in {self.wall_time:.1f}s using {self.workers} worker(s).")
+
+    def report(self):
+        lines = [self.headline()]
+        # Slowest folders first so outliers stand out
+        for result in sorted(self.results, key=lambda r: r.elapsed, reverse=True):
+            if result.skipped:
+                status = "up to date"
+            elif result.canceled:
+                status = "canceled"
+            else:
+                status = "ok" if result.ok else f"FAILED: {result.error}"
+            lines.append(f"  {result.elapsed:8.2f}s  {result.folder}  [{status}]")
+            lines.extend(duplicate_lines(result))
+        return "\n".join(lines)
+
+
+def duplicate_lines(result):
+    # One line per image dedupe found in result's folder
+    return [f"      {duplicate} duplicates {kept}" + (f" (distance {distance})" if distance else "")
+            for duplicate, kept, distance in result.duplicates]
+
+
+def _init_worker(log_config, progress_queue, control):
+    global _progress_queue, _control
+    instrumentation.configure(*log_config)
+    # A forked worker starts with a copy of the parent's totals, which the parent already counts
+    instrumentation.snapshot(reset=True)
+    _progress_queue = progress_queue
+    _control = control
+
+
+def _image_done(folder, image_path):
+    if _progress_queue is not None:
+        _progress_queue.put((folder, image_path))
+    if _control is not None:
+        _control.checkpoint()
+
+
+def build_folder(folder, output_file, images_dict, max_image_width, document_options,
+                 incremental=False, hash_contents=False, scratch_root=None, append=False):
+    # Runs inside a worker process; never raises so one folder cannot stop the batch
+    with span("folder", folder=folder):
+        result = _build_folder(folder, output_file, images_dict, max_image_width, document_options,
+                               incremental, hash_contents, scratch_root, append)
+    # Ship this folder's metrics back to the parent, which owns the batch totals
+    result.metrics = instrumentation.snapshot(reset=True)
+    return result
+
+
+def _build_folder(folder, output_file, images_dict, max_image_width, document_options, incremental, hash_contents,
+                  scratch_root=None, append=False):
+    start = time.perf_counter()
+    scratch_dir = None
+    try:
+        if _control is not None:
+            _control.checkpoint()  # Folders still queued when the batch is canceled stop here
+        image_options = document_options.get('image_options') or ImagePrepOptions()
+        # Described before building, so inputs changing mid-build are picked up next run
+        build = describe_build(images_dict, max_image_width, image_options, document_options.get('dedupe'))
+        if incremental and is_up_to_date(output_file, build):
+            return FolderResult(folder, output_file, True, time.perf_counter() - start, skipped=True)
+        target = output_file
+        if scratch_root is not None:
+            # Built on local scratch space; the parent's OutputStage moves it to output_file
+            scratch_dir = make_scratch_dir(scratch_root)
+            target = os.path.join(scratch_dir, os.path.basename(output_file))
+
+        if append:
+            # Extended on a copy, so output_file is only ever replaced whole
+            duplicates = []
+            copy = target
+            if scratch_dir is None:
+                copy = os.path.join(os.path.dirname(os.path.abspath(output_file)),
+                                    f".{os.path.basename(output_file)}.{os.getpid()}.append.tmp")
+            added = append_to_document(output_file, build, images_dict, max_image_width, copy,
+                                       image_options=image_options, dedupe=document_options.get('dedupe'),
+                                       on_image=partial(_image_done, folder), duplicates=duplicates)
+            if added == 0:
+                write_manifest(output_file, build, hash_contents)  # build now lists the images in document order
+                return FolderResult(folder, output_file, True, time.perf_counter() - start, skipped=True)
+            if added is not None:
+                if scratch_dir is None:
+                    try:
+                        os.replace(copy, output_file)
+                    except BaseException:
+                        os.remove(copy)
+                        raise
+                    write_manifest(output_file, build, hash_contents)
+                    result = FolderResult(folder, output_file, True, time.perf_counter() - start)
+                    result.appended, result.duplicates = True, duplicates
+                    return result
+                if hash_contents:
+                    add_content_hashes(build)
+                result = FolderResult(folder, output_file, True, time.perf_counter() - start)
+                result.staged_file, result.build, result.appended = target, build, True
+                result.duplicates = duplicates
+                scratch_dir = None  # Now owned by the OutputStage
+                return result
+
+        duplicates = []  # An append that fell back to a rebuild may have reported some already
+        create_document(target, images_dict, max_image_width, on_image=partial(_image_done, folder),
+                        duplicates=duplicates, **document_options)
+
+        result = FolderResult(folder, output_file, True, time.perf_counter() - start)
+        result.duplicates = duplicates
+        if scratch_dir is None:
+            write_manifest(output_file, build, hash_contents)
+            return result
+
+        if hash_contents:
+            add_content_hashes(build)  # Here, where the images were just read, not on the I/O threads
+        result.staged_file, result.build = target, build
+        scratch_dir = None  # Now owned by the OutputStage
+        return result
+    except BatchCanceled:
+        result = FolderResult(folder, output_file, False, time.perf_counter() - start, "Canceled")
+        result.canceled = True
+        return result
+    except PermissionError as e:
+        # A locked output in direct mode (the OutputStage handles staged ones); the caller decides whether to retry
+        logging.error(f"Output for folder {folder} is locked: {e}")
+        result = FolderResult(folder, output_file, False, time.perf_counter() - start, f"{output_file} is open in another program")
+        result.locked = True
+        return result
+    except Exception as e:
+        logging.error(f"Error creating document for folder {folder}: {e}")
+        return FolderResult(folder, output_file, False, time.perf_counter() - start, str(e))
+    finally:
+        if scratch_dir is not None:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def generate_documents_parallel(jobs, max_image_width, max_workers=None, on_result=None,
+                                incremental=False, hash_contents=False, metrics_file=None, progress_queue=None,
+                                control=None, output_stage=None, append=False, memory_budget=None, largest_first=False,
+                                volumes=None, **document_options):
+    """Builds one document per (folder, output_file, images_dict) job on a process pool.
+
+    images_dict is an ImageManifest (see compile_images); it is sent to the workers as is.
+
+    jobs may be a lazy iterable (e.g. fed by folder discovery); building starts with
+    the first job and the iterable is consumed as workers free up.
+    on_result is called with each FolderResult as soon as its folder finishes.
+    With incremental=True, folders whose build manifest still matches their inputs
+    are skipped; hash_contents stores image hashes so touched-but-identical files
+    do not force a rebuild. Workers log and trace where this process does (see
+    instrumentation.configure); metrics_file receives the batch totals in
+    Prometheus text format.
+    progress_queue (a multiprocessing queue) receives a (folder, image_path) tuple
+    per embedded image; control is a BatchControl used to pause or cancel the batch.
+    With an output_stage (an OutputStage), workers build into local scratch space and
+    the stage's I/O threads move each document into place, so no worker ever waits
+    on the destination; on_result then fires once the document has been published.
+    With largest_first, jobs are read a little ahead and the largest (by estimated
+    cost, see cost_scheduler) are started first; with a memory_budget in bytes, a job
+    also waits until its estimated peak memory fits beside the running ones, and
+    nothing is queued ahead of the workers.
+    volumes (VolumeLimits) splits folders predicted to exceed it into part documents
+    plus an index (see volumes.volume_jobs); the parts are separate jobs, so one
+    folder's parts are built side by side, and each has its own FolderResult.
+    document_options (image_options, streaming, ...) are passed on to create_document
+    and must be picklable.
+    """
+    workers = max_workers or default_worker_count()
+    start = time.perf_counter()
+    results = []
+    scratch_root = output_stage.scratch_dir if output_stage is not None else None
+    image_options = document_options.get('image_options') or ImagePrepOptions()
+    max_image_height = document_options.get('max_image_height', 4)
+    if volumes is not None:
+        jobs = volume_jobs(jobs, volumes, max_image_width, image_options, max_image_height, output_stage)
+    scheduler = None
+    if largest_first or memory_budget is not None:
+        estimate = partial(estimate_cost, max_image_width=max_image_width, image_options=image_options,
+                           streaming=document_options.get('streaming', False), max_image_height=max_image_height)
+        scheduler = CostScheduler(jobs, estimate, memory_budget)
+
+    with span("batch", workers=workers), \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(instrumentation.worker_config(), progress_queue, control)) as executor:
+        completed = queue.SimpleQueue()  # Finished build futures and publish futures alike
+        in_flight = {}
+        publishing = set()
+
+        def finish(future):
+            if future in publishing:
+                publishing.discard(future)
+                report(future.result())
+                return
+
+            folder, output_file, cost = in_flight.pop(future)
+            if cost is not None:
+                scheduler.release(cost)
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. BrokenProcessPool); record it and keep going
+                logging.error(f"Worker failed for folder {folder}: {e}")
+                result = FolderResult(folder, output_file, False, 0.0, str(e))
+
+            if result.metrics:
+                instrumentation.merge(result.metrics)
+            if result.staged_file:
+                published = output_stage.publish(result)
+                publishing.add(published)
+                published.add_done_callback(completed.put)
+            else:
+                report(result)
+
+        def report(result):
+            if result.skipped:
+                instrumentation.count("folders_skipped")
+            elif result.ok:
+                instrumentation.count("folders_built")
+            else:
+                instrumentation.count("folders_canceled" if result.canceled else "folders_failed")
+            if result.ok and not result.skipped and not result.versioned:
+                # Rebuilt whole, so the volumes of an earlier split are out of date
+                remove_stale_parts(result.output_file)
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+        def submit(job, cost=None):
+            folder, output_file, images_dict = job
+            future = executor.submit(build_folder, folder, output_file, images_dict, max_image_width, document_options,
+                                     incremental, hash_contents, scratch_root, append)
+            in_flight[future] = (folder, output_file, cost)
+            future.add_done_callback(completed.put)
+
+        if scheduler is None:
+            for job in jobs:
+                if control is not None and control.canceled:
+                    break
+                submit(job)
+                # Report what finished meanwhile, and wait for a free slot once enough work is queued
+                while not completed.empty() or len(in_flight) >= workers * MAX_QUEUED_PER_WORKER:
+                    finish(completed.get())
+        else:
+            # Queued jobs would hold memory they do not use yet, so only as many as there are workers
+            limit = workers if memory_budget is not None else workers * MAX_QUEUED_PER_WORKER
+            while not scheduler.done and not (control is not None and control.canceled):
+                picked = scheduler.take() if len(in_flight) < limit else None
+                if picked is None:
+                    if not in_flight and scheduler.done:
+                        break
+                    finish(completed.get())  # Wait for a slot or for memory to be released
+                    continue
+                submit(*picked)
+                while not completed.empty():
+                    finish(completed.get())
+
+        while in_flight or publishing:
+            finish(completed.get())
+
+    if metrics_file:
+        try:
+            instrumentation.write_prometheus(metrics_file)
+        except OSError as e:
+            logging.error(f"Error writing metrics to {metrics_file}: {e}")
+
+    return BatchSummary(results, time.perf_counter() - start, workers)
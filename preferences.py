@@ -1,7 +1,12 @@
+import os
+
+# Root folder for on-disk caches (prepared images, thumbnails, ...)
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".wordGenerator", "cache")
+
 def load_preferences():
     # Load preferences from a config file (if needed)
     pass
 
 def save_preferences():
     # Save preferences to a config file (if needed)
-    pass
\ No newline at end of file
+    pass
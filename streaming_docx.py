@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+import docx
+from docx_xml import inline_picture_xml, relationship_xml
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(docx.__file__), "templates", "default.docx")
+SPOOL_LIMIT = 8 * 1024 * 1024  # Body XML beyond this is spooled to a temp file
+
+# Parts rewritten by the writer; everything else is copied from the python-docx template
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS_PART = "word/_rels/document.xml.rels"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+IMAGE_CONTENT_TYPES = {
+    'png': "image/png",
+    'jpg': "image/jpeg",
+    'gif': "image/gif",
+    'bmp': "image/bmp",
+}
+# PNG, JPEG and GIF are already compressed; deflating them again only costs time
+STORED_EXTENSIONS = ('png', 'jpg', 'gif')
+
+
+def sniff_image_extension(data):
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return 'png'
+    if data.startswith(b"\xff\xd8"):
+        return 'jpg'
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return 'gif'
+    if data.startswith(b"BM"):
+        return 'bmp'
+    raise ValueError("unsupported image format")
+
+
+class _Template:
+    def __init__(self, path=TEMPLATE_PATH):
+        with zipfile.ZipFile(path) as template:
+            self.parts = {name: template.read(name) for name in template.namelist()}
+
+        document = self.parts[DOCUMENT_PART].decode("utf-8")
+        body_start = document.index("<w:body>") + len("<w:body>")
+        section_start = document.index("<w:sectPr")
+        self.document_head = document[:body_start].encode("utf-8")
+        self.document_tail = document[section_start:].encode("utf-8")
+
+        # Two-column tables split the text width evenly, like python-docx does
+        page_width = int(re.search(r'<w:pgSz w:w="(\d+)"', document).group(1))
+        left = int(re.search(r'w:left="(\d+)"', document).group(1))
+        right = int(re.search(r'w:right="(\d+)"', document).group(1))
+        self.text_width_twips = page_width - left - right
+
+        self.relationships = self.parts[DOCUMENT_RELS_PART].decode("utf-8")
+        self.next_rel_id = max(int(n) for n in re.findall(r'Id="rId(\d+)"', self.relationships)) + 1
+
+        content_types = self.parts[CONTENT_TYPES_PART].decode("utf-8")
+        defaults = "".join(f'<Default Extension="{ext}" ContentType="{content_type}"/>'
+                           for ext, content_type in IMAGE_CONTENT_TYPES.items()
+                           if f'Extension="{ext}"' not in content_types)
+        self.content_types = content_types.replace("</Types>", defaults + "</Types>").encode("utf-8")
+
+
+_template = None
+
+
+def _get_template():
+    global _template
+    if _template is None:
+        _template = _Template()
+    return _template
+
+
+class StreamingDocxWriter:
+    """Writes a .docx as it is built instead of holding the whole document in memory.
+
+    Each image goes into word/media as soon as it is added and is not kept afterwards;
+    identical images share one media part. The body XML is spooled (to disk once it
+    grows large) and copied into word/document.xml on close().
+    """
+
+    def __init__(self, output):
+        self.template = _get_template()
+        self.zip = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+        self.body = tempfile.SpooledTemporaryFile(max_size=SPOOL_LIMIT)
+        self.relationships = []
+        self.media = {}  # sha1 of image bytes -> (relationship id, filename)
+        self.next_rel_id = self.template.next_rel_id
+        self.next_shape_id = 1
+
+        # Static parts first, so [Content_Types].xml leads the archive like Word's own files
+        self.zip.writestr(CONTENT_TYPES_PART, self.template.content_types)
+        for name, data in self.template.parts.items():
+            if name not in (CONTENT_TYPES_PART, DOCUMENT_PART, DOCUMENT_RELS_PART):
+                self.zip.writestr(name, data)
+
+    @property
+    def text_width_twips(self):
+        return self.template.text_width_twips
+
+    def write_xml(self, fragments):
+        """Writes body XML fragments (complete body elements) as they come."""
+        for xml in fragments:
+            self._write(xml)
+
+    def picture_xml(self, image, width, height, filename=None):
+        # Embeds the image now and returns the drawing XML referencing it; see BulkDocxWriter.picture_xml
+        rel_id, filename = self._add_media(image, filename)
+        shape_id = self.next_shape_id
+        self.next_shape_id += 1
+        return inline_picture_xml(shape_id, rel_id, filename, width, height)
+
+    def close(self):
+        try:
+            with self.zip.open(DOCUMENT_PART, "w", force_zip64=True) as part:
+                part.write(self.template.document_head)
+                self.body.seek(0)
+                shutil.copyfileobj(self.body, part)
+                part.write(self.template.document_tail)
+
+            relationships = self.template.relationships.replace(
+                "</Relationships>", "".join(self.relationships) + "</Relationships>")
+            self.zip.writestr(DOCUMENT_RELS_PART, relationships.encode("utf-8"))
+        finally:
+            self.body.close()
+            self.zip.close()
+
+    def abort(self):
+        self.body.close()
+        self.zip.close()
+
+    def _write(self, xml):
+        self.body.write(xml.encode("utf-8"))
+
+    def _add_media(self, image, filename=None):
+        if isinstance(image, str):
+            filename = filename or os.path.basename(image)
+            with open(image, "rb") as f:
+                data = f.read()
+        else:
+            image.seek(0)
+            data = image.read()
+
+        extension = sniff_image_extension(data)
+        if filename is None:
+            filename = f"image.{extension}"  # python-docx's name for anonymous streams
+
+        digest = hashlib.sha1(data).hexdigest()
+        media = self.media.get(digest)
+        if media is None:
+            rel_id = f"rId{self.next_rel_id}"
+            self.next_rel_id += 1
+            target = f"media/image{len(self.media) + 1}.{extension}"
+            compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            self.zip.writestr("word/" + target, data, compress_type=compress_type)
+            self.relationships.append(relationship_xml(rel_id, target))
+            media = self.media[digest] = (rel_id, filename)
+        # data goes out of scope here; only the hash, relationship id and name are kept
+        return media
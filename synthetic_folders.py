@@ -0,0 +1,59 @@
+import os
+import random
+from PIL import Image, ImageDraw
+
+FORMAT_EXTENSIONS = {
+    'png': '.png',
+    'jpg': '.jpg',
+    'gif': '.gif',
+    'bmp': '.bmp',
+}
+
+
+def parse_resolution(value):
+    width, _, height = value.lower().partition('x')
+    return int(width), int(height)
+
+
+def make_image(resolution, rng):
+    """Draws a screenshot-like image: a gradient background with random panels and noise."""
+    width, height = resolution
+    base = Image.linear_gradient('L').resize(resolution).convert('RGB')
+    img = Image.merge('RGB', [band.point(lambda v, k=rng.random(): int(v * k)) for band in base.split()])
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randrange(20, width // 2 + 21)), min(height, y0 + rng.randrange(10, height // 3 + 11))
+        draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+
+    # A noisy strip keeps the encoders from compressing the whole image to nothing
+    noise_height = max(1, height // 8)
+    noise = Image.effect_noise((width, noise_height), 64).convert('RGB')
+    img.paste(noise, (0, height - noise_height))
+    return img
+
+
+def generate_folder(folder, image_count, resolution=(1280, 720), formats=('png', 'jpg'), titles=4, seed=0):
+    """Fills folder with image_count images named title_N.ext, spread over `titles` groups.
+
+    Returns the list of written paths. The same arguments always produce the same files.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    title_names = [f"title{t}" for t in range(titles)]
+    counters = dict.fromkeys(title_names, 0)
+
+    paths = []
+    for i in range(image_count):
+        title = title_names[i % titles]
+        counters[title] += 1
+        image_format = formats[i % len(formats)]
+        path = os.path.join(folder, f"{title}_{counters[title]}{FORMAT_EXTENSIONS[image_format]}")
+
+        img = make_image(resolution, rng)
+        if image_format == 'gif':
+            img = img.convert('P', palette=Image.ADAPTIVE)
+        img.save(path)
+        paths.append(path)
+    return paths
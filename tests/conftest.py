@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_image():
+    """Writes a small solid-colour image and returns its path."""
+    from PIL import Image
+
+    def make(path, color='red', size=(64, 48)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGB', size, color).save(path)
+        return str(path)
+    return make
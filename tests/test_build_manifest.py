@@ -0,0 +1,91 @@
+import os
+
+from build_manifest import describe_build, is_up_to_date, load_manifest, plan_append, write_manifest
+from image_manifest import TWO_COLUMNS, ImageGroup, ImageManifest
+from image_prep import ImagePrepOptions
+
+
+def _manifest(*groups):
+    return ImageManifest(ImageGroup(title, paths, layout) for title, paths, layout in groups)
+
+
+def _built(output_file, images_dict, hash_contents=False):
+    # Stands in for a document build: any file will do, the manifest records its stat
+    with open(output_file, 'wb') as f:
+        f.write(b"docx")
+    build = describe_build(images_dict, 5, ImagePrepOptions())
+    write_manifest(output_file, build, hash_contents)
+    return build
+
+
+def test_unchanged_inputs_are_up_to_date(tmp_path, make_image):
+    a = make_image(tmp_path / "dd_1.png")
+    b = make_image(tmp_path / "dd_2.png")
+    output = str(tmp_path / "out.docx")
+    _built(output, _manifest(("dd", [a, b], "Single Column")))
+
+    assert is_up_to_date(output, describe_build(_manifest(("dd", [a, b], "Single Column")), 5, ImagePrepOptions()))
+
+
+def test_order_does_not_matter(tmp_path, make_image):
+    a = make_image(tmp_path / "dd_1.png")
+    b = make_image(tmp_path / "dd_2.png")
+    c = make_image(tmp_path / "ee_1.png")
+    output = str(tmp_path / "out.docx")
+    _built(output, _manifest(("dd", [a, b], "Single Column"), ("ee", [c], "Single Column")))
+
+    reordered = _manifest(("ee", [c], "Single Column"), ("dd", [b, a], "Single Column"))
+    assert is_up_to_date(output, describe_build(reordered, 5, ImagePrepOptions()))
+
+
+def test_changes_are_not_up_to_date(tmp_path, make_image):
+    a = make_image(tmp_path / "dd_1.png")
+    b = make_image(tmp_path / "dd_2.png")
+    output = str(tmp_path / "out.docx")
+    _built(output, _manifest(("dd", [a], "Single Column")))
+
+    def up_to_date(images_dict, max_image_width=5):
+        return is_up_to_date(output, describe_build(images_dict, max_image_width, ImagePrepOptions()))
+
+    assert not up_to_date(_manifest(("dd", [a, b], "Single Column")))
+    assert not up_to_date(_manifest(("dd", [a], TWO_COLUMNS)))
+    assert not up_to_date(_manifest(("ee", [a], "Single Column")))
+    assert not up_to_date(_manifest(("dd", [a], "Single Column")), max_image_width=4)
+
+    make_image(a, color='blue', size=(80, 48))
+    assert not up_to_date(_manifest(("dd", [a], "Single Column")))
+
+
+def test_touched_file_with_same_hash_is_restamped(tmp_path, make_image):
+    a = make_image(tmp_path / "dd_1.png")
+    output = str(tmp_path / "out.docx")
+    _built(output, _manifest(("dd", [a], "Single Column")), hash_contents=True)
+
+    stat = os.stat(a)
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10_000_000_000))
+    assert is_up_to_date(output, describe_build(_manifest(("dd", [a], "Single Column")), 5, ImagePrepOptions()))
+    assert load_manifest(output)['groups'][0]['images'][0]['mtime_ns'] == os.stat(a).st_mtime_ns
+
+
+def test_plan_append_keeps_document_order(tmp_path, make_image):
+    a = make_image(tmp_path / "dd_1.png")
+    b = make_image(tmp_path / "dd_2.png")
+    c = make_image(tmp_path / "ee_1.png")
+    output = str(tmp_path / "out.docx")
+    _built(output, _manifest(("dd", [b], "Single Column")))
+
+    build = describe_build(_manifest(("ee", [c], "Single Column"), ("dd", [a, b], "Single Column")), 5, ImagePrepOptions())
+    plan = plan_append(output, build)
+
+    assert plan == [("dd", [a], False), ("ee", [c], True)]
+    assert [group['title'] for group in build['groups']] == ["dd", "ee"]
+    assert [image['path'] for image in build['groups'][0]['images']] == [b, a]
+
+
+def test_plan_append_refuses_removed_images(tmp_path, make_image):
+    a = make_image(tmp_path / "dd_1.png")
+    b = make_image(tmp_path / "dd_2.png")
+    output = str(tmp_path / "out.docx")
+    _built(output, _manifest(("dd", [a, b], "Single Column")))
+
+    assert plan_append(output, describe_build(_manifest(("dd", [a], "Single Column")), 5, ImagePrepOptions())) is None
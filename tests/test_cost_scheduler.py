@@ -0,0 +1,59 @@
+import instrumentation
+from cost_scheduler import WORKER_BASE_BYTES, CostScheduler, JobCost
+
+MB = 1 << 20
+
+
+def _jobs(*sizes):
+    # The "images_dict" of each job is just its (work, memory) for the estimate below
+    return [(f"folder{i}", f"folder{i}.docx", size) for i, size in enumerate(sizes)]
+
+
+def _estimate(size):
+    work, memory = size
+    return JobCost(1, 0, 0, 0, memory * MB, work)
+
+
+def _folder(taken):
+    return taken[0][0]
+
+
+def test_largest_job_first_without_a_budget():
+    scheduler = CostScheduler(_jobs((1, 10), (5, 10), (3, 10)), _estimate)
+    assert [_folder(scheduler.take()) for _ in range(3)] == ["folder1", "folder2", "folder0"]
+    assert scheduler.take() is None and scheduler.done
+
+
+def test_job_waits_for_memory_without_being_starved():
+    scheduler = CostScheduler(_jobs((9, 60), (8, 50), (1, 10)), _estimate, memory_budget=100 * MB)
+    first = scheduler.take()
+    assert _folder(first) == "folder0"
+    # folder1 does not fit beside folder0, and folder2 must not take the memory it is waiting for
+    instrumentation.snapshot(reset=True)
+    assert scheduler.take() is None
+    assert instrumentation.snapshot(reset=True)['counters']['jobs_held_for_memory'] == 1
+
+    scheduler.release(first[1])
+    assert [_folder(scheduler.take()) for _ in range(2)] == ["folder1", "folder2"]
+    assert scheduler.done
+
+
+def test_job_over_the_budget_runs_alone():
+    scheduler = CostScheduler(_jobs((9, 150), (1, 10)), _estimate, memory_budget=100 * MB)
+    big = scheduler.take()
+    assert _folder(big) == "folder0"
+    assert scheduler.take() is None
+    scheduler.release(big[1])
+    assert _folder(scheduler.take()) == "folder1"
+
+
+def test_job_that_cannot_be_estimated_still_runs():
+    def estimate(size):
+        if size is None:
+            raise OSError("unreadable")
+        return _estimate(size)
+
+    scheduler = CostScheduler(_jobs((5, 10), None), estimate, memory_budget=100 * MB)
+    assert _folder(scheduler.take()) == "folder0"
+    job, cost = scheduler.take()
+    assert job[0] == "folder1" and cost.work == 0 and cost.memory == WORKER_BASE_BYTES
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+from docx import Document
+from PIL import Image, ImageDraw
+
+import instrumentation
+from dedupe import DedupeOptions, Deduper, find_duplicates
+from document_generator import create_document
+from image_manifest import ImageGroup, ImageManifest
+from image_prep import ImagePrepOptions
+
+
+def _screen(path, bars=((0, 40), (80, 120)), marks=()):
+    # Vertical bars give the difference hash something to see; marks are small changes on top
+    image = Image.new('L', (180, 160), 255)
+    draw = ImageDraw.Draw(image)
+    for left, right in bars:
+        draw.rectangle((left, 0, right, 159), fill=0)
+    for box in marks:
+        draw.rectangle(box, fill=128)
+    image.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def screens(tmp_path):
+    first = _screen(tmp_path / "login_1.png")
+    with open(first, 'rb') as f, open(tmp_path / "login_2.png", 'wb') as copy:
+        copy.write(f.read())
+    return {
+        'first': first,
+        'copy': str(tmp_path / "login_2.png"),
+        'cursor': _screen(tmp_path / "login_3.png", marks=[(130, 70, 150, 90)]),
+        'other': _screen(tmp_path / "login_4.png", bars=((20, 60), (120, 170))),
+    }
+
+
+def test_exact_copy_is_a_duplicate_at_any_threshold(screens):
+    image_paths = [screens['first'], screens['copy'], screens['other']]
+    assert find_duplicates(image_paths, threshold=0) == {screens['copy']: (screens['first'], 0)}
+
+
+def test_near_duplicate_depends_on_the_threshold(screens):
+    image_paths = [screens['first'], screens['cursor'], screens['other']]
+    duplicates = find_duplicates(image_paths, threshold=8)
+    assert list(duplicates) == [screens['cursor']]
+    kept, distance = duplicates[screens['cursor']]
+    assert kept == screens['first'] and 0 < distance <= 8
+
+    assert find_duplicates(image_paths, threshold=distance - 1) == {}
+    assert find_duplicates(image_paths, threshold=0) == {}
+
+
+def _check(options, image_paths, found):
+    with Deduper(options, found) as deduper:
+        group = deduper.group()
+        return [image.path for _, image in group.checked(image_paths) if image is not None]
+
+
+def test_flag_reports_without_dropping_and_drop_keeps_the_first(screens):
+    image_paths = [screens['first'], screens['copy'], screens['other']]
+
+    found = []
+    assert _check(DedupeOptions('flag', cache_file=None), image_paths, found) == image_paths
+    assert found == [(screens['copy'], screens['first'], 0)]
+    assert _check(DedupeOptions('drop', cache_file=None), image_paths, []) == [screens['first'], screens['other']]
+
+
+def test_build_reads_each_image_once_and_leaves_out_duplicates(tmp_path, screens):
+    images_dict = ImageManifest([ImageGroup("login", list(screens.values())), ImageGroup("home", [screens['copy']])])
+    output_file = str(tmp_path / "login.docx")
+    found = []
+    instrumentation.snapshot(reset=True)
+    create_document(output_file, images_dict, 5, image_options=ImagePrepOptions(dpi=None, cache_dir=None),
+                    dedupe=DedupeOptions('drop', cache_file=None), duplicates=found)
+    counters = instrumentation.snapshot(reset=True)['counters']
+
+    # Duplicates are only looked for within a group
+    assert [duplicate for duplicate, _, _ in found] == [screens['copy'], screens['cursor']]
+    assert len(Document(output_file).inline_shapes) == 3
+    assert counters['bytes_read'] == sum(os.path.getsize(path) for path in list(screens.values()) + [screens['copy']])
+
+
+@pytest.mark.parametrize("mode, threshold", [('merge', 8), ('drop', -1), ('drop', 64)])
+def test_invalid_options_are_rejected(mode, threshold):
+    with pytest.raises(ValueError):
+        DedupeOptions(mode, threshold)
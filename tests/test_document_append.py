@@ -0,0 +1,97 @@
+import os
+import shutil
+
+from docx import Document
+from PIL import Image
+
+from dedupe import DedupeOptions
+from image_grouping import compile_images
+from image_prep import ImagePrepOptions
+from output_stage import OutputStage
+from parallel_generator import generate_documents_parallel
+
+
+def _build(folder, **options):
+    images_dict = compile_images(folder, {}, {}, default_layout="Single Column")
+    output_file = os.path.join(folder, "shots.docx")
+    summary = generate_documents_parallel([(folder, output_file, images_dict)], 5, max_workers=1, incremental=True,
+                                          image_options=ImagePrepOptions(cache_dir=None), **options)
+    [result] = summary.results
+    assert result.ok, result.error
+    return result
+
+
+def _pictures(folder):
+    return len(Document(os.path.join(folder, "shots.docx")).inline_shapes)
+
+
+def test_append_then_plain_build_is_up_to_date(tmp_path, make_image):
+    folder = str(tmp_path / "shots")
+    make_image(os.path.join(folder, "dd_1.png"))
+    make_image(os.path.join(folder, "ee_1.png"), color='yellow')
+    assert not _build(folder).skipped
+
+    make_image(os.path.join(folder, "dd_2.png"), color='blue')
+    make_image(os.path.join(folder, "aa_1.png"), color='green')
+    assert _build(folder, append=True).appended
+    assert _pictures(folder) == 4
+    # Named after their files, as python-docx's add_picture(path) names them
+    names = [shape._inline.graphic.graphicData.pic.nvPicPr.cNvPr.name
+             for shape in Document(os.path.join(folder, "shots.docx")).inline_shapes]
+    assert sorted(names) == ["aa_1.png", "dd_1.png", "dd_2.png", "ee_1.png"]
+
+    assert _build(folder, append=True).skipped
+    assert _build(folder).skipped
+
+
+def test_append_falls_back_to_rebuild_when_an_image_is_removed(tmp_path, make_image):
+    folder = str(tmp_path / "shots")
+    make_image(os.path.join(folder, "dd_1.png"))
+    removed = make_image(os.path.join(folder, "dd_2.png"))
+    _build(folder)
+
+    os.remove(removed)
+    result = _build(folder, append=True)
+    assert not result.appended and not result.skipped
+    assert _pictures(folder) == 1
+
+
+def test_append_through_the_output_stage_leaves_a_locked_document_alone(tmp_path, make_image, monkeypatch):
+    folder = str(tmp_path / "shots")
+    make_image(os.path.join(folder, "dd_1.png"))
+    _build(folder)
+    output_file = os.path.join(folder, "shots.docx")
+    with open(output_file, 'rb') as f:
+        original = f.read()
+
+    replace = os.replace
+
+    def locked_replace(src, dst):
+        if dst == output_file:
+            raise PermissionError(f"{dst} is open in another program")
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', locked_replace)
+    make_image(os.path.join(folder, "dd_2.png"), color='blue')
+    with OutputStage(str(tmp_path / "scratch"), retries=0) as stage:
+        result = _build(folder, append=True, output_stage=stage)
+    assert result.appended and result.versioned
+
+    with open(output_file, 'rb') as f:
+        assert f.read() == original
+    assert len(Document(result.output_file).inline_shapes) == 2
+    assert os.listdir(tmp_path / "scratch") == []
+
+
+def test_append_compares_new_images_with_the_ones_in_the_document(tmp_path, make_image):
+    folder = str(tmp_path / "shots")
+    first = make_image(os.path.join(folder, "dd_1.png"))
+    dedupe = DedupeOptions('drop', cache_file=None)
+    _build(folder, dedupe=dedupe)
+
+    shutil.copyfile(first, os.path.join(folder, "dd_2.png"))
+    Image.linear_gradient('L').transpose(Image.Transpose.ROTATE_90).save(os.path.join(folder, "dd_3.png"))  # Not solid, so unlike dd_1
+    result = _build(folder, append=True, dedupe=dedupe)
+    assert result.appended
+    assert result.duplicates == [(os.path.join(folder, "dd_2.png"), first, 0)]
+    assert _pictures(folder) == 2
@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+import instrumentation
+from document_generator import create_document
+from image_manifest import ImageGroup, ImageManifest
+from image_prep import ImagePrepOptions
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_each_two_column_table_is_timed(tmp_path, make_image, streaming):
+    image_paths = [make_image(os.path.join(tmp_path, f"aa_{i}.png"), color=(i * 40, 0, 0)) for i in range(1, 4)]
+    images_dict = ImageManifest([ImageGroup("aa", image_paths, "Two Columns"), ImageGroup("bb", image_paths[:1])])
+    instrumentation.snapshot(reset=True)
+    create_document(str(tmp_path / "tc1.docx"), images_dict, 5, image_options=ImagePrepOptions(dpi=None, cache_dir=None),
+                    streaming=streaming)
+    spans = instrumentation.snapshot(reset=True)['spans']
+    assert spans['table'][0] == 1 and spans['group'][0] == 2 and spans['image'][0] == 4
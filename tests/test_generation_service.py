@@ -0,0 +1,86 @@
+import base64
+import http.client
+import io
+import threading
+
+import pytest
+from PIL import Image
+
+from generation_service import MAX_REQUEST_BYTES, GenerationService, JobError, parse_job
+
+
+def _png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 24), 'red').save(buffer, 'PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def test_parse_job_groups_uploaded_images():
+    job = {'images': [{'name': "login_2.png", 'data': _png()}, {'name': "login_1.png", 'data': _png()},
+                      {'name': "home_1.png", 'data': _png()}],
+           'layouts': {'login': "two"}, 'notes': {'login': "Login flow"}, 'dpi': 0}
+    name, images_dict, max_image_width, image_options, dedupe = parse_job(job)
+    assert name == "images"
+    assert list(images_dict) == ["home", "login"]
+    assert images_dict['login'].two_columns and images_dict['login'].note == "Login flow"
+    assert [image.path for image in images_dict['login'].image_paths] == ["login_1.png", "login_2.png"]
+    assert image_options.dpi is None and not dedupe.enabled
+    # Nothing is cached on disk for a service job
+    assert image_options.cache_dir is None and dedupe.cache_file is None
+
+
+@pytest.mark.parametrize("job", [
+    [],
+    {},
+    {'folder': "/no/such/folder"},
+    {'images': []},
+    {'images': [{'name': "a_1.png"}]},
+    {'images': [{'name': "a_1.txt", 'data': _png()}]},
+    {'images': [{'name': "a_1.png", 'data': "not base64!"}]},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'layout': "three"},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'layouts': ["two"]},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'notes': "Login flow"},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'notes': {'a': None}},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'notes': {'a': 3}},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'max_image_width': 0},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'max_image_width': "wide"},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'dedupe': "merge"},
+    {'images': [{'name': "a_1.png", 'data': _png()}], 'dedupe': "drop", 'dedupe_threshold': 64},
+])
+def test_parse_job_rejects_invalid_jobs(job):
+    with pytest.raises(JobError):
+        parse_job(job)
+
+
+def test_negative_content_length_is_rejected():
+    with GenerationService(("127.0.0.1", 0), workers=1, queue_size=0) as service:
+        thread = threading.Thread(target=service.serve_forever, daemon=True)
+        thread.start()
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", service.server_address[1], timeout=5)
+            connection.putrequest("POST", "/jobs")
+            connection.putheader("Content-Length", "-1")
+            connection.endheaders()
+            response = connection.getresponse()
+            assert response.status == 411
+            connection.close()
+        finally:
+            service.shutdown()
+
+
+def test_busy_service_answers_before_reading_the_body():
+    with GenerationService(("127.0.0.1", 0), workers=1, queue_size=0) as service:
+        thread = threading.Thread(target=service.serve_forever, daemon=True)
+        thread.start()
+        assert service.try_accept()  # The only slot
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", service.server_address[1], timeout=5)
+            connection.putrequest("POST", "/jobs")
+            connection.putheader("Content-Length", str(MAX_REQUEST_BYTES))
+            connection.endheaders()  # No body follows
+            response = connection.getresponse()
+            assert response.status == 503
+            connection.close()
+        finally:
+            service.release()
+            service.shutdown()
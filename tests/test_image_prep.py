@@ -0,0 +1,39 @@
+import os
+import time
+
+from PIL import Image
+
+from image_ingest import read_image
+from image_prep import ImagePrepOptions, _cache_bytes, prepare_image
+
+
+def _cached_files(cache_dir):
+    return sorted(os.path.join(root, name) for root, _, files in os.walk(cache_dir) for name in files)
+
+
+def test_resampled_cache_stays_under_its_budget(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    options = ImagePrepOptions(dpi=10, cache_dir=cache_dir)
+    images = []
+    for i in range(3):
+        path = str(tmp_path / f"shot_{i}.png")
+        Image.effect_noise((400, 300), 40 + i).save(path)
+        images.append(read_image(path))
+
+    prepare_image(images[0], 5, 5, options)
+    first_file, = _cached_files(cache_dir)
+    size = os.path.getsize(first_file)
+    options.cache_budget = 2.5 * size
+    os.utime(first_file, (time.time() - 60, time.time() - 60))
+
+    prepare_image(images[1], 5, 5, options)
+    assert len(_cached_files(cache_dir)) == 2
+    # A hit marks the entry as recently used, so the second file is the one pruned next
+    prepare_image(images[0], 5, 5, options)
+    second_file, = set(_cached_files(cache_dir)) - {first_file}
+    os.utime(second_file, (time.time() - 30, time.time() - 30))
+
+    prepare_image(images[2], 5, 5, options)
+    remaining = _cached_files(cache_dir)
+    assert first_file in remaining and second_file not in remaining
+    assert _cache_bytes[cache_dir] == sum(map(os.path.getsize, remaining)) <= 0.9 * options.cache_budget
@@ -0,0 +1,15 @@
+import logging
+
+import instrumentation
+
+
+def test_report_is_kept_in_an_error_level_log(tmp_path):
+    log_file = tmp_path / "app.log"
+    instrumentation.configure(str(log_file), logging.ERROR)
+    try:
+        logging.info("dropped")
+        logging.getLogger(instrumentation.REPORT_LOGGER).info("Generated 1/1 document(s)")
+    finally:
+        instrumentation.shutdown()
+    text = log_file.read_text(encoding='utf-8')
+    assert "Generated 1/1 document(s)" in text and "dropped" not in text
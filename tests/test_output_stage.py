@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+import instrumentation
+from build_manifest import load_manifest
+from output_stage import OutputStage, make_scratch_dir
+from parallel_generator import FolderResult
+
+
+@pytest.fixture
+def stage(tmp_path):
+    with OutputStage(str(tmp_path / "scratch"), max_workers=1, retries=2, backoff=0) as stage:
+        yield stage
+
+
+@pytest.fixture
+def locked(monkeypatch):
+    # Makes the next `times` renames onto a path fail as if the file were open in Word
+    failures = {}
+    replace = os.replace
+
+    def fake_replace(source, target):
+        if failures.get(target, 0) > 0:
+            failures[target] -= 1
+            raise PermissionError(13, "Permission denied", target)
+        replace(source, target)
+
+    monkeypatch.setattr(os, "replace", fake_replace)
+    return failures
+
+
+def _staged(stage, output_file, content=b"new"):
+    scratch = make_scratch_dir(stage.scratch_dir)
+    staged_file = os.path.join(scratch, os.path.basename(output_file))
+    with open(staged_file, 'wb') as f:
+        f.write(content)
+    result = FolderResult(os.path.dirname(output_file), output_file, True, 0)
+    result.staged_file, result.build = staged_file, {'version': 1}
+    return result
+
+
+def _publish(stage, result):
+    instrumentation.snapshot(reset=True)
+    result = stage.publish(result).result()
+    return result, instrumentation.snapshot(reset=True)['counters']
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_published_with_its_manifest_and_scratch_removed(tmp_path, stage):
+    output_file = str(tmp_path / "tc1.docx")
+    result, _ = _publish(stage, _staged(stage, output_file))
+    assert result.ok and not result.versioned and result.staged_file is None
+    assert _read(output_file) == b"new" and load_manifest(output_file)['version'] == 1
+    assert os.listdir(stage.scratch_dir) == []
+
+
+def test_locked_target_is_retried(tmp_path, stage, locked):
+    output_file = str(tmp_path / "tc1.docx")
+    locked[output_file] = 2
+    result, counters = _publish(stage, _staged(stage, output_file))
+    assert result.ok and result.output_file == output_file and not result.versioned
+    assert counters['outputs_retried'] == 2 and _read(output_file) == b"new"
+
+
+def test_still_locked_target_gets_a_versioned_name(tmp_path, stage, locked):
+    output_file = str(tmp_path / "tc1.docx")
+    with open(output_file, 'wb') as f:
+        f.write(b"old")
+    locked[output_file] = 3
+    result, counters = _publish(stage, _staged(stage, output_file))
+    assert result.ok and result.versioned and result.output_file == str(tmp_path / "tc1 (2).docx")
+    assert counters['outputs_versioned'] == 1
+    assert _read(output_file) == b"old" and _read(result.output_file) == b"new"
+    # The versioned copy must not mark the folder as up to date
+    assert load_manifest(output_file) is None and load_manifest(result.output_file) is None
+    assert os.listdir(stage.scratch_dir) == []
+
+
+def test_still_locked_target_fails_without_versioning(tmp_path, locked):
+    output_file = str(tmp_path / "tc1.docx")
+    locked[output_file] = 3
+    with OutputStage(str(tmp_path / "scratch"), max_workers=1, retries=2, backoff=0, version_locked=False) as stage:
+        staged = _staged(stage, output_file)
+        staged_file = staged.staged_file
+        result, counters = _publish(stage, staged)
+    assert not result.ok and result.locked and counters['outputs_failed'] == 1
+    assert not os.path.exists(output_file) and not os.path.exists(str(tmp_path / "tc1 (2).docx"))
+    # Kept in scratch so the document is not lost
+    assert staged_file in result.error and _read(staged_file) == b"new"
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from build_manifest import load_manifest, manifest_path
+from image_grouping import compile_images
+from image_manifest import ImageGroup, ImageManifest
+from image_prep import ImagePrepOptions
+from output_stage import OutputStage
+from parallel_generator import generate_documents_parallel
+from volumes import DOCUMENT_BASE_BYTES, IMAGE_OVERHEAD_BYTES, VolumeLimits, part_file, plan_volumes
+
+
+def _images(make_image, folder, title, count):
+    return [make_image(os.path.join(folder, f"{title}_{i}.png"), color=(i * 20, 0, 0)) for i in range(1, count + 1)]
+
+
+def _counts(volumes):
+    return [[(title, len(group.image_paths)) for title, group in volume.items()] for volume in volumes]
+
+
+def test_groups_that_fit_are_never_divided(tmp_path, make_image):
+    images_dict = ImageManifest([ImageGroup("aa", _images(make_image, tmp_path, "aa", 2)),
+                                 ImageGroup("bb", _images(make_image, tmp_path, "bb", 2)),
+                                 ImageGroup("cc", _images(make_image, tmp_path, "cc", 1))])
+    volumes = plan_volumes(images_dict, VolumeLimits(max_images=3), 5)
+    assert _counts(volumes) == [[("aa", 2)], [("bb", 2), ("cc", 1)]]
+
+
+def test_everything_in_one_volume_when_it_fits(tmp_path, make_image):
+    images_dict = ImageManifest([ImageGroup("aa", _images(make_image, tmp_path, "aa", 3))])
+    assert _counts(plan_volumes(images_dict, VolumeLimits(max_images=3), 5)) == [[("aa", 3)]]
+
+
+def test_large_group_is_divided_evenly_between_rows(tmp_path, make_image):
+    image_paths = _images(make_image, tmp_path, "aa", 7)
+    single = plan_volumes(ImageManifest([ImageGroup("aa", image_paths)]), VolumeLimits(max_images=3), 5)
+    # As many volumes as filling each up needs (3, 3, 1), but evened out
+    assert sorted(len(volume["aa"].image_paths) for volume in single) == [2, 2, 3]
+    assert [path for volume in single for path in volume["aa"].image_paths] == image_paths
+
+    # Two per row, so a row is never split between volumes
+    double = plan_volumes(ImageManifest([ImageGroup("aa", image_paths, "Two Columns")]), VolumeLimits(max_images=3), 5)
+    assert _counts(double) == [[("aa", 2)], [("aa", 2)], [("aa", 3)]]
+
+
+def test_size_limit(tmp_path, make_image):
+    image_paths = _images(make_image, tmp_path, "aa", 4)
+    per_image = os.path.getsize(image_paths[0]) + IMAGE_OVERHEAD_BYTES
+    limits = VolumeLimits(max_bytes=DOCUMENT_BASE_BYTES + 2 * per_image + 16)
+    volumes = plan_volumes(ImageManifest([ImageGroup("aa", image_paths)]), limits, 5,
+                           ImagePrepOptions(dpi=None, cache_dir=None))
+    assert _counts(volumes) == [[("aa", 2)], [("aa", 2)]]
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_split_then_unsplit_build_removes_the_parts(tmp_path, make_image, staged):
+    folder = str(tmp_path / "tc1")
+    _images(make_image, folder, "aa", 3)
+    _images(make_image, folder, "bb", 2)
+    output_file = os.path.join(folder, "tc1.docx")
+
+    def build(volumes):
+        options = dict(image_options=ImagePrepOptions(dpi=None, cache_dir=None), incremental=True, volumes=volumes)
+        images_dict = compile_images(folder, {}, {}, default_layout="Single Column")
+        if not staged:
+            return generate_documents_parallel([(folder, output_file, images_dict)], 5, max_workers=1, **options)
+        with OutputStage(str(tmp_path / "scratch")) as stage:
+            return generate_documents_parallel([(folder, output_file, images_dict)], 5, max_workers=1,
+                                               output_stage=stage, **options)
+
+    summary = build(VolumeLimits(max_images=3))
+    assert [os.path.basename(result.output_file) for result in summary.succeeded] == ["tc1_part1.docx", "tc1_part2.docx"]
+    index = load_manifest(output_file)
+    assert [part['file'] for part in index['index']] == ["tc1_part1.docx", "tc1_part2.docx"]
+    if staged:
+        assert os.listdir(tmp_path / "scratch") == []
+
+    summary = build(None)
+    assert [result.output_file for result in summary.succeeded] == [output_file]
+    assert not os.path.exists(part_file(output_file, 1)) and not os.path.exists(manifest_path(part_file(output_file, 2)))
+    assert 'version' in load_manifest(output_file)
@@ -0,0 +1,37 @@
+import json
+import os
+import re
+
+import pytest
+
+from wordgenerator import folder_jobs, load_manifest, main
+
+
+def test_a_bad_note_fails_only_the_folders_it_applies_to(tmp_path, make_image):
+    make_image(str(tmp_path / "tc1" / "login_1.png"))
+    make_image(str(tmp_path / "tc2" / "home_1.png"))
+    folders = [str(tmp_path / "tc1"), str(tmp_path / "tc2")]
+
+    failed = []
+    jobs = list(folder_jobs(folders, {}, {'login': 12}, "Single Column", failed))
+    assert failed == [folders[0]]
+    assert [(folder, os.path.basename(output_file)) for folder, output_file, _ in jobs] == [(folders[1], "tc2.docx")]
+
+
+@pytest.mark.parametrize("manifest, key", [
+    ({'folders': "tc1"}, "'folders'"),
+    ({'layout': 2}, "'layout'"),
+    ({'max_image_width': "wide"}, "'max_image_width'"),
+    ({'titles': ["dd"]}, "'titles'"),
+    ({'titles': {'dd': "Two Columns"}}, "'titles.dd'"),
+    ({'titles': {'dd': {'layout': None}}}, "'titles.dd.layout'"),
+    ({'titles': {'dd': {'note': 3}}}, "'titles.dd.note'"),
+])
+def test_manifest_entries_of_the_wrong_type_are_named(tmp_path, capsys, manifest, key):
+    path = tmp_path / "batch.json"
+    path.write_text(json.dumps(manifest), encoding='utf-8')
+    with pytest.raises(ValueError, match=re.escape(key)):
+        load_manifest(str(path))
+
+    assert main(["build", "--manifest", str(path), "--log-file", str(tmp_path / "app.log")]) == 2
+    assert key in capsys.readouterr().err
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from fast_decode import DEFAULT_MAX_PIXELS, check_pixels, decode_reduced
+from preferences import CACHE_DIR
+
+THUMBNAIL_SIZE = (100, 100)
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes of decoded thumbnail pixels kept in memory
+DEFAULT_DISK_BUDGET = 256 * 1024 * 1024  # bytes of thumbnail files kept on disk
+
+
+def thumbnail_key(image_path, size=THUMBNAIL_SIZE):
+    # A thumbnail stays valid while the source keeps its path, mtime and size
+    stat = os.stat(image_path)
+    return (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, size)
+
+
+def image_nbytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+class ThumbnailCache:
+    """Two-tier thumbnail cache: an in-memory LRU over a persistent on-disk store.
+
+    get() is safe to call from several threads at once. Sources above max_pixels
+    raise ImageTooLargeError instead of being decoded.
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 disk_dir=os.path.join(CACHE_DIR, "thumbnails"), disk_budget=DEFAULT_DISK_BUDGET,
+                 max_pixels=DEFAULT_MAX_PIXELS):
+        self.size = size
+        self.max_pixels = max_pixels
+        self.memory_budget = memory_budget
+        self.disk_dir = disk_dir
+        self.disk_budget = disk_budget
+        self._memory = OrderedDict()  # key -> thumbnail, least recently used first
+        self._memory_bytes = 0
+        self._disk_bytes = None  # Measured lazily on the first disk write
+        self._lock = threading.Lock()
+
+    def get(self, image_path):
+        """Returns a PIL thumbnail for image_path, decoding the source only on a full miss."""
+        key = thumbnail_key(image_path, self.size)
+
+        with self._lock:
+            img = self._memory.get(key)
+            if img is not None:
+                self._memory.move_to_end(key)
+                return img
+
+        img = self._load_from_disk(key)
+        if img is None:
+            img = self._make_thumbnail(image_path)
+            self._save_to_disk(key, img)
+
+        self._remember(key, img)
+        return img
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def _make_thumbnail(self, image_path):
+        # PIL is imported on first use so creating a cache at startup stays cheap
+        from PIL import Image
+        with Image.open(image_path) as img:
+            check_pixels(img.size, self.max_pixels)  # Header only; nothing decoded yet
+            scale = min(self.size[0] / img.width, self.size[1] / img.height, 1.0)
+            reduced = decode_reduced(img, (img.width * scale, img.height * scale))
+            reduced.thumbnail(self.size)  # Thumbnail for uniform image size
+            # Decoded pixels only; the source file handle is closed on leaving the block
+            return reduced.copy()
+
+    def _remember(self, key, img):
+        nbytes = image_nbytes(img)
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = img
+            self._memory_bytes += nbytes
+            while self._memory_bytes > self.memory_budget and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= image_nbytes(evicted)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.disk_dir, digest[:2], digest + ".png")
+
+    def _load_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        from PIL import Image
+        try:
+            with Image.open(path) as img:
+                img.load()
+                thumbnail = img.copy()
+            os.utime(path)  # Mark as recently used for eviction
+            return thumbnail
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error(f"Error reading cached thumbnail {path}: {e}")
+            return None
+
+    def _save_to_disk(self, key, img):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, format="PNG")
+            os.replace(tmp_path, path)
+            nbytes = os.path.getsize(path)
+        except Exception as e:
+            logging.error(f"Error writing cached thumbnail {path}: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._measure_disk()
+            else:
+                self._disk_bytes += nbytes
+            if self._disk_bytes > self.disk_budget:
+                self._evict_disk()
+
+    def _measure_disk(self):
+        return sum(size for _, _, size in cache_entries(self.disk_dir, (".png",)))
+
+    def _evict_disk(self):
+        self._disk_bytes = prune_cache(self.disk_dir, self.disk_budget, (".png",))
+
+
+def cache_entries(cache_dir, extensions):
+    """Yields (path, mtime, size) for every cached file under cache_dir."""
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(extensions):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+
+def prune_cache(cache_dir, budget, extensions):
+    """Removes the least recently used files until cache_dir is back under 90% of budget.
+
+    Returns the bytes left. Callers mark a file as used by touching its mtime.
+    """
+    target = budget * 0.9
+    entries = sorted(cache_entries(cache_dir, extensions), key=lambda entry: entry[1])
+    total = sum(size for _, _, size in entries)
+    for path, _, size in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            total -= size  # Another process pruned it first
+        except OSError as e:
+            logging.error(f"Error evicting cached file {path}: {e}")
+    return total
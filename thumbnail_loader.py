@@ -0,0 +1,82 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 4
+BATCH_SIZE = 16  # Thumbnails handed to Tk per poll, so one poll never blocks the UI for long
+POLL_MS = 30
+
+
+class ThumbnailLoader:
+    """Decodes thumbnails on a thread pool and delivers them on the Tk thread.
+
+    Workers only touch PIL; the results go through a queue that root.after drains in
+    small batches, where callback(img, error) is called. cancel() drops all pending
+    work, including results that are already queued.
+    """
+
+    def __init__(self, root, cache, max_workers=DEFAULT_WORKERS):
+        self.root = root
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self.results = queue.Queue()
+        self.generation = 0  # Bumped by cancel(); stale work is skipped
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.polling = False
+
+    def request(self, image_path, callback):
+        # The returned future can be cancelled if the thumbnail is no longer needed
+        generation = self.generation
+        future = self.executor.submit(self._load, generation, image_path, callback)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._forget)
+        self._start_polling()
+        return future
+
+    def cancel(self):
+        self.generation += 1
+        with self.lock:
+            pending, self.pending = self.pending, set()
+        for future in pending:
+            future.cancel()
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _forget(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def _load(self, generation, image_path, callback):
+        if generation != self.generation:
+            return
+        try:
+            img = self.cache.get(image_path)
+            self.results.put((generation, callback, img, None))
+        except Exception as e:
+            self.results.put((generation, callback, None, e))
+
+    def _start_polling(self):
+        if not self.polling:
+            self.polling = True
+            self.root.after(POLL_MS, self._drain)
+
+    def _drain(self):
+        for _ in range(BATCH_SIZE):
+            try:
+                generation, callback, img, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                callback(img, error)
+
+        with self.lock:
+            busy = bool(self.pending)
+        if busy or not self.results.empty():
+            self.root.after(POLL_MS, self._drain)
+        else:
+            # Nothing left to deliver; stop polling until the next request
+            self.polling = False
@@ -0,0 +1,249 @@
+"""Splits a folder too large for one document into numbered volumes plus an index.
+
+    tc1/tc1_part1.docx, tc1/tc1_part2.docx, ...   the images, split between title groups
+    tc1/tc1.docx                                  an index linking to each part
+
+Sizes are predicted before anything is built (see cost_scheduler.predict_group),
+so every part is an ordinary job: parts are built side by side on the pool and
+each keeps its own build manifest, so an unchanged part is skipped next time. A
+title group is only divided when it alone is over the limit; two-column groups
+are divided between rows. Parts left over from an earlier, larger split are
+deleted once the folder's document is rebuilt (see remove_stale_parts).
+"""
+import logging
+import os
+import shutil
+from build_manifest import load_manifest, manifest_path, write_manifest
+from cost_scheduler import predict_group
+from docx_xml import hyperlink_xml
+from image_manifest import ImageManifest, PackedPaths
+from instrumentation import count, span
+from output_stage import make_scratch_dir
+
+# What a .docx holds besides its images (styles, settings, ...), and per picture (XML, relationship)
+DOCUMENT_BASE_BYTES = 40 << 10
+IMAGE_OVERHEAD_BYTES = 1 << 10
+
+
+class VolumeLimits:
+    """Caps on one volume: its predicted size in bytes and/or its number of images (None = no cap)."""
+
+    def __init__(self, max_bytes=None, max_images=None):
+        if max_bytes is None and max_images is None:
+            raise ValueError("volumes need a size or image limit")
+        self.max_bytes = max_bytes
+        self.max_images = max_images
+
+    def fill(self, size, images):
+        # How full a volume of this size would be; over 1.0 is over a limit
+        return max(size / self.max_bytes if self.max_bytes else 0.0,
+                   images / self.max_images if self.max_images else 0.0)
+
+    def fits(self, size, images):
+        return self.fill(size, images) <= 1.0
+
+
+def part_file(output_file, number):
+    base, extension = os.path.splitext(output_file)
+    return f"{base}_part{number}{extension}"
+
+
+def _slice(image_paths, start, stop):
+    # Parts of a PackedPaths stay packed
+    if isinstance(image_paths, PackedPaths):
+        return PackedPaths(image_paths.folder, [image_paths.name(i) for i in range(start, stop)])
+    return list(image_paths[start:stop])
+
+
+def _split_rows(rows, limits):
+    """Divides (size, images) rows into as few volumes as greedy filling needs, as evenly as
+    possible; returns (first row, end row) pairs."""
+    sizes, images = [0], [0]
+    for row_size, row_images in rows:
+        sizes.append(sizes[-1] + row_size)
+        images.append(images[-1] + row_images)
+
+    def fill(start, end):
+        return limits.fill(DOCUMENT_BASE_BYTES + sizes[end] - sizes[start], images[end] - images[start])
+
+    greedy = []
+    start = 0
+    for end in range(1, len(rows)):
+        if fill(start, end + 1) > 1.0:
+            greedy.append((start, end))
+            start = end
+    greedy.append((start, len(rows)))
+    if len(greedy) == 1:
+        return greedy
+
+    # As many volumes, each taking rows while that brings it closer to an even share of what is left
+    chunks = []
+    start = 0
+    for left in range(len(greedy), 1, -1):
+        share = fill(start, len(rows)) / left
+        end = start + 1
+        while (end < len(rows) and fill(start, end + 1) <= 1.0
+               and fill(start, end + 1) - share < share - fill(start, end)):
+            end += 1
+        chunks.append((start, end))
+        start = end
+    if start == len(rows) or fill(start, len(rows)) > 1.0:
+        return greedy  # Evening out did not work out; greedy always does
+    chunks.append((start, len(rows)))
+    return chunks
+
+
+def plan_volumes(images_dict, limits, max_image_width, image_options=None, max_image_height=4):
+    """Returns the ImageManifest of each volume, in order; a single one if everything fits."""
+    volumes = []
+    current = ImageManifest()
+    size, images = DOCUMENT_BASE_BYTES, 0
+
+    for group in images_dict.values():
+        _, embedded, _, _ = predict_group(group, max_image_width, image_options, max_image_height)
+        group_size = sum(embedded) + IMAGE_OVERHEAD_BYTES * len(embedded)
+
+        if len(current) and not limits.fits(size + group_size, images + len(embedded)):
+            volumes.append(current)
+            current = ImageManifest()
+            size, images = DOCUMENT_BASE_BYTES, 0
+        if limits.fits(size + group_size, images + len(embedded)):
+            current.add(group)
+            size += group_size
+            images += len(embedded)
+            continue
+
+        # Too large for any volume of its own: divided between rows, and every part keeps the title
+        step = 2 if group.two_columns else 1
+        rows = []
+        for i in range(0, len(embedded), step):
+            row = embedded[i:i + step]
+            rows.append((sum(row) + IMAGE_OVERHEAD_BYTES * len(row), len(row)))
+        chunks = _split_rows(rows, limits)
+        for start, stop in chunks[:-1]:
+            current.add(group.replace(image_paths=_slice(group.image_paths, start * step, stop * step)))
+            volumes.append(current)
+            current = ImageManifest()
+        start = chunks[-1][0]
+        current.add(group.replace(image_paths=_slice(group.image_paths, start * step, len(embedded))))
+        size = DOCUMENT_BASE_BYTES + sum(row_size for row_size, _ in rows[start:])
+        images = sum(row_images for _, row_images in rows[start:])
+
+    if len(current) or not volumes:
+        volumes.append(current)
+    return volumes
+
+
+def _describe(parts):
+    # What the index shows, which is also what decides whether it has to be written again
+    return [{'file': os.path.basename(part),
+             'groups': [[group.title, len(group.image_paths)] for group in volume.values()]}
+            for part, volume in parts]
+
+
+def index_up_to_date(index_file, parts):
+    manifest = load_manifest(index_file)
+    if manifest is None or manifest.get('index') != _describe(parts):
+        return False
+    try:
+        stat = os.stat(index_file)
+    except FileNotFoundError:
+        return False
+    return manifest.get('output') == {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def write_index(index_file, parts, target=None):
+    """Writes the index document for index_file, linking to each (part file, ImageManifest) in parts.
+
+    It is saved to target (index_file itself by default); returns the build to
+    record in index_file's manifest. That holds no build 'version', so a later
+    unsplit build of the folder never mistakes the index for an up-to-date document.
+    """
+    # Imported here: python-docx is only needed once a folder is actually split
+    from docx import Document
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    from bulk_docx import BulkDocxWriter
+    from docx_xml import heading_xml, paragraph_xml
+    from document_generator import save_document
+
+    description = _describe(parts)
+    total = sum(count for part in description for _, count in part['groups'])
+    doc = Document()
+    writer = BulkDocxWriter(doc)
+    name = os.path.splitext(os.path.basename(index_file))[0]
+    fragments = [heading_xml(name, 1), paragraph_xml(f"{total} image(s) in {len(parts)} parts.")]
+    for part in description:
+        # Relative links, so the folder can be moved or shared as a whole
+        rel_id = doc.part.relate_to(part['file'], RT.HYPERLINK, is_external=True)
+        images = sum(count for _, count in part['groups'])
+        fragments.append(f'<w:p><w:pPr><w:pStyle w:val="Heading2"/></w:pPr>{hyperlink_xml(rel_id, part["file"])}'
+                         f'<w:r><w:t xml:space="preserve"> ({images} image(s))</w:t></w:r></w:p>')
+        fragments.extend(paragraph_xml(f"{title}: {count} image(s)", "ListBullet") for title, count in part['groups'])
+    writer.write_xml(fragments)
+
+    with span("volume_index", output=index_file):
+        save_document(doc, target or index_file)
+    return {'index': description}
+
+
+def _publish_index(index_file, parts, output_stage):
+    # Built in scratch space and moved into place by the stage, like any other document
+    from parallel_generator import FolderResult  # parallel_generator imports this module
+    scratch_dir = make_scratch_dir(output_stage.scratch_dir)
+    staged_file = os.path.join(scratch_dir, os.path.basename(index_file))
+    try:
+        build = write_index(index_file, parts, staged_file)
+    except BaseException:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        raise
+    result = FolderResult(os.path.dirname(index_file), index_file, True, 0.0)
+    result.staged_file, result.build = staged_file, build
+    output_stage.publish(result)  # Failures are logged by the stage
+
+
+def remove_stale_parts(output_file, first=1):
+    """Deletes part files numbered first and up that an earlier, larger split left behind.
+
+    Only parts with a build manifest are touched, i.e. ones this program wrote.
+    """
+    number = first
+    while os.path.exists(manifest_path(part_file(output_file, number))):
+        part = part_file(output_file, number)
+        for path in (part, manifest_path(part)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Error removing old volume {path}: {e}")
+        number += 1
+
+
+def volume_jobs(jobs, limits, max_image_width, image_options=None, max_image_height=4, output_stage=None):
+    """Yields (folder, output_file, images_dict) jobs with each folder over limits split into parts.
+
+    A split folder's output_file becomes its index, which is written here, before
+    the parts are built, so it links to where they are about to be. With an
+    output_stage it is built in scratch space and published by the stage.
+    """
+    for folder, output_file, images_dict in jobs:
+        with span("volume_plan", folder=folder):
+            volumes = plan_volumes(images_dict, limits, max_image_width, image_options, max_image_height)
+        if len(volumes) == 1:
+            yield folder, output_file, images_dict
+            continue
+
+        count("folders_split")
+        parts = [(part_file(output_file, number), volume) for number, volume in enumerate(volumes, 1)]
+        remove_stale_parts(output_file, len(parts) + 1)
+        if not index_up_to_date(output_file, parts):
+            try:
+                if output_stage is not None:
+                    _publish_index(output_file, parts, output_stage)
+                else:
+                    write_manifest(output_file, write_index(output_file, parts))
+            except Exception as e:
+                # The parts are still worth building without their index
+                logging.error(f"Error writing volume index {output_file}: {e}")
+        for part, volume in parts:
+            yield folder, part, volume
@@ -0,0 +1,376 @@
+"""Headless command-line entry point.
+
+    python -m wordgenerator build FOLDER [FOLDER ...] [--layout two] [--max-width 5]
+    python -m wordgenerator build --manifest batch.json
+    python -m wordgenerator build --recursive D:/archive --exclude "thumbs*"
+    python -m wordgenerator build D:/scans --volume-size 200
+    python -m wordgenerator watch D:/captures --append
+    python -m wordgenerator serve --port 8765
+
+Nothing in this module (or anything it imports) may import tkinter, so it can run
+on machines without a display server.
+"""
+import argparse
+import json
+import os
+import sys
+from cost_scheduler import DEFAULT_MEMORY_FRACTION, default_memory_budget
+from folder_discovery import discover_image_folders
+from folder_watcher import DEFAULT_DEBOUNCE, DEFAULT_MAX_DELAY, DEFAULT_POLL_INTERVAL
+from image_grouping import IMAGE_TYPES, LAYOUTS, compile_images
+from dedupe import DEDUPE_MODES, DEFAULT_THRESHOLD, DedupeOptions
+from fast_decode import DEFAULT_MAX_PIXELS
+from image_prep import DEFAULT_DPI, DEFAULT_JPEG_QUALITY, RECOMPRESS_FORMATS, ImagePrepOptions
+from output_stage import DEFAULT_SCRATCH_DIR, OutputStage
+from parallel_generator import duplicate_lines, generate_documents_parallel
+from volumes import VolumeLimits
+import instrumentation
+
+LAYOUT_ALIASES = {
+    'single': "Single Column",
+    'one': "Single Column",
+    'two': "Two Columns",
+}
+
+DEFAULT_MAX_IMAGE_WIDTH = 5
+
+
+def parse_layout(value):
+    layout = LAYOUT_ALIASES.get(value.lower(), value)
+    if layout not in LAYOUTS:
+        raise argparse.ArgumentTypeError(f"unknown layout '{value}' (use single or two)")
+    return layout
+
+
+def parse_title_option(value):
+    # TITLE=VALUE pairs for per-title layouts and notes
+    title, sep, text = value.partition('=')
+    if not sep or not title:
+        raise argparse.ArgumentTypeError(f"expected TITLE=VALUE, got '{value}'")
+    return title, text
+
+
+def load_manifest(path):
+    """Reads a JSON batch manifest.
+
+    {
+        "folders": ["D:/captures/tc1", "D:/captures/tc2"],
+        "max_image_width": 5,
+        "layout": "Single Column",
+        "dpi": 200,
+        "recompress": "jpeg",
+        "jpeg_quality": 85,
+        "dedupe": "drop",
+        "dedupe_threshold": 8,
+        "titles": {"dd": {"layout": "Two Columns", "note": "Login flow"}}
+    }
+    """
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict):
+        raise ValueError(f"{path}: manifest must be a JSON object")
+    check_manifest(path, manifest)
+    return manifest
+
+
+def check_manifest(path, manifest):
+    # Raises ValueError naming the first entry of the wrong type, instead of failing somewhere later
+    def expect(key, value, valid, expected):
+        if not valid:
+            raise ValueError(f"{path}: '{key}' must be {expected}, got {json.dumps(value)}")
+
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    folders = manifest.get('folders', [])
+    expect('folders', folders, isinstance(folders, list) and all(isinstance(folder, str) for folder in folders),
+           "a list of paths")
+    for key in ('layout', 'recompress', 'dedupe'):
+        if key in manifest:
+            expect(key, manifest[key], isinstance(manifest[key], str), "a string")
+    for key in ('max_image_width', 'dpi', 'jpeg_quality', 'dedupe_threshold'):
+        if key in manifest:
+            expect(key, manifest[key], is_number(manifest[key]) or (key == 'dpi' and manifest[key] is None), "a number")
+
+    titles = manifest.get('titles', {})
+    expect('titles', titles, isinstance(titles, dict), "an object of title: options")
+    for title, options in titles.items():
+        expect(f"titles.{title}", options, isinstance(options, dict), 'an object like {"layout": ..., "note": ...}')
+        for key in ('layout', 'note'):
+            if key in options:
+                expect(f"titles.{title}.{key}", options[key], isinstance(options[key], str), "a string")
+
+
+def build_settings(args):
+    # Flags override anything given in the manifest
+    manifest = load_manifest(args.manifest) if args.manifest else {}
+
+    folders = list(manifest.get('folders', [])) + list(args.folders)
+    default_layout = args.layout or parse_layout(manifest.get('layout', "Single Column"))
+    max_image_width = args.max_width if args.max_width is not None else float(manifest.get('max_image_width', DEFAULT_MAX_IMAGE_WIDTH))
+
+    layouts = {}
+    notes = {}
+    for title, options in manifest.get('titles', {}).items():
+        if 'layout' in options:
+            layouts[title] = parse_layout(options['layout'])
+        if 'note' in options:
+            notes[title] = options['note']
+    for title, layout in args.title_layout:
+        layouts[title] = parse_layout(layout)
+    for title, note in args.note:
+        notes[title] = note
+
+    dpi = args.dpi if args.dpi is not None else manifest.get('dpi', DEFAULT_DPI)
+    image_options = ImagePrepOptions(
+        dpi=dpi or None,  # 0 embeds the original files
+        recompress=args.recompress or manifest.get('recompress'),
+        jpeg_quality=args.jpeg_quality if args.jpeg_quality is not None else manifest.get('jpeg_quality', DEFAULT_JPEG_QUALITY),
+    )
+    if args.no_image_cache:
+        image_options.cache_dir = None
+    if args.max_megapixels is not None:
+        image_options.max_pixels = int(args.max_megapixels * 1_000_000) or None  # 0 disables the limit
+
+    dedupe = DedupeOptions(args.dedupe or manifest.get('dedupe', 'off'),
+                           args.dedupe_threshold if args.dedupe_threshold is not None
+                           else int(manifest.get('dedupe_threshold', DEFAULT_THRESHOLD)))
+    if args.no_image_cache:
+        dedupe.cache_file = None
+
+    return folders, default_layout, layouts, notes, max_image_width, image_options, dedupe
+
+
+def print_progress(result):
+    if result.skipped:
+        print(f"[skip]   {result.output_file} is up to date", flush=True)
+    elif result.ok:
+        found = f", {len(result.duplicates)} duplicate image(s)" if result.duplicates else ""
+        found += ", target was open so it was saved under a new name" if result.versioned else ""
+        status = "[append]" if result.appended else "[ok]    "
+        print(f"{status} {result.output_file} ({result.elapsed:.1f}s{found})", flush=True)
+        for line in duplicate_lines(result):
+            print(line, flush=True)
+    else:
+        print(f"[failed] {result.folder}: {result.error}", flush=True)
+
+
+def folder_jobs(folders, layouts, notes, default_layout, failed, index=None):
+    # (folder, output_file, images_dict) for generate_documents_parallel; unreadable folders go to failed
+    for folder in folders:
+        try:
+            images_dict = compile_images(folder, layouts, notes, IMAGE_TYPES, default_layout, index=index)
+        except (OSError, TypeError, ValueError) as e:
+            # TypeError/ValueError: a note or layout from the manifest that is not a string
+            print(f"[failed] {folder}: {e}", flush=True)
+            failed.append(folder)
+            continue
+
+        output_file = os.path.join(folder, f"{os.path.basename(os.path.normpath(folder))}.docx")
+        yield folder, output_file, images_dict
+
+
+def run_build(args):
+    instrumentation.configure(args.log_file, trace_file=args.trace)
+
+    try:
+        folders, default_layout, layouts, notes, max_image_width, image_options, dedupe = build_settings(args)
+    except (OSError, ValueError, argparse.ArgumentTypeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    if not folders:
+        print("error: no folders given", file=sys.stderr)
+        return 2
+
+    if args.recursive:
+        # Folders are built as discovery finds them, while the rest of the tree is still being walked
+        print(f"Building every image folder under {len(folders)} root(s)...", flush=True)
+        folders = discover_image_folders(folders, IMAGE_TYPES, args.include, args.exclude)
+    else:
+        print(f"Building {len(folders)} document(s)...", flush=True)
+
+    failed = []
+    # A locked output is retried, then versioned (or fails the folder with --direct)
+    output_stage = None if args.direct else OutputStage(args.scratch_dir or DEFAULT_SCRATCH_DIR)
+    try:
+        summary = generate_documents_parallel(folder_jobs(folders, layouts, notes, default_layout, failed),
+                                              max_image_width, args.workers, on_result=print_progress,
+                                              incremental=not args.force, hash_contents=args.hash,
+                                              metrics_file=args.metrics, output_stage=output_stage,
+                                              append=args.append and not args.force,
+                                              memory_budget=memory_budget(args), largest_first=not args.in_order,
+                                              volumes=volume_limits(args), image_options=image_options,
+                                              streaming=args.streaming, dedupe=dedupe)
+    finally:
+        if output_stage is not None:
+            output_stage.shutdown()
+    print(summary.report(), flush=True)
+
+    return 1 if failed or summary.failed else 0
+
+
+def run_watch(args):
+    instrumentation.configure(args.log_file, trace_file=args.trace)
+    from folder_index import FolderIndex
+    from folder_watcher import watch_folders
+    from preferences import CACHE_DIR
+
+    try:
+        roots, default_layout, layouts, notes, max_image_width, image_options, dedupe = build_settings(args)
+    except (OSError, ValueError, argparse.ArgumentTypeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    if not roots:
+        print("error: no folders given", file=sys.stderr)
+        return 2
+
+    scratch_dir = args.scratch_dir or DEFAULT_SCRATCH_DIR
+    output_stage = None if args.direct else OutputStage(scratch_dir)
+    index = FolderIndex(IMAGE_TYPES)  # Kept across batches, so only changed folders are listed again
+
+    def build(folders):
+        failed = []
+        summary = generate_documents_parallel(folder_jobs(folders, layouts, notes, default_layout, failed, index),
+                                              max_image_width, args.workers, on_result=print_progress,
+                                              incremental=True, hash_contents=args.hash,
+                                              metrics_file=args.metrics, output_stage=output_stage,
+                                              append=args.append, memory_budget=memory_budget(args),
+                                              largest_first=not args.in_order, volumes=volume_limits(args),
+                                              image_options=image_options, streaming=args.streaming, dedupe=dedupe)
+        print(summary.headline(), flush=True)
+
+    print(f"Watching {len(roots)} root(s) for new images (Ctrl+C to stop)...", flush=True)
+    try:
+        watch_folders(roots, build, args.include, args.exclude, ignore_dirs=[CACHE_DIR, scratch_dir],
+                      debounce=args.debounce, max_delay=args.max_delay, use_inotify=not args.poll,
+                      poll_interval=args.poll_interval, initial_build=not args.no_initial_build)
+    except KeyboardInterrupt:
+        print("Stopped watching.", flush=True)
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if output_stage is not None:
+            output_stage.shutdown()
+    return 0
+
+
+def run_serve(args):
+    instrumentation.configure(args.log_file)
+    # Imported here: the service module imports this one for its defaults
+    from generation_service import serve
+    try:
+        serve(args.host, args.port, args.workers, args.queue_size)
+    except OSError as e:
+        print(f"error: cannot listen on {args.host}:{args.port}: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+def add_document_options(parser):
+    # Options shared by build and watch: what goes into the documents and how they are written
+    parser.add_argument('--manifest', help="JSON file with folders, layouts, notes and max width")
+    parser.add_argument('--layout', type=parse_layout, help="default layout for every title: single or two")
+    parser.add_argument('--title-layout', type=parse_title_option, action='append', default=[], metavar='TITLE=LAYOUT',
+                        help="layout for one title group (repeatable)")
+    parser.add_argument('--note', type=parse_title_option, action='append', default=[], metavar='TITLE=TEXT',
+                        help="note added under one title group (repeatable)")
+    parser.add_argument('--max-width', type=float, help=f"maximum image width in inches (default {DEFAULT_MAX_IMAGE_WIDTH})")
+    parser.add_argument('--dpi', type=int, help=f"resample images to this DPI at their printed size, 0 to embed originals (default {DEFAULT_DPI})")
+    parser.add_argument('--recompress', choices=RECOMPRESS_FORMATS, help="re-encode embedded images as JPEG or optimized PNG")
+    parser.add_argument('--jpeg-quality', type=int, help=f"JPEG quality used with --recompress jpeg (default {DEFAULT_JPEG_QUALITY})")
+    parser.add_argument('--max-megapixels', type=float,
+                        help=f"skip images larger than this instead of decoding them, 0 for no limit (default {DEFAULT_MAX_PIXELS / 1_000_000:g})")
+    parser.add_argument('--dedupe', choices=DEDUPE_MODES,
+                        help="report (flag) or leave out (drop) repeated and near-identical images within a title group (default off)")
+    parser.add_argument('--dedupe-threshold', type=int, metavar='BITS',
+                        help=f"how many of 64 perceptual hash bits may differ for images to count as duplicates (default {DEFAULT_THRESHOLD})")
+    parser.add_argument('--no-image-cache', action='store_true', help="do not read or write the prepared-image and image-hash caches")
+    parser.add_argument('--streaming', action='store_true', help="write each .docx incrementally with bounded memory (for very large folders)")
+    parser.add_argument('--scratch-dir', metavar='DIR',
+                        help=f"local folder documents are built in before being copied to their destination (default {DEFAULT_SCRATCH_DIR})")
+    parser.add_argument('--direct', action='store_true', help="write each .docx straight to its destination, without scratch space")
+    parser.add_argument('--append', action='store_true',
+                        help="add images that are new since the last build to the existing document instead of rebuilding it, where nothing else changed")
+    parser.add_argument('--hash', action='store_true', help="record image content hashes so touched but unchanged files are not rebuilt")
+    parser.add_argument('--log-file', help="append errors to this file instead of stderr")
+    parser.add_argument('--trace', metavar='FILE', help="write per-image/folder/batch timing spans as JSON lines")
+    parser.add_argument('--metrics', metavar='FILE', help="write batch counters and span totals in Prometheus text format")
+    parser.add_argument('--workers', type=int, help="worker processes (default: CPU count)")
+    parser.add_argument('--memory-budget', type=float, metavar='GB',
+                        help="only start a folder once its estimated memory fits beside the running ones, 0 for no limit "
+                             f"(default {DEFAULT_MEMORY_FRACTION:.0%} of physical memory)")
+    parser.add_argument('--in-order', action='store_true', help="build folders in the order given instead of largest first")
+    parser.add_argument('--volume-size', type=float, metavar='MB',
+                        help="split folders whose document would be larger than this into _partN volumes plus an index")
+    parser.add_argument('--volume-images', type=int, metavar='N',
+                        help="split folders with more images than this into _partN volumes plus an index")
+
+
+def memory_budget(args):
+    # Bytes, or None for no limit
+    if args.memory_budget is None:
+        return default_memory_budget()
+    return int(args.memory_budget * (1 << 30)) or None
+
+
+def volume_limits(args):
+    if not args.volume_size and not args.volume_images:
+        return None
+    return VolumeLimits(int(args.volume_size * (1 << 20)) if args.volume_size else None, args.volume_images or None)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="wordgenerator", description="Generate Word documents from image folders.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="generate one .docx per folder")
+    build.add_argument('folders', nargs='*', help="folders containing images")
+    build.add_argument('--recursive', action='store_true', help="treat folders as roots and build every folder below them that holds images")
+    build.add_argument('--include', action='append', default=[], metavar='GLOB',
+                       help="with --recursive, only build folders whose name or relative path matches (repeatable)")
+    build.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                       help="with --recursive, skip folders (and everything below them) that match (repeatable)")
+    add_document_options(build)
+    build.add_argument('--force', action='store_true', help="rebuild every folder, even if its document is up to date")
+    build.set_defaults(func=run_build)
+
+    watch = subparsers.add_parser('watch', help="keep documents up to date as images are added under some folders")
+    watch.add_argument('folders', nargs='*', metavar='root', help="folders to watch, with everything below them")
+    watch.add_argument('--include', action='append', default=[], metavar='GLOB',
+                       help="only build folders whose name or relative path matches (repeatable)")
+    watch.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                       help="skip folders (and everything below them) that match (repeatable)")
+    watch.add_argument('--debounce', type=float, default=DEFAULT_DEBOUNCE,
+                       help=f"seconds a folder must be quiet before it is rebuilt (default {DEFAULT_DEBOUNCE:g})")
+    watch.add_argument('--max-delay', type=float, default=DEFAULT_MAX_DELAY,
+                       help=f"longest a folder that keeps changing waits for a rebuild (default {DEFAULT_MAX_DELAY:g})")
+    watch.add_argument('--poll', action='store_true', help="poll folder modification times instead of using inotify")
+    watch.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                       help=f"seconds between polls when polling (default {DEFAULT_POLL_INTERVAL:g})")
+    watch.add_argument('--no-initial-build', action='store_true',
+                       help="do not bring every folder up to date on start, only react to changes")
+    add_document_options(watch)
+    watch.set_defaults(func=run_watch)
+
+    serve = subparsers.add_parser('serve', help="build documents for other tools over local HTTP")
+    serve.add_argument('--host', default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+    serve.add_argument('--port', type=int, default=8765, help="port to listen on (default 8765)")
+    serve.add_argument('--workers', type=int, help="worker processes (default: CPU count)")
+    serve.add_argument('--queue-size', type=int, default=16,
+                       help="jobs accepted beyond the busy workers before answering 503 (default 16)")
+    serve.add_argument('--log-file', help="append errors to this file instead of stderr")
+    serve.set_defaults(func=run_serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())